@@ -1,5 +1,4 @@
 import os
-import glob
 import json
 import configparser
 import logging
@@ -7,7 +6,7 @@ import shutil
 import markdown
 from datetime import datetime
 
-from fastapi import FastAPI, HTTPException, Body, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Body, UploadFile, File, Form, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles 
 from fastapi.responses import FileResponse
@@ -17,9 +16,12 @@ from typing import List, Dict, Any, Optional
 import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from modules import state_manager
+from modules import report_index
+from modules import config_service
 from modules.report_generator import slugify
 from modules.utils import file_lock, verify_safe_path
-from modules.log_reader import count_file_lines
+from modules.log_reader import count_log_lines
+from modules.log_formats import FORMATS as LOG_FORMATS
 
 # --- config ---
 CONFIG_FILE = "config.ini"
@@ -48,7 +50,8 @@ def get_active_config_file(test_mode: bool) -> str:
 def get_system_settings_path(test_mode: bool = False) -> str:
     return TEST_SYSTEM_SETTINGS_FILE if test_mode else SYSTEM_SETTINGS_FILE
 
-def get_system_config_parser(test_mode: bool = False) -> configparser.ConfigParser:
+def get_system_config_parser(test_mode: bool = False, writable: bool = False) -> configparser.ConfigParser:
+    """Mac dinh tra ve parser cua snapshot dung chung (chi doc, ghi -> TypeError); writable=True -> parse moi de sua va ghi."""
     config_path = get_system_settings_path(test_mode)
     config = configparser.ConfigParser(interpolation=None, allow_no_value=True)
     
@@ -56,10 +59,16 @@ def get_system_config_parser(test_mode: bool = False) -> configparser.ConfigPars
         with file_lock(config_path):
             config.add_section('System')
             with open(config_path, 'w', encoding='utf-8') as f: config.write(f)
-            
+
+    if not writable:
+        return config_service.load(config_path, allow_no_value=True).parser
     config.read(config_path, encoding='utf-8')
     return config
 
+def get_host_config_parser(test_mode: bool = False) -> configparser.ConfigParser:
+    """Parser config.ini tu snapshot dung chung (chi doc, ghi -> TypeError; nap lai khi file doi)."""
+    return config_service.load(get_active_config_file(test_mode)).parser
+
 # --- Pydantic Models ---
 class PipelineSubStage(BaseModel):
     name: str = "Worker"
@@ -94,6 +103,10 @@ class HostStatus(BaseModel):
     is_enabled: bool
     last_run: Optional[str] = None
     stages_count: int = 0
+    backlog: bool = False
+    backlog_lines: int = 0
+    backlog_bytes: int = 0
+    backlog_eta_seconds: Optional[int] = None
 
 class ReportInfo(BaseModel):
     filename: str
@@ -120,6 +133,13 @@ class SystemSettings(BaseModel):
     active_smtp_profile: Optional[str] = None
     attach_context_files: bool = False
     scheduler_check_interval_seconds: int = 60
+    scheduler_max_parallel_hosts: int = 4
+    backlog_max_batches_per_cycle: int = 5
+    backlog_max_api_calls_per_cycle: int = 0
+    backlog_max_tokens_per_cycle: int = 0
+    max_concurrent_requests: int = 0
+    reduce_token_budget: int = 200000
+    analysis_engine: str = 'thread'
     gemini_profiles: Dict[str, str] = {} 
     
 class HostConfig(BaseModel):
@@ -131,6 +151,14 @@ class HostConfig(BaseModel):
     geminiapikey: str
     networkdiagram: str
     chunk_size: Optional[int] = 8000
+    parallel_read_threshold_mb: Optional[int] = 1024
+    log_format: Optional[str] = 'auto'
+    template_mining: Optional[bool] = False
+    local_stats: Optional[bool] = False
+    chunk_token_budget: Optional[int] = 0
+    exact_token_count: Optional[bool] = False
+    max_concurrency: Optional[int] = 5
+    worker_assignment: Optional[str] = 'least_load'
     smtp_profile: Optional[str] = ''
     context_files: List[str] = []
     pipeline: List[PipelineStage] = []
@@ -143,6 +171,10 @@ class HostConfig(BaseModel):
             raise ValueError("Hostname contains invalid characters (newline).")
         return v.strip()
 
+class AnalyzeWindowRequest(BaseModel):
+    start: datetime
+    end: datetime
+
 class PromptFile(BaseModel):
     filename: str
     content: str
@@ -154,14 +186,14 @@ def get_host_id(hostname: str) -> str:
 def config_to_dict(config: configparser.ConfigParser, section: str) -> dict:
     if not config.has_section(section): return {}
     config_dict = dict(config.items(section))
-    standard_keys = ['syshostname', 'logfile', 'hourstoanalyze', 'timezone', 'run_interval_seconds', 'geminiapikey', 'networkdiagram', 'enabled', 'smtp_profile', 'pipeline_config', 'chunk_size']
+    standard_keys = ['syshostname', 'logfile', 'hourstoanalyze', 'timezone', 'run_interval_seconds', 'geminiapikey', 'networkdiagram', 'enabled', 'smtp_profile', 'pipeline_config', 'chunk_size', 'parallel_read_threshold_mb', 'log_format', 'template_mining', 'local_stats', 'chunk_token_budget', 'exact_token_count', 'max_concurrency', 'worker_assignment']
     other_context = [config.get(section, key) for key in config.options(section) if key not in standard_keys and not key.startswith('context_file_')]
     explicit_context = [config.get(section, k) for k in config.options(section) if k.startswith('context_file_')]
     config_dict['context_files'] = other_context + explicit_context
     pipeline_json = config.get(section, 'pipeline_config', fallback='[]')
     try: config_dict['pipeline'] = json.loads(pipeline_json)
     except: config_dict['pipeline'] = []
-    for key in ['run_interval_seconds', 'hourstoanalyze', 'chunk_size']:
+    for key in ['run_interval_seconds', 'hourstoanalyze', 'chunk_size', 'parallel_read_threshold_mb', 'chunk_token_budget', 'max_concurrency']:
         if key in config_dict:
              try: config_dict[key] = int(config_dict[key])
              except: config_dict[key] = 8000 if key == 'chunk_size' else 0
@@ -170,8 +202,7 @@ def config_to_dict(config: configparser.ConfigParser, section: str) -> dict:
 # --- API Endpoints ---
 @app.get("/api/dashboard-stats", response_model=Dict[str, Any])
 async def get_dashboard_stats(test_mode: bool = False):
-    config = configparser.ConfigParser(interpolation=None)
-    config.read(get_active_config_file(test_mode), encoding='utf-8')
+    config = get_host_config_parser(test_mode)
     system_settings = get_system_config_parser(test_mode)
     report_dir = system_settings.get('System', 'report_directory', fallback='test_reports' if test_mode else 'reports')
 
@@ -182,23 +213,12 @@ async def get_dashboard_stats(test_mode: bool = False):
         if section.startswith(('Firewall_', 'Host_')):
             if config.getboolean(section, 'enabled', fallback=True):
                 log_file = config.get(section, 'LogFile', fallback='')
-                if log_file and os.path.exists(log_file):
-                    total_raw += count_file_lines(log_file)
+                if log_file:
+                    total_raw += count_log_lines(log_file)
 
     if os.path.isdir(report_dir):
-        files = glob.glob(os.path.join(report_dir, '*', '**', '*.json'), recursive=True)
-        for r_path in files:
-            try:
-                with open(r_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if data.get('stage_index') == 0:
-                        # // [FIX] Lay raw_log_count tu root JSON, hoac tu summary_stats
-                        count = data.get('raw_log_count', 0)
-                        if not count and 'summary_stats' in data:
-                             count = data['summary_stats'].get('raw_log_count', 0)
-                        
-                        total_analyzed += int(count) if count else 0
-            except: pass
+        try: total_analyzed = int(report_index.total_raw_log_count(report_dir, stage_index=0))
+        except Exception as e: logging.error(f"Report index error: {e}")
 
     api_stats = state_manager.get_api_usage_stats(test_mode)
     
@@ -206,25 +226,40 @@ async def get_dashboard_stats(test_mode: bool = False):
         "total_raw_logs": total_raw,
         "total_analyzed_logs": total_analyzed,
         "total_api_calls": api_stats.get("total", 0),
-        "api_usage_breakdown": api_stats.get("breakdown", {})
+        "api_usage_breakdown": api_stats.get("breakdown", {}),
+        "api_key_health": api_stats.get("key_health", {})
     }
 
+@app.get("/api/scheduler-metrics", response_model=Dict[str, Any])
+async def get_scheduler_metrics(test_mode: bool = False):
+    """Do tre lich chay theo host (lateness_seconds, max/avg, next_due...) do scheduler cua main.py ghi."""
+    return state_manager.get_scheduler_metrics(test_mode) or {}
+
+@app.get("/api/rate-limits", response_model=Dict[str, Any])
+async def get_rate_limits(test_mode: bool = False):
+    """Thoi gian cho slot rate limiter theo key alias / model (calls, queued_calls, avg/max_wait_seconds)."""
+    return state_manager.get_rate_limits(test_mode).get("metrics", {})
+
 @app.get("/api/status", response_model=List[HostStatus])
 async def get_host_status(test_mode: bool = False):
     try:
-        config = configparser.ConfigParser(interpolation=None)
-        config.read(get_active_config_file(test_mode), encoding='utf-8')
+        config = get_host_config_parser(test_mode)
         host_sections = [s for s in config.sections() if s.startswith(('Firewall_', 'Host_'))]
         status_list = []
         for section in host_sections:
             last_run_ts = state_manager.get_last_cycle_run_timestamp(section, test_mode)
             is_enabled = config.getboolean(section, 'enabled', fallback=True)
-            pipeline = json.loads(config.get(section, 'pipeline_config', fallback='[]'))
+            pipeline = config_service.host_pipeline(config, section)
+            backlog = state_manager.get_backlog_status(section, test_mode) or {}
             status_list.append(HostStatus(
                 id=section, hostname=config.get(section, 'SysHostname', fallback='N/A'),
                 status="Online" if is_enabled else "Disabled", is_enabled=is_enabled,
                 last_run=last_run_ts.isoformat() if last_run_ts else "Never",
-                stages_count=len(pipeline)
+                stages_count=len(pipeline),
+                backlog=backlog.get('has_backlog', False),
+                backlog_lines=backlog.get('remaining_lines', 0),
+                backlog_bytes=backlog.get('remaining_bytes', 0),
+                backlog_eta_seconds=backlog.get('eta_seconds')
             ))
         return status_list
     except Exception as e: raise HTTPException(500, detail=str(e))
@@ -245,8 +280,7 @@ async def toggle_host_status(host_id: str, test_mode: bool = False):
 
 @app.get("/api/hosts/{host_id}", response_model=Dict)
 async def get_host_details(host_id: str, test_mode: bool = False):
-    config = configparser.ConfigParser(interpolation=None)
-    config.read(get_active_config_file(test_mode), encoding='utf-8')
+    config = get_host_config_parser(test_mode)
     if not config.has_section(host_id): raise HTTPException(404)
     return config_to_dict(config, host_id)
 
@@ -312,6 +346,19 @@ async def delete_host(host_id: str, test_mode: bool = False):
         return {"status": "deleted"}
     except TimeoutError: raise HTTPException(503)
 
+@app.post("/api/hosts/{host_id}/analyze-window", response_model=Dict)
+async def analyze_host_window(host_id: str, window: AnalyzeWindowRequest, background_tasks: BackgroundTasks, test_mode: bool = False):
+    """Chay Stage 0 cho 1 cua so thoi gian co dinh (backfill). Xu ly o background."""
+    if window.start >= window.end: raise HTTPException(400, detail="start must be before end")
+    config = get_host_config_parser(test_mode)
+    if not config.has_section(host_id): raise HTTPException(404)
+    system_settings = get_system_config_parser(test_mode)
+
+    # // Import tre de API khong phai nap pipeline khi khoi dong
+    import main as pipeline_main
+    background_tasks.add_task(pipeline_main.run_window_analysis, config, host_id, system_settings, window.start, window.end, test_mode)
+    return {"status": "scheduled", "host_id": host_id, "start": window.start.isoformat(), "end": window.end.isoformat()}
+
 @app.get("/api/gemini-models", response_model=Dict[str, str])
 async def get_gemini_models():
     if not os.path.exists(MODEL_LIST_FILE): return {}
@@ -358,6 +405,13 @@ async def list_prompts(test_mode: bool = False):
     if not os.path.isdir(prompt_dir): return []
     return [f for f in os.listdir(prompt_dir) if f.endswith('.md')]
 
+@app.get("/api/log-formats", response_model=List[Dict[str, str]])
+async def list_log_formats():
+    """Cac format log ho tro (gia tri cho truong log_format cua host, 'auto' = tu nhan dien)."""
+    return [{"name": "auto", "description": "Auto-detect"}] + [
+        {"name": f.name, "description": f.description} for f in LOG_FORMATS.values()
+    ]
+
 @app.get("/api/email-templates", response_model=List[str])
 async def list_email_templates():
     """List available .html email templates in the backend root directory."""
@@ -397,36 +451,30 @@ async def delete_prompt(filename: str, test_mode: bool = False):
 
 @app.get("/api/reports", response_model=List[ReportInfo])
 async def get_all_reports(test_mode: bool = False):
-    config = configparser.ConfigParser(interpolation=None); config.read(get_active_config_file(test_mode), encoding='utf-8')
+    config = get_host_config_parser(test_mode)
     system_settings = get_system_config_parser(test_mode)
     report_dir = system_settings.get('System', 'report_directory', fallback='test_reports' if test_mode else 'reports')
     if not os.path.isdir(report_dir): return []
     hostname_map = {s: config.get(s, 'SysHostname', fallback=s) for s in config.sections() if s.startswith(('Firewall_', 'Host_'))}
     reports = []
-    files = glob.glob(os.path.join(report_dir, '*', '**', '*.json'), recursive=True)
-    files.sort(key=os.path.getmtime, reverse=True)
-    for file_path in files:
-        try:
-            parts = os.path.normpath(file_path).split(os.sep)
-            host_id = next((p for p in parts if p.startswith(('Firewall_', 'Host_'))), None)
-            if not host_id: continue 
-            with open(file_path, 'r', encoding='utf-8') as f: 
-                content = json.load(f)
-
-                stats = content.get('summary_stats', {})
-                # // [FIX] QUAN TRONG: Ensure raw_log_count is passed to frontend in summary_stats
-                # Neu stats khong co, nhung root JSON co, thi copy vao
-                if 'raw_log_count' not in stats and 'raw_log_count' in content:
-                    stats['raw_log_count'] = content['raw_log_count']
-                
-                reports.append(ReportInfo(
-                    filename=os.path.basename(file_path), path=file_path,
-                    hostname=hostname_map.get(host_id, host_id), type=content.get('report_type', 'unknown'),
-                    generated_time=datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S'),
-                    summary_stats=stats, 
-                    stage_index=content.get('stage_index', None)
-                ))
-        except: pass
+    try: indexed = report_index.query_reports(report_dir, newest_first=True)
+    except Exception as e:
+        logging.error(f"Report index error: {e}")
+        return []
+    for item in indexed:
+        host_id = item['host']
+        if not host_id.startswith(('Firewall_', 'Host_')): continue
+        stats = item['summary_stats']
+        # // [FIX] QUAN TRONG: Ensure raw_log_count is passed to frontend in summary_stats
+        if 'raw_log_count' not in stats and item['raw_log_count']:
+            stats['raw_log_count'] = item['raw_log_count']
+        reports.append(ReportInfo(
+            filename=os.path.basename(item['path']), path=item['path'],
+            hostname=hostname_map.get(host_id, host_id), type=item['report_type'] or 'unknown',
+            generated_time=datetime.fromtimestamp(item['mtime']).strftime('%Y-%m-%d %H:%M:%S'),
+            summary_stats=stats,
+            stage_index=item['stage_index']
+        ))
     return reports
 
 @app.get("/api/report-content", response_model=Dict)
@@ -449,6 +497,8 @@ async def delete_report(path: str, test_mode: bool = False):
         try: safe_path = verify_safe_path(base_report_dir, path)
         except: raise HTTPException(403)
     if os.path.exists(safe_path): os.remove(safe_path)
+    try: report_index.remove_report(base_report_dir, safe_path)
+    except Exception as e: logging.error(f"Report index error: {e}")
     return {"status": "deleted"}
 
 @app.get("/api/reports/download")
@@ -536,6 +586,13 @@ async def get_settings(test_mode: bool = False):
         settings.active_smtp_profile = s.get('active_smtp_profile')
         settings.attach_context_files = s.getboolean('attach_context_files', False)
         settings.scheduler_check_interval_seconds = s.getint('scheduler_check_interval_seconds', 60)
+        settings.scheduler_max_parallel_hosts = s.getint('scheduler_max_parallel_hosts', 4)
+        settings.backlog_max_batches_per_cycle = s.getint('backlog_max_batches_per_cycle', 5)
+        settings.backlog_max_api_calls_per_cycle = s.getint('backlog_max_api_calls_per_cycle', 0)
+        settings.backlog_max_tokens_per_cycle = s.getint('backlog_max_tokens_per_cycle', 0)
+        settings.max_concurrent_requests = s.getint('max_concurrent_requests', 0)
+        settings.reduce_token_budget = s.getint('reduce_token_budget', 200000)
+        settings.analysis_engine = s.get('analysis_engine', 'thread')
     
     profiles = {}
     for sec in conf.sections():
@@ -555,7 +612,7 @@ async def save_settings(settings: SystemSettings, test_mode: bool = False):
     path = get_system_settings_path(test_mode)
     try:
         with file_lock(path):
-            conf = get_system_config_parser(test_mode)
+            conf = get_system_config_parser(test_mode, writable=True)
             for s in conf.sections(): 
                 if s.startswith('Email_'): conf.remove_section(s)
             if 'System' not in conf: conf.add_section('System')
@@ -567,6 +624,13 @@ async def save_settings(settings: SystemSettings, test_mode: bool = False):
             sys['active_smtp_profile'] = settings.active_smtp_profile or ''
             sys['attach_context_files'] = str(settings.attach_context_files)
             sys['scheduler_check_interval_seconds'] = str(settings.scheduler_check_interval_seconds)
+            sys['scheduler_max_parallel_hosts'] = str(settings.scheduler_max_parallel_hosts)
+            sys['backlog_max_batches_per_cycle'] = str(settings.backlog_max_batches_per_cycle)
+            sys['backlog_max_api_calls_per_cycle'] = str(settings.backlog_max_api_calls_per_cycle)
+            sys['backlog_max_tokens_per_cycle'] = str(settings.backlog_max_tokens_per_cycle)
+            sys['max_concurrent_requests'] = str(settings.max_concurrent_requests)
+            sys['reduce_token_budget'] = str(settings.reduce_token_budget)
+            sys['analysis_engine'] = settings.analysis_engine or 'thread'
             for name, prof in settings.smtp_profiles.items():
                 sec = f'Email_{name}'
                 conf.add_section(sec)
@@ -8,17 +8,30 @@ import pytz
 import time
 import json
 import re
-import glob
+import asyncio
+import threading
+import contextlib
 import concurrent.futures
 from datetime import datetime
 
 from modules import state_manager
 from modules import log_reader
+from modules import log_formats
+from modules import template_miner
+from modules import log_stats
+from modules import token_budget
+from modules import tree_reduce
 from modules import gemini_analyzer
+from modules import client_pool
+from modules import key_pool
+from modules import async_engine
 from modules import email_service
 from modules import report_generator
+from modules import report_index
 from modules import context_loader
+from modules import config_service
 from modules import utils
+from modules import scheduler
 
 CONFIG_FILE = "config.ini"
 SYSTEM_SETTINGS_FILE = "system_settings.ini"
@@ -26,6 +39,16 @@ SYSTEM_SETTINGS_FILE = "system_settings.ini"
 # // Default fallback
 DEFAULT_CHUNK_SIZE = 6000
 
+# // So chunk Stage 0 goi Gemini cung luc cua 1 host (host: max_concurrency)
+DEFAULT_MAX_CONCURRENCY = 5
+# // Cach chon worker profile cho chunk (host: worker_assignment)
+WORKER_ASSIGNMENTS = ('least_load', 'round_robin')
+# // Cach chay request Stage 0 (System: analysis_engine): thread pool theo host hoac event loop dung chung (async_engine)
+ANALYSIS_ENGINES = ('thread', 'async')
+
+# // Backlog drain: so batch Stage 0 toi da moi chu ky (System: backlog_max_batches_per_cycle)
+DEFAULT_BACKLOG_MAX_BATCHES = 5
+
 LOGGING_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
 logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
 
@@ -43,7 +66,7 @@ def get_attachments(config, host_section, system_settings):
     if not system_settings.getboolean('System', 'attach_context_files', fallback=False):
         return []
     
-    standard_keys = ['syshostname', 'logfile', 'hourstoanalyze', 'timezone', 'run_interval_seconds', 'geminiapikey', 'networkdiagram', 'enabled', 'smtp_profile', 'pipeline_config', 'chunk_size']
+    standard_keys = ['syshostname', 'logfile', 'hourstoanalyze', 'timezone', 'run_interval_seconds', 'geminiapikey', 'networkdiagram', 'enabled', 'smtp_profile', 'pipeline_config', 'chunk_size', 'parallel_read_threshold_mb', 'log_format', 'template_mining', 'local_stats', 'chunk_token_budget', 'exact_token_count', 'max_concurrency', 'worker_assignment']
     attachments = []
     for key in config.options(host_section):
         if key not in standard_keys and not key.startswith('context_file_'):
@@ -71,10 +94,26 @@ def resolve_api_key_with_alias(raw_key, system_settings):
     masked = clean_key[:4] + "..." + clean_key[-4:] if len(clean_key) > 8 else "Raw Key"
     return (clean_key, f"Key: {masked}")
 
+def build_key_pool(raw_pool, model_name, system_settings, test_mode=False):
+    """key_pool cua stage (profile trong Gemini_Keys) -> KeyPool cho model; khong cau hinh / khong profile hop le -> None."""
+    entries = key_pool.parse_pool(raw_pool)
+    if not entries:
+        return None
+    keys = []
+    for entry in entries:
+        profile_name = entry.split(':', 1)[1].strip()
+        if not system_settings.has_option('Gemini_Keys', profile_name):
+            logging.warning(f"key_pool: bo qua profile '{profile_name}' (khong co trong Gemini_Keys).")
+            continue
+        keys.append(resolve_api_key_with_alias(entry, system_settings))
+    pool = key_pool.KeyPool(keys, model_name, test_mode)
+    return pool if len(pool) else None
+
 # --- WORKER FUNCTION (Executes inside thread) ---
-def process_chunk_worker(worker_config, chunk_content, host_section, bonus_context_text, binary_files, system_settings, prompt_dir, test_mode=False):
+def process_chunk_worker(worker_config, chunk_content, host_section, bonus_context_text, binary_files, system_settings, prompt_dir, test_mode=False, pool=None):
     """
     Worker function to process a log chunk with internal Retry Logic (3 times).
+    pool (KeyPool, tuy chon): moi lan thu gui toi key khoe nhat cua pool, loi/429 chuyen ngay sang key khac.
     """
     worker_name = worker_config.get('name', 'Worker')
     model_name = worker_config.get('model')
@@ -89,20 +128,30 @@ def process_chunk_worker(worker_config, chunk_content, host_section, bonus_conte
     # // RETRY LOGIC (3 Times)
     max_retries = 3
     last_error = None
+    usage = {}
     
     for attempt in range(max_retries):
         try:
-            result = gemini_analyzer.analyze_with_gemini(
-                f"{host_section}_{worker_name}", 
-                chunk_content, 
-                bonus_context_text, 
-                api_key, 
-                prompt_file, 
-                model_name,
-                key_alias=key_alias,
-                test_mode=test_mode,
-                context_file_paths=binary_files
-            )
+            if pool is not None:
+                result, key_alias, usage = pool.call(
+                    f"{host_section}_{worker_name}",
+                    lambda k, alias, u: gemini_analyzer.analyze_with_gemini(
+                        f"{host_section}_{worker_name}", chunk_content, bonus_context_text, k, prompt_file, model_name,
+                        key_alias=alias, test_mode=test_mode, context_file_paths=binary_files, usage_out=u, max_retries=1),
+                    token_budget.TokenEstimator(model_name).estimate(chunk_content))
+            else:
+                result = gemini_analyzer.analyze_with_gemini(
+                    f"{host_section}_{worker_name}", 
+                    chunk_content, 
+                    bonus_context_text, 
+                    api_key, 
+                    prompt_file, 
+                    model_name,
+                    key_alias=key_alias,
+                    test_mode=test_mode,
+                    context_file_paths=binary_files,
+                    usage_out=usage
+                )
             
             # // Check for fatal errors in string response
             if "Gemini blocked response" in result or "Fatal Gemini Error" in result:
@@ -111,7 +160,9 @@ def process_chunk_worker(worker_config, chunk_content, host_section, bonus_conte
             return {
                 "worker": worker_name,
                 "result": result,
-                "status": "success"
+                "status": "success",
+                "usage": usage,
+                "key_alias": key_alias
             }
         except Exception as e:
             last_error = e
@@ -125,9 +176,150 @@ def process_chunk_worker(worker_config, chunk_content, host_section, bonus_conte
         "status": "failed"
     }
 
+async def process_chunk_worker_async(worker_config, chunk_content, host_section, bonus_context_text, binary_files, system_settings, prompt_dir, test_mode=False, pool=None, deadline=async_engine.DEFAULT_CALL_DEADLINE_SECONDS):
+    """
+    Ban async cua process_chunk_worker (analysis_engine = async): cung retry 3 lan va dang ket qua.
+    deadline: han moi lan goi Gemini; task bi huy (abort stage) -> request dang chay bi huy theo.
+    """
+    worker_name = worker_config.get('name', 'Worker')
+    model_name = worker_config.get('model')
+    api_key, key_alias = resolve_api_key_with_alias(worker_config.get('gemini_api_key'), system_settings)
+    prompt_file = os.path.join(prompt_dir, worker_config.get('prompt_file'))
+    label = f"{host_section}_{worker_name}"
+
+    def _request(k, alias, u):
+        return gemini_analyzer.analyze_with_gemini_async(
+            label, chunk_content, bonus_context_text, k, prompt_file, model_name,
+            key_alias=alias, test_mode=test_mode, context_file_paths=binary_files, usage_out=u,
+            max_retries=1 if pool is not None else gemini_analyzer.MAX_RETRIES, deadline=deadline)
+
+    max_retries = 3
+    last_error = None
+    usage = {}
+
+    for attempt in range(max_retries):
+        try:
+            if pool is not None:
+                result, key_alias, usage = await pool.call_async(label, _request, token_budget.TokenEstimator(model_name).estimate(chunk_content))
+            else:
+                result = await _request(api_key, key_alias, usage)
+            if "Gemini blocked response" in result or "Fatal Gemini Error" in result:
+                raise Exception(f"AI Error: {result}")
+            return {"worker": worker_name, "result": result, "status": "success", "usage": usage, "key_alias": key_alias}
+        except Exception as e:
+            last_error = e
+            logging.warning(f"[{host_section}] Worker '{worker_name}' failed attempt {attempt+1}/{max_retries}: {e}")
+            await asyncio.sleep(2)
+
+    logging.error(f"[{host_section}] Worker '{worker_name}' FAILED after {max_retries} attempts.")
+    return {"worker": worker_name, "result": f"Worker Failed: {str(last_error)}", "status": "failed"}
+
+# // Gioi han so request Gemini dong thoi cua ca tien trinh (System: max_concurrent_requests, 0 = khong gioi han)
+_GLOBAL_SLOTS = {}
+_GLOBAL_SLOTS_LOCK = threading.Lock()
+
+def _global_request_slots(system_settings):
+    try:
+        limit = int(system_settings.getint('System', 'max_concurrent_requests', fallback=0))
+    except (TypeError, ValueError):
+        limit = 0
+    if limit <= 0:
+        return contextlib.nullcontext()
+    with _GLOBAL_SLOTS_LOCK:
+        return _GLOBAL_SLOTS.setdefault(limit, threading.BoundedSemaphore(limit))
+
+def _async_max_in_flight(system_settings):
+    """Semaphore toan cuc cua engine async: max_concurrent_requests neu > 0, nguoc lai async_engine.DEFAULT_MAX_IN_FLIGHT."""
+    try:
+        limit = int(system_settings.getint('System', 'max_concurrent_requests', fallback=0))
+    except (TypeError, ValueError):
+        limit = 0
+    return limit if limit > 0 else async_engine.DEFAULT_MAX_IN_FLIGHT
+
+def _reduce_token_budget(system_settings):
+    try:
+        budget = int(system_settings.getint('System', 'reduce_token_budget', fallback=tree_reduce.DEFAULT_REDUCE_TOKEN_BUDGET))
+    except (TypeError, ValueError):
+        budget = tree_reduce.DEFAULT_REDUCE_TOKEN_BUDGET
+    return budget if budget > 0 else tree_reduce.DEFAULT_REDUCE_TOKEN_BUDGET
+
+def _make_reduce_fn(label, bonus_context_text, api_key, prompt_file, model_name, key_alias, system_settings, test_mode, binary_files, attempts=1, run_info=None, estimator=None, pool=None):
+    """Ham reduce_fn cho tree_reduce: goi Gemini (retry attempts lan, qua key pool neu co), het lan -> raise ReduceFailed."""
+    slots = _global_request_slots(system_settings)
+    lock = threading.Lock()
+
+    def _reduce(text):
+        result = "Fatal Gemini Error: Init"
+        for att in range(attempts):
+            if run_info is not None:
+                with lock:
+                    run_info['api_calls'] += 1
+                    run_info['estimated_tokens'] += estimator.estimate(text)
+            try:
+                with slots:
+                    if pool is not None:
+                        result, _, _ = pool.call(label, lambda k, alias, u: gemini_analyzer.analyze_with_gemini(
+                            label, text, bonus_context_text, k, prompt_file, model_name,
+                            key_alias=alias, test_mode=test_mode, context_file_paths=binary_files, usage_out=u, max_retries=1),
+                            estimator.estimate(text) if estimator is not None else 0)
+                    else:
+                        result = gemini_analyzer.analyze_with_gemini(
+                            label, text, bonus_context_text,
+                            api_key, prompt_file, model_name,
+                            key_alias=key_alias, test_mode=test_mode,
+                            context_file_paths=binary_files
+                        )
+                if "Gemini blocked response" in result or "Fatal Gemini Error" in result:
+                    raise Exception(result)
+                return result
+            except Exception as e:
+                logging.warning(f"[{label}] Reduce failed attempt {att+1}: {e}")
+                if att + 1 < attempts:
+                    time.sleep(2)
+        raise tree_reduce.ReduceFailed(result)
+
+    return _reduce
+
+def _stage0_worker_profiles(stage_name, stage_config, substages, main_key_raw):
+    """Worker profile cua Stage 0: stage chinh + cac substage dang bat (moi profile co model/key rieng)."""
+    profiles = [{
+        "name": stage_name,
+        "model": stage_config.get('model'),
+        "prompt_file": stage_config.get('prompt_file'),
+        "gemini_api_key": main_key_raw
+    }]
+    profiles.extend(sub for sub in substages if sub.get('enabled', True))
+    return profiles
+
+def _pick_worker_profile(profiles, in_flight, assigned, strategy):
+    """
+    least_load: profile dang xu ly it chunk nhat (hoa -> profile duoc giao it chunk nhat, roi theo thu tu).
+    round_robin: lan luot theo thu tu profile.
+    """
+    if strategy == 'round_robin':
+        return profiles[sum(assigned.values()) % len(profiles)]
+    return min(profiles, key=lambda p: (in_flight.get(p['name'], 0), assigned.get(p['name'], 0)))
+
+def _chunk_token_estimator(host_config, host_section, model_name, raw_key, system_settings):
+    """
+    Estimator xep chunk cua Stage 0. exact_token_count = true: tong token moi chunk dem bang API countTokens
+    (them 1 request/chunk, loi -> uoc tinh theo ky tu); mac dinh chi uoc tinh offline.
+    """
+    if not host_config.getboolean(host_section, 'exact_token_count', fallback=False):
+        return token_budget.TokenEstimator(model_name)
+    api_key, _ = resolve_api_key_with_alias(raw_key, system_settings)
+    return token_budget.TokenEstimator(model_name, count_tokens=lambda text: gemini_analyzer.count_tokens(text, api_key, model_name))
+
 # --- PIPELINE EXECUTION ---
 
-def run_pipeline_stage_0(host_config, host_section, stage_config, main_raw_api_key, system_settings, test_mode=False):
+def run_pipeline_stage_0(host_config, host_section, stage_config, main_raw_api_key, system_settings, test_mode=False, window=None, run_info=None, notify=True):
+    """
+    window=(start, end): phan tich lai 1 cua so thoi gian co dinh (backfill),
+    khong dung toi timestamp/checkpoint cua chu ky dinh ky va khong gui email.
+    run_info (dict, tuy chon): duoc dien log_count, has_backlog, remaining_lines, remaining_bytes,
+    api_calls, estimated_tokens de nguoi goi quyet dinh co chay tiep batch khac khong.
+    """
+    if run_info is None: run_info = {}
     stage_name = stage_config.get('name', 'Periodic')
     substages = stage_config.get('substages', [])
     summary_conf = stage_config.get('summary_conf') or {}
@@ -147,7 +339,16 @@ def run_pipeline_stage_0(host_config, host_section, stage_config, main_raw_api_k
     except (configparser.NoOptionError, ValueError):
         chunk_size = host_config.getint(host_section, 'ChunkSize', fallback=DEFAULT_CHUNK_SIZE)
     
-    logging.info(f"[{host_section}] Using Chunk Size: {chunk_size}")
+    # // chunk_token_budget > 0: xep chunk theo token uoc tinh thay vi so dong
+    chunk_token_budget = host_config.getint(host_section, 'chunk_token_budget', fallback=0)
+    if chunk_token_budget > 0:
+        logging.info(f"[{host_section}] Using Chunk Token Budget: {chunk_token_budget}")
+    else:
+        logging.info(f"[{host_section}] Using Chunk Size: {chunk_size}")
+    parallel_threshold_mb = host_config.getint(host_section, 'parallel_read_threshold_mb', fallback=log_reader.DEFAULT_PARALLEL_READ_THRESHOLD_MB)
+    log_format = host_config.get(host_section, 'log_format', fallback='auto')
+    use_templates = host_config.getboolean(host_section, 'template_mining', fallback=False)
+    use_local_stats = host_config.getboolean(host_section, 'local_stats', fallback=False)
     
     report_dir = system_settings.get('System', 'report_directory', fallback='reports')
     prompt_dir = system_settings.get('System', 'prompt_directory', fallback='prompts')
@@ -156,119 +357,256 @@ def run_pipeline_stage_0(host_config, host_section, stage_config, main_raw_api_k
     total_workers_available = 1 + len(substages)
     total_capacity_lines = chunk_size * total_workers_available
     
-    read_result = log_reader.read_new_log_entries(log_file, hours, timezone, host_section, test_mode, custom_limit=total_capacity_lines)
+    log_stream = log_reader.open_log_stream(log_file, hours, timezone, host_section, test_mode, custom_limit=total_capacity_lines, window=window, parallel_threshold_mb=parallel_threshold_mb, log_format=log_format)
     
-    if not read_result or read_result[0] is None:
+    if log_stream is None:
         logging.error(f"[{host_section}] Log read failed. Aborting.")
         return False
 
-    full_log_content, start_time, end_time, log_count, candidate_timestamp = read_result
+    start_time, end_time = log_stream.start_time, log_stream.end_time
+
+    stage_specific_key_raw = stage_config.get('gemini_api_key')
+    final_main_key_raw = stage_specific_key_raw if stage_specific_key_raw and stage_specific_key_raw.strip() else main_raw_api_key
+
+    estimator = _chunk_token_estimator(host_config, host_section, stage_config.get('model'), final_main_key_raw, system_settings)
+    if chunk_token_budget > 0:
+        parser = log_formats.make_parser(log_stream.log_format, pytz.timezone(timezone))
+        chunk_source = token_budget.iter_token_chunks(log_stream.iter_lines(), chunk_token_budget, estimator, parser)
+    else:
+        chunk_source = ((chunk, None) for chunk in log_stream.iter_chunks(chunk_size))
+
+    worker_profiles = _stage0_worker_profiles(stage_name, stage_config, substages, final_main_key_raw)
+    max_in_flight = max(1, host_config.getint(host_section, 'max_concurrency', fallback=DEFAULT_MAX_CONCURRENCY))
+    assignment = host_config.get(host_section, 'worker_assignment', fallback='least_load').strip().lower()
+    if assignment not in WORKER_ASSIGNMENTS:
+        logging.warning(f"[{host_section}] worker_assignment '{assignment}' khong hop le, dung least_load.")
+        assignment = 'least_load'
+    global_slots = _global_request_slots(system_settings)
+    engine_mode = system_settings.get('System', 'analysis_engine', fallback='thread').strip().lower()
+    if engine_mode not in ANALYSIS_ENGINES:
+        logging.warning(f"[{host_section}] analysis_engine '{engine_mode}' khong hop le, dung thread.")
+        engine_mode = 'thread'
+    # // key_pool cua stage: moi worker profile (theo model) lay key tu pool thay vi key co dinh
+    key_pools = {p.get('model'): build_key_pool(stage_config.get('key_pool'), p.get('model'), system_settings, test_mode) for p in worker_profiles}
+
+    bonus_context_text, binary_files = None, []
+
+    def _execute_task(worker_conf, chunk_content, chunk_idx):
+        with global_slots:
+            started = time.monotonic()
+            result = process_chunk_worker(
+                worker_conf,
+                chunk_content,
+                host_section,
+                bonus_context_text,
+                binary_files,
+                system_settings,
+                prompt_dir,
+                test_mode,
+                pool=key_pools.get(worker_conf.get('model'))
+            )
+            result['elapsed'] = time.monotonic() - started
+        result['chunk'] = chunk_idx
+        return result
+
+    async def _execute_task_async(worker_conf, chunk_content, chunk_idx):
+        started = time.monotonic()
+        result = await process_chunk_worker_async(
+            worker_conf, chunk_content, host_section, bonus_context_text, binary_files,
+            system_settings, prompt_dir, test_mode, pool=key_pools.get(worker_conf.get('model'))
+        )
+        result['elapsed'] = time.monotonic() - started
+        result['chunk'] = chunk_idx
+        return result
+
+    # // WORK QUEUE: moi chunk deu duoc xu ly; chunk giao cho worker profile ngay khi du,
+    # // toi da max_in_flight chunk cung luc -> bo nho ~ chunk x max_in_flight, khong phu thuoc do lon cua so log
+    completed_tasks = []
+    in_flight = {}
+    assigned = {}
+    submitted_count = 0
+    chunk_count = 0
+    sent_chars = 0
+    estimated_tokens = 0
+    planned_tokens = {}
+    # // Template mining (tuy chon): chunk tho -> "template x so dong + bien mau" truoc khi gui Gemini
+    miner = template_miner.load_miner(host_section, test_mode) if use_templates else None
+    raw_chars = 0
+    compressed_chars = 0
+    template_count = 0
+    # // Thong ke cuc bo (tuy chon): so lieu chinh xac dat truoc log trong prompt va luu vao summary_stats
+    stats_agg = log_stats.LogStatsAggregator(pytz.timezone(timezone), log_stream.log_format) if use_local_stats else None
+    worker_local_stats = {}
+
+    # // async: chunk chay tren event loop dung chung cua process (khong ton 1 thread / request dang cho mang)
+    engine = async_engine.get_engine() if engine_mode == 'async' else None
+    executor_cm = contextlib.nullcontext() if engine is not None else concurrent.futures.ThreadPoolExecutor(max_workers=max_in_flight)
+    with executor_cm as executor:
+        pending = {}
+
+        def _submit(worker_conf, chunk_str, chunk_idx):
+            if engine is not None:
+                return engine.submit(_execute_task_async(worker_conf, chunk_str, chunk_idx), _async_max_in_flight(system_settings))
+            return executor.submit(_execute_task, worker_conf, chunk_str, chunk_idx)
+
+        def _collect(done_futures):
+            for future in done_futures:
+                chunk_idx, worker_name = pending.pop(future)
+                in_flight[worker_name] -= 1
+                try:
+                    completed_tasks.append((chunk_idx, worker_name, future.result(), None))
+                except Exception as exc:
+                    completed_tasks.append((chunk_idx, worker_name, None, exc))
+
+        try:
+            for chunk_idx, (chunk_str, chunk_tokens) in enumerate(chunk_source):
+                chunk_count += 1
+
+                if bonus_context_text is None:
+                    bonus_context_text, binary_files = context_loader.read_bonus_context_files(host_config, host_section)
+
+                chunk_stats = stats_agg.feed(chunk_str) if stats_agg is not None else None
+                if miner is not None:
+                    raw_chars += len(chunk_str)
+                    chunk_str, chunk_templates = template_miner.compress_chunk(miner, chunk_str)
+                    template_count += chunk_templates
+                    compressed_chars += len(chunk_str)
+                if chunk_stats is not None:
+                    worker_local_stats[chunk_idx] = chunk_stats
+                    chunk_str = log_stats.render_table(chunk_stats) + chunk_str
+
+                if len(pending) >= max_in_flight:
+                    done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    _collect(done)
+                else:
+                    _collect([f for f in pending if f.done()])
+
+                worker_conf = _pick_worker_profile(worker_profiles, in_flight, assigned, assignment)
+                worker_name = worker_conf['name']
+                pending[_submit(worker_conf, chunk_str, chunk_idx)] = (chunk_idx, worker_name)
+                in_flight[worker_name] = in_flight.get(worker_name, 0) + 1
+                assigned[worker_name] = assigned.get(worker_name, 0) + 1
+                submitted_count += 1
+                sent_chars += len(chunk_str)
+                planned_tokens[chunk_idx] = estimator.estimate(chunk_str)
+                estimated_tokens += planned_tokens[chunk_idx]
+                if chunk_tokens is not None:
+                    logging.info(f"[{host_section}] Chunk {chunk_idx} -> '{worker_name}': ~{chunk_tokens} token log, ~{planned_tokens[chunk_idx]} token gui di.")
+        except Exception as e:
+            logging.error(f"[{host_section}] Log read failed while streaming: {e}. Aborting.")
+            # // Huy cac chunk chua xong (async: huy ca request dang cho Gemini)
+            for future in pending:
+                future.cancel()
+            _collect(concurrent.futures.wait(pending)[0])
+            return False
+
+        _collect(concurrent.futures.wait(pending)[0])
+
+    template_stats = None
+    if miner is not None:
+        template_miner.save_miner(host_section, miner, test_mode)
+        template_stats = {
+            "raw_chars": raw_chars,
+            "compressed_chars": compressed_chars,
+            "compression_ratio": round(raw_chars / compressed_chars, 2) if compressed_chars else None,
+            "templates": template_count,
+            "known_templates": len(miner.clusters)
+        }
+        logging.info(f"[{host_section}] Template mining: {raw_chars} -> {compressed_chars} ky tu (x{template_stats['compression_ratio']}).")
+
+    log_count = log_stream.log_count
+    candidate_timestamp = log_stream.latest_timestamp
+    run_info.update(
+        log_count=log_count,
+        has_backlog=log_stream.has_backlog,
+        remaining_lines=log_stream.remaining_lines,
+        remaining_bytes=log_stream.remaining_bytes,
+        api_calls=submitted_count,
+        estimated_tokens=estimated_tokens
+    )
 
     if log_count == 0:
+        if window:
+            logging.info(f"[{host_section}] No logs in requested window.")
+            return True
         logging.info(f"[{host_section}] No new logs. Advancing timestamp.")
         state_manager.save_last_run_timestamp(candidate_timestamp, host_section, test_mode)
+        log_reader.commit_checkpoint(host_section, test_mode)
         return True
 
-    bonus_context_text, binary_files = context_loader.read_bonus_context_files(host_config, host_section)
+    logging.info(f"[{host_section}] Total Logs: {log_count} lines. Worker profiles: {len(worker_profiles)} ({assignment}, max {max_in_flight} in flight). Split into {chunk_count} chunks.")
 
-    log_lines = full_log_content.splitlines()
-    chunks = [log_lines[i:i + chunk_size] for i in range(0, len(log_lines), chunk_size)]
-    
-    logging.info(f"[{host_section}] Total Logs: {log_count} lines. Available Workers: {total_workers_available}. Split into {len(chunks)} chunks.")
-
-    active_workers_payload = []
-
-    stage_specific_key_raw = stage_config.get('gemini_api_key')
-    final_main_key_raw = stage_specific_key_raw if stage_specific_key_raw and stage_specific_key_raw.strip() else main_raw_api_key
-
-    if len(chunks) > 0:
-        chunk_str = "\n".join(chunks[0])
-        active_workers_payload.append({
-            "config": {
-                "name": stage_name, 
-                "model": stage_config.get('model'),
-                "prompt_file": stage_config.get('prompt_file'),
-                "gemini_api_key": final_main_key_raw
-            },
-            "content": chunk_str
-        })
-
-
-    for i in range(1, len(chunks)):
-        sub_idx = i - 1
-        if sub_idx < len(substages):
-            sub_conf = substages[sub_idx]
-            if sub_conf.get('enabled', True):
-                chunk_str = "\n".join(chunks[i])
-                active_workers_payload.append({
-                    "config": sub_conf,
-                    "content": chunk_str
-                })
-        else:
-            pass 
-
-    if not active_workers_payload:
+    if submitted_count == 0:
         logging.warning(f"[{host_section}] No chunks to process.")
         return False
 
-    logging.info(f"[{host_section}] >>> Parallel Execution: {len(active_workers_payload)} tasks.")
+    logging.info(f"[{host_section}] >>> Parallel Execution: {submitted_count} tasks.")
 
     successful_results = []
     failed_workers = []
     
-    is_multi_worker_run = len(active_workers_payload) > 1
-
-    def _execute_task(task_payload):
-        return process_chunk_worker(
-            task_payload['config'],
-            task_payload['content'],
-            host_section,
-            bonus_context_text,
-            binary_files,
-            system_settings,
-            prompt_dir,
-            test_mode
-        )
+    is_multi_worker_run = submitted_count > 1
+    # // Thong luong theo worker profile (ghi vao bao cao Reduce)
+    worker_metrics = {}
+
+    for chunk_idx, worker_name, data, exc in sorted(completed_tasks, key=lambda t: t[0]):
+        metrics = worker_metrics.setdefault(worker_name, {"chunks": 0, "failed": 0, "planned_tokens": 0, "prompt_tokens": 0, "busy_seconds": 0.0, "queue_wait_seconds": 0.0})
+        metrics["chunks"] += 1
+        metrics["planned_tokens"] += planned_tokens.get(chunk_idx, 0)
+        if exc is not None:
+            logging.error(f"[{host_section}] Thread execution failed for '{worker_name}': {exc}")
+            failed_workers.append(worker_name)
+            metrics["failed"] += 1
+            continue
+        metrics["busy_seconds"] += data.get('elapsed', 0.0)
+        metrics["prompt_tokens"] += data.get('usage', {}).get('prompt_tokens') or 0
+        metrics["queue_wait_seconds"] += data.get('usage', {}).get('queue_wait_seconds') or 0.0
+        try:
+            worker_stats = utils.extract_json_from_text(data['result'])
+            if chunk_idx in worker_local_stats and isinstance(worker_stats, dict):
+                worker_stats["local_stats"] = worker_local_stats[chunk_idx]
+            worker_md = re.sub(r'```json\s*.*?\s*```', '', data['result'], flags=re.DOTALL | re.IGNORECASE).strip()
+            
+            worker_report_data = {
+                "hostname": hostname,
+                "worker_name": worker_name,
+                "analysis_start_time": start_time.isoformat(),
+                "analysis_end_time": end_time.isoformat(),
+                "report_generated_time": datetime.now(pytz.timezone(timezone)).isoformat(),
+                "summary_stats": worker_stats,
+                "analysis_details_markdown": worker_md,
+                "stage_index": 0,
+                "report_type": worker_name,
+                "chunk_index": chunk_idx,
+                "status": data['status'],
+                "raw_log_count": log_count if not is_multi_worker_run else 0 
+            }
+            if template_stats:
+                worker_report_data["template_mining"] = template_stats
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_worker = {
-            executor.submit(_execute_task, task): task['config']['name'] 
-            for task in active_workers_payload
-        }
+            report_generator.save_structured_report(host_section, worker_report_data, timezone, report_dir, worker_name)
+            
+            if data['status'] == 'success':
+                successful_results.append(data)
+                logging.info(f"[{host_section}] Worker '{worker_name}' SUCCESS.")
+                actual_tokens = data.get('usage', {}).get('prompt_tokens')
+                logging.info(f"[{host_section}] Worker '{worker_name}' chunk {chunk_idx} tokens: planned ~{planned_tokens.get(chunk_idx)} (log), actual {actual_tokens if actual_tokens is not None else 'N/A'} (prompt).")
+            else:
+                failed_workers.append(worker_name)
+                metrics["failed"] += 1
+                logging.error(f"[{host_section}] Worker '{worker_name}' FAILED.")
 
-        for future in concurrent.futures.as_completed(future_to_worker):
-            worker_name = future_to_worker[future]
-            try:
-                data = future.result()
-                
-                worker_stats = utils.extract_json_from_text(data['result'])
-                worker_md = re.sub(r'```json\s*.*?\s*```', '', data['result'], flags=re.DOTALL | re.IGNORECASE).strip()
-                
-                worker_report_data = {
-                    "hostname": hostname,
-                    "worker_name": worker_name,
-                    "analysis_start_time": start_time.isoformat(),
-                    "analysis_end_time": end_time.isoformat(),
-                    "report_generated_time": datetime.now(pytz.timezone(timezone)).isoformat(),
-                    "summary_stats": worker_stats,
-                    "analysis_details_markdown": worker_md,
-                    "stage_index": 0,
-                    "report_type": worker_name,
-                    "raw_log_count": log_count if not is_multi_worker_run else 0 
-                }
-
-                report_generator.save_structured_report(host_section, worker_report_data, timezone, report_dir, worker_name)
-                
-                if data['status'] == 'success':
-                    successful_results.append(data)
-                    logging.info(f"[{host_section}] Worker '{worker_name}' SUCCESS.")
-                else:
-                    failed_workers.append(worker_name)
-                    logging.error(f"[{host_section}] Worker '{worker_name}' FAILED.")
+        except Exception as exc:
+            logging.error(f"[{host_section}] Thread execution failed for '{worker_name}': {exc}")
+            failed_workers.append(worker_name)
+            metrics["failed"] += 1
 
-            except Exception as exc:
-                logging.error(f"[{host_section}] Thread execution failed for '{worker_name}': {exc}")
-                failed_workers.append(worker_name)
+    for metrics in worker_metrics.values():
+        busy = metrics["busy_seconds"]
+        metrics["busy_seconds"] = round(busy, 3)
+        metrics["queue_wait_seconds"] = round(metrics["queue_wait_seconds"], 3)
+        metrics["chunks_per_minute"] = round(metrics["chunks"] * 60 / busy, 2) if busy else None
+        metrics["tokens_per_second"] = round(metrics["planned_tokens"] / busy, 1) if busy else None
 
     if not successful_results:
         logging.error(f"[{host_section}] ALL Workers failed. Aborting pipeline.")
@@ -290,15 +628,17 @@ def run_pipeline_stage_0(host_config, host_section, stage_config, main_raw_api_k
         logging.info(f"[{host_section}] >>> Running Reduce '{reduce_name}' for {len(successful_results)} results...")
         
         combined_inputs = []
-        successful_results.sort(key=lambda x: x['worker'] != stage_name) 
+        # // Theo thu tu chunk = thu tu thoi gian
+        successful_results.sort(key=lambda x: x['chunk'])
 
         for res in successful_results:
-            combined_inputs.append(f"--- ANALYSIS PART FROM {res['worker']} ---\n{res['result']}")
+            combined_inputs.append(f"--- ANALYSIS PART {res['chunk'] + 1} FROM {res['worker']} ---\n{res['result']}")
         
         if failed_workers:
              combined_inputs.append(f"--- WARNING ---\nThe following workers failed to process their chunks: {failed_workers}. This report is based on partial data.")
 
-        full_combined_text = "\n\n".join(combined_inputs)
+        stats_table = log_stats.render_table(stats_agg.summary()) if stats_agg is not None else ""
+        full_combined_text = stats_table + tree_reduce.PART_SEPARATOR.join(combined_inputs)
 
         reduce_model = summary_conf.get('model') or stage_config.get('model')
         reduce_prompt_file_name = summary_conf.get('prompt_file') or 'summary_prompt_template.md'
@@ -309,29 +649,21 @@ def run_pipeline_stage_0(host_config, host_section, stage_config, main_raw_api_k
         
         reduce_api_key, reduce_alias = resolve_api_key_with_alias(reduce_key_raw, system_settings)
 
-        # // RETRY LOGIC FOR REDUCE
-        reduce_result = "Fatal Gemini Error: Init"
-        for att in range(3):
-            try:
-                reduce_result = gemini_analyzer.analyze_with_gemini(
-                    f"{host_section}_Reduce",
-                    full_combined_text,
-                    bonus_context_text,
-                    reduce_api_key, 
-                    reduce_prompt_file,
-                    reduce_model,
-                    key_alias=reduce_alias,
-                    test_mode=test_mode,
-                    context_file_paths=binary_files
-                )
-                if "Gemini blocked response" in reduce_result or "Fatal Gemini Error" in reduce_result:
-                     raise Exception(reduce_result)
-                break 
-            except Exception as e:
-                logging.warning(f"[{host_section}] Reduce failed attempt {att+1}: {e}")
-                time.sleep(2)
-
-        if "Gemini blocked response" in reduce_result or "Fatal Gemini Error" in reduce_result:
+        # // Tree-reduce: vuot reduce_token_budget -> reduce theo nhom song song; ket qua trung gian duoc cache
+        reduce_estimator = token_budget.TokenEstimator(reduce_model)
+        reduce_fn = _make_reduce_fn(f"{host_section}_Reduce", bonus_context_text, reduce_api_key, reduce_prompt_file, reduce_model,
+                                    reduce_alias, system_settings, test_mode, binary_files, attempts=3, run_info=run_info,
+                                    estimator=reduce_estimator,
+                                    pool=build_key_pool(stage_config.get('key_pool'), reduce_model, system_settings, test_mode))
+        try:
+            reduce_result, reduce_tree = tree_reduce.tree_reduce(
+                host_section, combined_inputs, reduce_fn, reduce_estimator,
+                _reduce_token_budget(system_settings), f"{reduce_model}|{reduce_prompt_file}",
+                header=stats_table, test_mode=test_mode)
+        except tree_reduce.ReduceFailed:
+            reduce_result, reduce_tree = None, None
+
+        if reduce_result is None:
             logging.error(f"[{host_section}] Reduce Failed.")
             final_stats = {} 
             final_markdown = "## AUTO-GENERATED CONCATENATION (AI REDUCE FAILED)\n\n" + full_combined_text
@@ -339,6 +671,9 @@ def run_pipeline_stage_0(host_config, host_section, stage_config, main_raw_api_k
             final_stats = utils.extract_json_from_text(reduce_result)
             final_markdown = re.sub(r'```json\s*.*?\s*```', '', reduce_result, flags=re.DOTALL | re.IGNORECASE).strip()
 
+        if stats_agg is not None and isinstance(final_stats, dict):
+            final_stats["local_stats"] = stats_agg.summary()
+
         # SAVE REDUCE REPORT
         final_report_type = reduce_name
         reduce_report_data = {
@@ -350,16 +685,36 @@ def run_pipeline_stage_0(host_config, host_section, stage_config, main_raw_api_k
             "summary_stats": final_stats,
             "analysis_details_markdown": final_markdown,
             "stage_index": 0,
-            "parallel_workers_active": len(active_workers_payload),
+            "parallel_workers_active": submitted_count,
             "failed_workers": failed_workers,
+            "worker_metrics": worker_metrics,
+            "client_pool": client_pool.POOL.stats(),
+            "analysis_engine": engine_mode,
+            "async_engine": engine.stats() if engine is not None else None,
             "report_type": reduce_name
         }
+        if template_stats:
+            reduce_report_data["template_mining"] = template_stats
+        if reduce_tree:
+            reduce_report_data["reduce_tree"] = reduce_tree
         report_generator.save_structured_report(host_section, reduce_report_data, timezone, report_dir, reduce_name)
 
 
+    if window:
+        logging.info(f"[{host_section}] Window analysis done. State and emails untouched.")
+        return True
+
     # Finalize Timestamp
     state_manager.save_last_run_timestamp(candidate_timestamp, host_section, test_mode)
+    log_reader.commit_checkpoint(host_section, test_mode)
     
+    # // notify co the la ham(run_info) -> bool: drain backlog chi gui email o batch cuoi cua chu ky
+    if callable(notify):
+        notify = notify(run_info)
+    if not notify:
+        logging.info(f"[{host_section}] Batch trung gian cua backlog: bao cao da luu, bo qua email.")
+        return True
+
     # --- EMAIL SENDING ---
     recipient_emails = stage_config.get('recipient_emails', '')
     if recipient_emails:
@@ -410,20 +765,13 @@ def run_pipeline_stage_0(host_config, host_section, stage_config, main_raw_api_k
 
     return True
 
-def run_pipeline_stage_n(host_config, host_section, current_stage_idx, stage_config, prev_stage_config, main_raw_api_key, system_settings, test_mode=False, is_last_stage=False):
-
-    stage_name = stage_config.get('name', f'Stage_{current_stage_idx}')
-    threshold = int(stage_config.get('trigger_threshold', 10))
-    
-    logging.info(f"[{host_section}] >>> Checking trigger for Stage {current_stage_idx} ({stage_name}). Need {threshold} reports.")
-
-    report_dir = system_settings.get('System', 'report_directory', fallback='reports')
-    host_report_dir = os.path.join(report_dir, host_section)
-    
+def _pending_stage_reports(report_dir, host_section, current_stage_idx, prev_stage_config, test_mode=False):
+    """
+    Bao cao nguon cua Stage N chua tieu thu (sau cursor), cu -> moi, doc tu report_index.
+    Tra ve (list record cua index, cursor hien tai hoac None).
+    """
     prev_stage_name = prev_stage_config.get('name', f'Stage_{current_stage_idx-1}')
-    prev_stage_slug = report_generator.slugify(prev_stage_name)
-    
-    possible_folders = [prev_stage_slug]
+    possible_folders = [report_generator.slugify(prev_stage_name)]
     
     reduce_name = None 
     
@@ -432,36 +780,70 @@ def run_pipeline_stage_n(host_config, host_section, current_stage_idx, stage_con
         reduce_name = prev_summary_conf.get('name') or f"{prev_stage_name}_Reduce"
         possible_folders.append(report_generator.slugify(reduce_name))
 
-    valid_reports = []
-    
     def is_match(json_type, config_name):
         if not json_type or not config_name: return False
         if json_type == config_name: return True
         if json_type == report_generator.slugify(config_name): return True
         return False
 
-    for folder in possible_folders:
-        search_pattern = os.path.join(host_report_dir, folder, "*", "*.json")
-        found_files = glob.glob(search_pattern, recursive=True)
-        for p in found_files:
-            try:
-                with open(p, 'r', encoding='utf-8') as f:
-                    d = json.load(f)
-                    r_type = d.get('report_type')
-                    
-                    # [FIX] Use robust comparison
-                    match_prev = is_match(r_type, prev_stage_name)
-                    match_reduce = is_match(r_type, reduce_name) if reduce_name else False
-                    
-                    if match_prev or match_reduce:
-                        if p not in valid_reports: valid_reports.append(p)
-            except Exception as e: 
-                logging.debug(f"[{host_section}] Error checking report {p}: {e}")
-                pass
-            
-    valid_reports.sort(key=os.path.getmtime, reverse=False)
+    cursor = state_manager.get_stage_cursor(host_section, current_stage_idx, test_mode)
+    after = (cursor['mtime'], cursor['rel_path']) if cursor else None
+    pending = []
+    for item in report_index.query_reports(report_dir, host=host_section, stage_slugs=possible_folders, after=after):
+        r_type = item['report_type']
+        # [FIX] Use robust comparison
+        match_prev = is_match(r_type, prev_stage_name)
+        match_reduce = is_match(r_type, reduce_name) if reduce_name else False
+        if match_prev or match_reduce:
+            pending.append(item)
+
+    if reduce_name:
+        # // Stage 0 luu ca bao cao tung chunk (report_type = ten worker, worker chinh trung ten stage) lan bao cao Reduce.
+        # // Moi chu ky (cung cua so log) chi tinh 1 bao cao: Reduce neu co; chu ky 1 chunk (khong Reduce) -> bao cao thanh cong duy nhat do.
+        # // Bao cao worker loi (status = failed) khong tinh: lan chay loi khong lam tang buffer.
+        cycles = {}
+        for item in pending:
+            cycles.setdefault((item['start_time'], item['end_time']), []).append(item)
+
+        def is_cycle_report(item):
+            cycle = cycles[(item['start_time'], item['end_time'])]
+            if any(is_match(i['report_type'], reduce_name) for i in cycle):
+                return is_match(item['report_type'], reduce_name)
+            succeeded = [i for i in cycle if i.get('status') != 'failed']
+            return len(succeeded) == 1 and succeeded[0] is item
+
+        pending = [item for item in pending if is_cycle_report(item)]
+
+    if cursor is None:
+        # // Chua co cursor (nang cap tu ban dem buffer_count): chi giu N bao cao moi nhat theo buffer cu,
+        # // dat cursor ngay truoc chung de khong tong hop lai toan bo lich su. Chua co buffer_count -> cai moi, giu het.
+        legacy_count = state_manager.get_stage_buffer_count(host_section, current_stage_idx, test_mode, default=None)
+        if legacy_count is not None and len(pending) > legacy_count:
+            seed = pending[len(pending) - legacy_count - 1]
+            cursor = {
+                "mtime": seed['mtime'], "rel_path": seed['rel_path'],
+                "consumed_total": 0, "last_batch": [],
+                "seeded_from_buffer_count": legacy_count,
+                "updated_at": datetime.now().isoformat()
+            }
+            state_manager.save_stage_cursor(host_section, current_stage_idx, cursor, test_mode)
+            logging.info(f"[{host_section}] Stage {current_stage_idx}: khoi tao cursor tu buffer cu ({legacy_count} bao cao dang cho).")
+            pending = pending[len(pending) - legacy_count:]
+    return pending, cursor
+
+def run_pipeline_stage_n(host_config, host_section, current_stage_idx, stage_config, prev_stage_config, main_raw_api_key, system_settings, test_mode=False, is_last_stage=False):
+
+    stage_name = stage_config.get('name', f'Stage_{current_stage_idx}')
+    threshold = int(stage_config.get('trigger_threshold', 10))
+    
+    logging.info(f"[{host_section}] >>> Checking trigger for Stage {current_stage_idx} ({stage_name}). Need {threshold} reports.")
 
-    reports_to_process = valid_reports[:threshold]
+    report_dir = system_settings.get('System', 'report_directory', fallback='reports')
+    
+    # // Chi lay batch bao cao nguon chua tieu thu tiep theo (cursor trong state), theo thu tu thoi gian
+    pending, cursor = _pending_stage_reports(report_dir, host_section, current_stage_idx, prev_stage_config, test_mode)
+    batch = pending[:threshold]
+    reports_to_process = [item['path'] for item in batch]
     
     if len(reports_to_process) < threshold and not test_mode:
         logging.info(f"[{host_section}] Not enough reports ({len(reports_to_process)}/{threshold}). Waiting.")
@@ -489,22 +871,21 @@ def run_pipeline_stage_n(host_config, host_section, current_stage_idx, stage_con
     timezone = host_config.get(host_section, 'TimeZone')
     logo_path = system_settings.get('System', 'logo_path', fallback=None)
 
-    content_to_analyze = "\n\n".join(combined_analysis)
-
     bonus_context_text, binary_files = context_loader.read_bonus_context_files(host_config, host_section)
     
     stage_key_raw = stage_config.get('gemini_api_key')
     final_key_raw = stage_key_raw if stage_key_raw and stage_key_raw.strip() else main_raw_api_key
     final_api_key, key_alias = resolve_api_key_with_alias(final_key_raw, system_settings)
 
-    result_raw = gemini_analyzer.analyze_with_gemini(
-        host_section, content_to_analyze, bonus_context_text, 
-        final_api_key, prompt_file, model_name,
-        key_alias=key_alias, test_mode=test_mode,
-        context_file_paths=binary_files
-    )
-    
-    if "Gemini blocked response" in result_raw or "Fatal Gemini Error" in result_raw:
+    # // Nhieu bao cao (trigger_threshold lon) -> tree-reduce; lan chay lai dung cache cac nhanh da xong
+    reduce_fn = _make_reduce_fn(host_section, bonus_context_text, final_api_key, prompt_file, model_name,
+                                key_alias, system_settings, test_mode, binary_files,
+                                pool=build_key_pool(stage_config.get('key_pool'), model_name, system_settings, test_mode))
+    try:
+        result_raw, reduce_tree = tree_reduce.tree_reduce(
+            host_section, combined_analysis, reduce_fn, token_budget.TokenEstimator(model_name),
+            _reduce_token_budget(system_settings), f"{model_name}|{prompt_file}", test_mode=test_mode)
+    except tree_reduce.ReduceFailed:
         logging.error(f"[{host_section}] Stage {current_stage_idx} AI Failed. Not saving.")
         return False
 
@@ -520,10 +901,21 @@ def run_pipeline_stage_n(host_config, host_section, current_stage_idx, stage_con
         "analysis_details_markdown": result_md,
         "source_reports": reports_to_process,
         "stage_index": current_stage_idx,
+        "reduce_tree": reduce_tree,
         "report_type": stage_name
     }
     
-    report_generator.save_structured_report(host_section, report_data, timezone, report_dir, stage_name)
+    if not report_generator.save_structured_report(host_section, report_data, timezone, report_dir, stage_name):
+        return False
+
+    # // Danh dau batch da tieu thu: lan sau bat dau tu bao cao ngay sau batch nay
+    last = batch[-1]
+    state_manager.save_stage_cursor(host_section, current_stage_idx, {
+        "mtime": last['mtime'], "rel_path": last['rel_path'],
+        "consumed_total": (cursor or {}).get('consumed_total', 0) + len(batch),
+        "last_batch": [item['rel_path'] for item in batch],
+        "updated_at": datetime.now().isoformat()
+    }, test_mode)
     
     recipients = stage_config.get('recipient_emails', '')
     if recipients:
@@ -589,11 +981,81 @@ def run_pipeline_stage_n(host_config, host_section, current_stage_idx, stage_con
 
     return True
 
-def process_host_pipeline(host_config, host_section, system_settings, test_mode=False):
-    pipeline_json = host_config.get(host_section, 'pipeline_config', fallback='[]')
-    try: pipeline = json.loads(pipeline_json)
-    except: return
+def _backlog_budget_exhausted(batches, calls, tokens, last_info, max_batches, max_calls, max_tokens):
+    """Batch tiep theo co vuot ngan sach khong (gia dinh ton tuong tu batch vua chay)."""
+    if batches >= max_batches:
+        return True
+    if max_calls and calls + last_info.get('api_calls', 0) > max_calls:
+        return True
+    if max_tokens and tokens + last_info.get('estimated_tokens', 0) > max_tokens:
+        return True
+    return False
+
+def run_stage_0_with_backlog_drain(host_config, host_section, stage_config, main_raw_api_key, system_settings, test_mode=False, run_interval=3600):
+    """
+    Chay Stage 0; neu reader bao con backlog thi chay tiep cac batch lien tiep (catch-up)
+    trong ngan sach cua System settings: backlog_max_batches_per_cycle, backlog_max_api_calls_per_cycle,
+    backlog_max_tokens_per_cycle (0 = khong gioi han). Moi batch van luu bao cao, chi batch cuoi gui email.
+    Ghi do sau backlog + thoi gian uoc tinh de xa het vao state. Tra ve so batch thanh cong.
+    """
+    max_batches = max(1, system_settings.getint('System', 'backlog_max_batches_per_cycle', fallback=DEFAULT_BACKLOG_MAX_BATCHES))
+    max_calls = system_settings.getint('System', 'backlog_max_api_calls_per_cycle', fallback=0)
+    max_tokens = system_settings.getint('System', 'backlog_max_tokens_per_cycle', fallback=0)
+
+    batches, calls, tokens, lines = 0, 0, 0, 0
+    info = {}
+    budget_exhausted = False
+    started = time.monotonic()
+
+    def _is_last_batch(attempt):
+        # // Cung dieu kien dung vong lap ben duoi, tinh truoc khi gui email -> 1 email moi chu ky
+        return not attempt.get('has_backlog') or _backlog_budget_exhausted(
+            batches + 1, calls + attempt.get('api_calls', 0), tokens + attempt.get('estimated_tokens', 0),
+            attempt, max_batches, max_calls, max_tokens)
 
+    while True:
+        attempt = {}
+        if not run_pipeline_stage_0(host_config, host_section, stage_config, main_raw_api_key, system_settings, test_mode,
+                                    run_info=attempt, notify=_is_last_batch):
+            break
+        # // Chi tinh backlog theo batch thanh cong gan nhat
+        info = attempt
+        batches += 1
+        calls += info.get('api_calls', 0)
+        tokens += info.get('estimated_tokens', 0)
+        lines += info.get('log_count', 0)
+
+        if not info.get('has_backlog'):
+            break
+        if _backlog_budget_exhausted(batches, calls, tokens, info, max_batches, max_calls, max_tokens):
+            budget_exhausted = True
+            logging.warning(f"[{host_section}] Het ngan sach catch-up ({batches} batch, {calls} API call, ~{tokens} token). Backlog con ~{info.get('remaining_lines', 0)} dong, doi chu ky sau.")
+            break
+        logging.info(f"[{host_section}] Backlog con ~{info.get('remaining_lines', 0)} dong. Chay tiep batch {batches + 1}/{max_batches}.")
+
+    if batches:
+        elapsed = time.monotonic() - started
+        remaining_lines = info.get('remaining_lines', 0) if info.get('has_backlog') else 0
+        eta_seconds = None
+        if remaining_lines and lines:
+            # // Het ngan sach -> toc do thuc te la so dong moi chu ky; nguoc lai la toc do xu ly
+            period = max(run_interval, elapsed) if budget_exhausted else elapsed
+            eta_seconds = int(remaining_lines / (lines / max(period, 1e-3)))
+        state_manager.save_backlog_status(host_section, {
+            "has_backlog": bool(remaining_lines),
+            "remaining_lines": remaining_lines,
+            "remaining_bytes": info.get('remaining_bytes', 0) if remaining_lines else 0,
+            "eta_seconds": eta_seconds,
+            "batches_last_cycle": batches,
+            "api_calls_last_cycle": calls,
+            "estimated_tokens_last_cycle": tokens,
+            "updated_at": datetime.now().isoformat()
+        }, test_mode)
+    return batches
+
+def process_host_pipeline(host_config, host_section, system_settings, test_mode=False):
+    # // pipeline_config parse 1 lan cho moi noi dung (config_service), stage la mapping chi doc
+    pipeline = config_service.host_pipeline(host_config, host_section)
     if not pipeline: return
         
     main_raw_api_key = host_config.get(host_section, 'GeminiAPIKey', fallback='')
@@ -606,43 +1068,111 @@ def process_host_pipeline(host_config, host_section, system_settings, test_mode=
         last_run = state_manager.get_last_cycle_run_timestamp(host_section, test_mode)
         
         if not last_run or (now - last_run).total_seconds() >= run_interval:
-            success = run_pipeline_stage_0(host_config, host_section, stage0_config, main_raw_api_key, system_settings, test_mode)
-            if success:
+            batches = run_stage_0_with_backlog_drain(host_config, host_section, stage0_config, main_raw_api_key, system_settings, test_mode, run_interval)
+            if batches:
                 state_manager.save_last_cycle_run_timestamp(now, host_section, test_mode)
-                if len(pipeline) > 1:
-                    curr_buff = state_manager.get_stage_buffer_count(host_section, 1, test_mode)
-                    state_manager.save_stage_buffer_count(host_section, 1, curr_buff + 1, test_mode)
 
     total_stages = len(pipeline)
+    report_dir = system_settings.get('System', 'report_directory', fallback='reports')
     for i in range(1, total_stages):
         current_stage = pipeline[i]
         if not current_stage.get('enabled', True): continue
         prev_stage = pipeline[i-1]
         threshold = int(current_stage.get('trigger_threshold', 10))
-        current_buffer = state_manager.get_stage_buffer_count(host_section, i, test_mode)
+        # // Buffer = so bao cao nguon chua tieu thu theo cursor (khong con dem cong don)
+        pending, _ = _pending_stage_reports(report_dir, host_section, i, prev_stage, test_mode)
+        current_buffer = len(pending)
+        state_manager.save_stage_buffer_count(host_section, i, current_buffer, test_mode)
         
         if current_buffer >= threshold:
             is_last = (i == total_stages - 1)
-            success = run_pipeline_stage_n(host_config, host_section, i, current_stage, prev_stage, main_raw_api_key, system_settings, test_mode, is_last_stage=is_last)
-            if success:
-                state_manager.save_stage_buffer_count(host_section, i, 0, test_mode)
-                if i + 1 < len(pipeline):
-                    next_buff = state_manager.get_stage_buffer_count(host_section, i+1, test_mode)
-                    state_manager.save_stage_buffer_count(host_section, i+1, next_buff + 1, test_mode)
+            run_pipeline_stage_n(host_config, host_section, i, current_stage, prev_stage, main_raw_api_key, system_settings, test_mode, is_last_stage=is_last)
+
+def run_window_analysis(host_config, host_section, system_settings, window_start, window_end, test_mode=False):
+    """Chay Stage 0 cho 1 cua so thoi gian [window_start, window_end] (CLI / API backfill)."""
+    pipeline = config_service.host_pipeline(host_config, host_section)
+    if not pipeline:
+        logging.error(f"[{host_section}] No pipeline configured.")
+        return False
+
+    main_raw_api_key = host_config.get(host_section, 'GeminiAPIKey', fallback='')
+    return run_pipeline_stage_0(host_config, host_section, pipeline[0], main_raw_api_key, system_settings, test_mode, window=(window_start, window_end))
+
+def _host_next_due(host_config, host_section, system_settings, now, after_run=False, test_mode=False):
+    """
+    Epoch den han tiep theo cua host = min theo stage: Stage 0 theo last_cycle + run_interval_seconds,
+    Stage N con du bao cao chua tieu thu (lan truoc loi) -> ngay.
+    Sau 1 lan chay khong bao gio som hon now + scheduler_check_interval_seconds (vd Stage 0 khong co log moi).
+    """
+    retry = system_settings.getint('System', 'scheduler_check_interval_seconds', fallback=60)
+    pipeline = config_service.host_pipeline(host_config, host_section)
+
+    dues = []
+    if pipeline and pipeline[0].get('enabled', True):
+        run_interval = host_config.getint(host_section, 'run_interval_seconds', fallback=3600)
+        last_run = state_manager.get_last_cycle_run_timestamp(host_section, test_mode)
+        dues.append(last_run.timestamp() + run_interval if last_run else now)
+    report_dir = system_settings.get('System', 'report_directory', fallback='reports')
+    for i in range(1, len(pipeline)):
+        if not pipeline[i].get('enabled', True): continue
+        pending, _ = _pending_stage_reports(report_dir, host_section, i, pipeline[i-1], test_mode)
+        if len(pending) >= int(pipeline[i].get('trigger_threshold', 10)):
+            dues.append(now)
+            break
+
+    due = min(dues) if dues else now + retry
+    return max(due, now + retry) if after_run else due
 
 def main():
+    # // Snapshot config dung chung: moi vong chi stat file, parse lai khi mtime/size doi
+    host_service = config_service.service_for(CONFIG_FILE)
+    sys_service = config_service.service_for(SYSTEM_SETTINGS_FILE)
+    next_due = lambda host, now, after_run: _host_next_due(host_service.get().parser, host, sys_service.get().parser, now, after_run)
+    run_host = lambda host: process_host_pipeline(host_service.get().parser, host, sys_service.get().parser)
+    host_scheduler = None
     while True:
         try:
-            sys_conf = configparser.ConfigParser(interpolation=None); sys_conf.read(SYSTEM_SETTINGS_FILE)
-            host_conf = configparser.ConfigParser(interpolation=None); host_conf.read(CONFIG_FILE)
-            
-            for sec in [s for s in host_conf.sections() if s.startswith(('Firewall_', 'Host_'))]:
-                if host_conf.getboolean(sec, 'enabled', fallback=True):
-                    process_host_pipeline(host_conf, sec, sys_conf)
-            time.sleep(sys_conf.getint('System', 'scheduler_check_interval_seconds', fallback=60))
+            sys_conf = sys_service.get().parser
+            max_parallel_hosts = sys_conf.getint('System', 'scheduler_max_parallel_hosts', fallback=scheduler.DEFAULT_MAX_PARALLEL_HOSTS)
+            if host_scheduler is None:
+                host_scheduler = scheduler.HostScheduler(max_parallel_hosts)
+                # // Host sua config (vd run_interval_seconds) -> tinh lai han ngay, khong doi lan chay cu
+                host_service.subscribe(lambda changed, snapshot: host_scheduler.reschedule(changed, next_due))
+            else:
+                # // Sua scheduler_max_parallel_hosts khong can restart
+                host_scheduler.resize(max_parallel_hosts)
+
+            # // Moi host 1 muc trong heap; host bi ket retry Gemini khong chan lich cua host khac
+            host_scheduler.sync(host_service.get().enabled_hosts(), next_due)
+            host_scheduler.dispatch(run_host, next_due)
+            host_scheduler.wait(config_service.RELOAD_CHECK_SECONDS)
         except Exception as e:
             logging.error(f"Main Loop Error: {e}")
             time.sleep(60)
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="AI Log Analyzer scheduler")
+    parser.add_argument('--host', help="Host section (vd: Host_pfSense) cho che do analyze window")
+    parser.add_argument('--window-start', help="ISO datetime, vd: 2025-10-16T08:00:00")
+    parser.add_argument('--window-end', help="ISO datetime, vd: 2025-10-16T12:00:00")
+    parser.add_argument('--rebuild-report-index', action='store_true', help="Quet lai thu muc bao cao va build lai index roi thoat")
+    args = parser.parse_args()
+
+    if args.rebuild_report_index:
+        sys_conf = configparser.ConfigParser(interpolation=None); sys_conf.read(SYSTEM_SETTINGS_FILE)
+        count = report_index.rebuild(sys_conf.get('System', 'report_directory', fallback='reports'))
+        logging.info(f"Report index: da build lai {count} bao cao.")
+        raise SystemExit(0)
+
+    if args.host:
+        if not (args.window_start and args.window_end):
+            parser.error("--host can --window-start va --window-end")
+        sys_conf = configparser.ConfigParser(interpolation=None); sys_conf.read(SYSTEM_SETTINGS_FILE)
+        host_conf = configparser.ConfigParser(interpolation=None); host_conf.read(CONFIG_FILE)
+        if not host_conf.has_section(args.host):
+            parser.error(f"Khong tim thay host '{args.host}' trong {CONFIG_FILE}")
+        ok = run_window_analysis(host_conf, args.host, sys_conf, datetime.fromisoformat(args.window_start), datetime.fromisoformat(args.window_end))
+        raise SystemExit(0 if ok else 1)
+
     main()
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+
+# // So request Gemini dong thoi toi da cua ca process khi dung engine async (System: max_concurrent_requests > 0 thi dung gia tri do)
+DEFAULT_MAX_IN_FLIGHT = 200
+# // Han moi lan goi generate (giay); qua han -> thu lai nhu DeadlineExceeded
+DEFAULT_CALL_DEADLINE_SECONDS = 300
+
+
+class AsyncEngine:
+    """
+    1 event loop chay trong thread nen, dung chung cho moi host pipeline cua process.
+    submit(coro, max_in_flight) tu thread bat ky -> concurrent.futures.Future (dung duoc voi concurrent.futures.wait);
+    future.cancel() huy task tren loop. Task chay duoi semaphore toan cuc theo max_in_flight.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._semaphores = {}
+        self._lock = threading.Lock()
+        self.metrics = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "in_flight": 0, "peak_in_flight": 0}
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="gemini-async", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self._ready.set()
+        self.loop.run_forever()
+
+    def _count(self, field, delta=1):
+        with self._lock:
+            self.metrics[field] += delta
+            if field == "in_flight":
+                self.metrics["peak_in_flight"] = max(self.metrics["peak_in_flight"], self.metrics["in_flight"])
+
+    async def _guarded(self, coro, max_in_flight):
+        # // Semaphore tao tren loop (chi thread cua loop doc/ghi _semaphores)
+        semaphore = self._semaphores.get(max_in_flight)
+        if semaphore is None:
+            semaphore = self._semaphores[max_in_flight] = asyncio.Semaphore(max_in_flight)
+        try:
+            async with semaphore:
+                self._count("in_flight")
+                try:
+                    result = await coro
+                finally:
+                    self._count("in_flight", -1)
+            self._count("completed")
+            return result
+        except asyncio.CancelledError:
+            self._count("cancelled")
+            raise
+        except Exception:
+            self._count("failed")
+            raise
+        finally:
+            # // Task bi huy truoc khi vao semaphore: dong coroutine chua chay de khong canh bao "never awaited"
+            coro.close()
+
+    def submit(self, coro, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        self._count("submitted")
+        return asyncio.run_coroutine_threadsafe(self._guarded(coro, max_in_flight), self.loop)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.metrics)
+
+    def shutdown(self):
+        """Huy moi task con chay roi dung loop."""
+        def _stop():
+            for task in asyncio.all_tasks(self.loop):
+                task.cancel()
+            self.loop.stop()
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(_stop)
+            self._thread.join(timeout=5)
+
+
+_ENGINE = None
+_ENGINE_LOCK = threading.Lock()
+
+
+def get_engine():
+    """Engine dung chung cua process (client grpc async gan voi loop cua engine nay)."""
+    global _ENGINE
+    with _ENGINE_LOCK:
+        if _ENGINE is None:
+            _ENGINE = AsyncEngine()
+        return _ENGINE
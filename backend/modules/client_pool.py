@@ -0,0 +1,122 @@
+import logging
+import threading
+import contextlib
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+from modules.upload_cache import key_fingerprint
+
+# // _ClientManager la API noi bo cua google-generativeai (da pin phien ban trong requirements.txt).
+# // SDK khong con lop nay -> quay ve genai.configure() toan cuc, moi lan goi giu CONFIGURE_LOCK.
+PER_KEY_CLIENTS = hasattr(genai_client, '_ClientManager')
+# // Khoa cau hinh toan cuc cua genai (configure + upload/get_file + generate o che do fallback)
+CONFIGURE_LOCK = threading.Lock()
+
+
+class ClientPool:
+    """
+    Client Gemini dung lai theo API key (va model): moi key 1 client/channel rieng, tao 1 lan.
+    Legacy (google.generativeai): moi key 1 _ClientManager rieng thay cho genai.configure() toan cuc,
+    GenerativeModel gan client cua key do -> cac worker khac key khong phai xep hang qua 1 lock chung.
+    Modern (genai.Client): 1 Client / key.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._managers = {}
+        self._models = {}
+        self._async_models = {}
+        self._clients = {}
+        self._metrics = {}
+
+    def _count(self, api_key, field):
+        m = self._metrics.setdefault(key_fingerprint(api_key), {"created": 0, "reused": 0})
+        m[field] += 1
+
+    def _generative_client(self, api_key):
+        manager = self._managers.get(api_key)
+        if manager is None:
+            manager = genai_client._ClientManager()
+            manager.configure(api_key=api_key)
+            self._managers[api_key] = manager
+        return manager.get_default_client("generative")
+
+    def generative_model(self, api_key, model_name):
+        """GenerativeModel (legacy) dung chung cho (key, model)."""
+        with self._lock:
+            model = self._models.get((api_key, model_name))
+            if model is not None:
+                self._count(api_key, "reused")
+                return model
+            model = genai.GenerativeModel(model_name)
+            model._client = self._generative_client(api_key)
+            self._models[(api_key, model_name)] = model
+            self._count(api_key, "created")
+            logging.info(f"Tao Gemini client cho key {key_fingerprint(api_key)} / model '{model_name}'.")
+            return model
+
+    @contextlib.contextmanager
+    def legacy_model(self, api_key, model_name):
+        """
+        GenerativeModel (legacy) cho (key, model) trong khoi with.
+        PER_KEY_CLIENTS: model dung chung cua pool, khong khoa. Nguoc lai: genai.configure(key) + model moi,
+        giu CONFIGURE_LOCK den het khoi (cac key xep hang nhu truoc khi co pool).
+        """
+        if PER_KEY_CLIENTS:
+            yield self.generative_model(api_key, model_name)
+            return
+        with CONFIGURE_LOCK:
+            genai.configure(api_key=api_key)
+            yield genai.GenerativeModel(model_name)
+
+    def async_generative_model(self, api_key, model_name):
+        """
+        GenerativeModel cho generate_content_async: client grpc async gan voi event loop tao ra no
+        -> chi goi tu event loop cua async_engine (1 loop cho ca process).
+        """
+        with self._lock:
+            model = self._async_models.get((api_key, model_name))
+            if model is not None:
+                self._count(api_key, "reused")
+                return model
+            manager = self._managers.get(api_key)
+            if manager is None:
+                self._generative_client(api_key)
+                manager = self._managers[api_key]
+            model = genai.GenerativeModel(model_name)
+            model._async_client = manager.get_default_client("generative_async")
+            self._async_models[(api_key, model_name)] = model
+            self._count(api_key, "created")
+            return model
+
+    def client(self, api_key):
+        """genai.Client (ban moi) dung chung theo key."""
+        with self._lock:
+            client = self._clients.get(api_key)
+            if client is not None:
+                self._count(api_key, "reused")
+                return client
+            client = self._clients[api_key] = genai.Client(api_key=api_key)
+            self._count(api_key, "created")
+            return client
+
+    def stats(self):
+        """{"created", "reused", "per_key_clients", "keys": {fingerprint: {"created", "reused"}}}."""
+        with self._lock:
+            keys = {fp: dict(m) for fp, m in self._metrics.items()}
+        return {
+            "created": sum(m["created"] for m in keys.values()),
+            "reused": sum(m["reused"] for m in keys.values()),
+            "per_key_clients": PER_KEY_CLIENTS,
+            "keys": keys,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+            self._managers.clear()
+            self._models.clear()
+            self._async_models.clear()
+            self._clients.clear()
+
+
+POOL = ClientPool()
@@ -0,0 +1,206 @@
+import os
+import json
+import logging
+import threading
+import functools
+import configparser
+from dataclasses import dataclass
+from types import MappingProxyType
+
+HOST_PREFIXES = ('Firewall_', 'Host_')
+# // Scheduler kiem tra file config toi da moi N giay (chi os.stat, khong parse)
+RELOAD_CHECK_SECONDS = 15
+
+
+def _freeze(value):
+    """dict -> MappingProxyType, list -> tuple (de quy): snapshot dung chung giua cac thread khong bi sua."""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+@functools.lru_cache(maxsize=256)
+def parse_pipeline(raw):
+    """pipeline_config (JSON) -> tuple stage chi doc; moi chuoi JSON chi parse 1 lan. JSON loi -> ()."""
+    try:
+        pipeline = json.loads(raw or '[]')
+    except ValueError:
+        logging.error(f"pipeline_config khong hop le: {raw[:80]}")
+        return ()
+    return _freeze(pipeline) if isinstance(pipeline, list) else ()
+
+
+def host_pipeline(host_config, host_section):
+    return parse_pipeline(host_config.get(host_section, 'pipeline_config', fallback='[]'))
+
+
+class ReadOnlyConfigParser(configparser.ConfigParser):
+    """Parser cua snapshot dung chung: sau freeze() moi thao tac ghi -> TypeError (can ghi thi parse moi duoi file_lock)."""
+
+    _frozen = False
+
+    def freeze(self):
+        self._frozen = True
+        return self
+
+    def _check_writable(self):
+        if self._frozen:
+            raise TypeError("Config snapshot chi doc: doc file moi (writable) de sua.")
+
+    def read(self, *args, **kwargs):
+        self._check_writable()
+        return super().read(*args, **kwargs)
+
+    def read_file(self, *args, **kwargs):
+        self._check_writable()
+        return super().read_file(*args, **kwargs)
+
+    def read_string(self, *args, **kwargs):
+        self._check_writable()
+        return super().read_string(*args, **kwargs)
+
+    def read_dict(self, *args, **kwargs):
+        self._check_writable()
+        return super().read_dict(*args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        self._check_writable()
+        return super().set(*args, **kwargs)
+
+    def add_section(self, *args, **kwargs):
+        self._check_writable()
+        return super().add_section(*args, **kwargs)
+
+    def remove_section(self, *args, **kwargs):
+        self._check_writable()
+        return super().remove_section(*args, **kwargs)
+
+    def remove_option(self, *args, **kwargs):
+        self._check_writable()
+        return super().remove_option(*args, **kwargs)
+
+
+@dataclass(frozen=True)
+class HostSnapshot:
+    section: str
+    hostname: str
+    enabled: bool
+    run_interval_seconds: int
+    pipeline: tuple
+    options: MappingProxyType
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """
+    1 lan parse cua 1 file ini. parser dung chung la ReadOnlyConfigParser (ghi -> TypeError;
+    can ghi thi doc file moi duoi file_lock). version = (mtime_ns, size) cua file luc parse.
+    """
+    path: str
+    version: tuple
+    parser: ReadOnlyConfigParser
+    hosts: MappingProxyType
+
+    def enabled_hosts(self):
+        return [h.section for h in self.hosts.values() if h.enabled]
+
+
+def _file_version(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def _build_snapshot(path, version, allow_no_value):
+    parser = ReadOnlyConfigParser(interpolation=None, allow_no_value=allow_no_value)
+    parser.read(path, encoding='utf-8')
+    parser.freeze()
+    hosts = {}
+    for section in parser.sections():
+        if not section.startswith(HOST_PREFIXES):
+            continue
+        try:
+            run_interval = parser.getint(section, 'run_interval_seconds', fallback=3600)
+        except ValueError:
+            run_interval = 3600
+        try:
+            enabled = parser.getboolean(section, 'enabled', fallback=True)
+        except ValueError:
+            enabled = True
+        hosts[section] = HostSnapshot(
+            section=section,
+            hostname=parser.get(section, 'SysHostname', fallback=section),
+            enabled=enabled,
+            run_interval_seconds=run_interval,
+            pipeline=host_pipeline(parser, section),
+            options=MappingProxyType(dict(parser.items(section))),
+        )
+    return ConfigSnapshot(path, version, parser, MappingProxyType(hosts))
+
+
+def changed_hosts(old, new):
+    """Host them / xoa / doi bat ky option nao giua 2 snapshot."""
+    old_hosts = old.hosts if old else {}
+    sections = set(old_hosts) | set(new.hosts)
+    return {s for s in sections if s not in old_hosts or s not in new.hosts or old_hosts[s].options != new.hosts[s].options}
+
+
+class ConfigService:
+    """
+    Cache snapshot cua 1 file ini: get() chi stat file, parse lai khi mtime/size doi.
+    subscribe(callback) -> callback(changed_hosts, snapshot) sau moi lan nap lai co host thay doi.
+    """
+
+    def __init__(self, path, allow_no_value=False):
+        self.path = path
+        self.allow_no_value = allow_no_value
+        self._snapshot = None
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def get(self):
+        version = _file_version(self.path)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._lock:
+            old = self._snapshot
+            if old is not None and old.version == version:
+                return old
+            snapshot = _build_snapshot(self.path, version, self.allow_no_value)
+            self._snapshot = snapshot
+        changed = changed_hosts(old, snapshot)
+        if old is not None:
+            logging.info(f"Nap lai config '{self.path}' ({len(changed)} host thay doi).")
+        if changed:
+            for callback in list(self._listeners):
+                try:
+                    callback(changed, snapshot)
+                except Exception as e:
+                    logging.error(f"Config listener loi: {e}")
+        return snapshot
+
+
+_SERVICES = {}
+_SERVICES_LOCK = threading.Lock()
+
+
+def service_for(path, allow_no_value=False):
+    """ConfigService dung chung theo (duong dan file, allow_no_value) (api.py va main.py cung dung)."""
+    key = (os.path.abspath(path), allow_no_value)
+    with _SERVICES_LOCK:
+        service = _SERVICES.get(key)
+        if service is None:
+            service = _SERVICES[key] = ConfigService(path, allow_no_value)
+        return service
+
+
+def load(path, allow_no_value=False):
+    return service_for(path, allow_no_value).get()
@@ -25,7 +25,9 @@ def read_bonus_context_files(config, host_section):
         'final_summary_enabled', 'summaries_per_final_report', 'final_summary_recipient_emails',
         'final_summary_prompt_file',
         'gemini_model', 'summary_gemini_model', 'final_summary_model',
-        'smtp_profile', 'pipeline_config', 'chunk_size', 'context_files'
+        'smtp_profile', 'pipeline_config', 'chunk_size', 'context_files',
+        'parallel_read_threshold_mb', 'log_format', 'template_mining', 'local_stats', 'chunk_token_budget',
+        'exact_token_count', 'max_concurrency', 'worker_assignment'
     ]
     
     context_keys = [key for key in config.options(host_section) if key not in standard_keys and not key.startswith('context_file_')]
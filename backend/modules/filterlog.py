@@ -0,0 +1,200 @@
+import csv
+import random
+import socket
+from array import array
+from datetime import datetime
+import numpy as np
+
+# // Cot filterlog pfSense (CSV sau "filterlog[pid]: "): rule, interface, action, direction, ip version,
+# // roi proto/src/dst/port theo IPv4 / IPv6
+FILTERLOG_RULE = 0
+FILTERLOG_INTERFACE = 4
+FILTERLOG_ACTION = 6
+FILTERLOG_DIRECTION = 7
+FILTERLOG_IP_VERSION = 8
+FILTERLOG_FIELDS = {
+    '4': {"proto": 16, "src": 18, "dst": 19, "src_port": 20, "dst_port": 21},
+    '6': {"proto": 12, "src": 15, "dst": 16, "src_port": 17, "dst_port": 18},
+}
+FILTERLOG_PORT_PROTOCOLS = ('tcp', 'udp')
+
+# // Byte/dong cua FilterlogTable: epoch 4 + src 4 + dst 4 + 2 port x 2 + rule 2 + interface 2 + action/direction/proto 1 x 3.
+# // 10M dong ~ 230 MB (array du phong them toi ~12% khi mo rong), so voi ~400+ B/dong khi giu str + datetime.
+BYTES_PER_ROW = 23
+
+COLUMNS = ("epoch", "rule", "interface", "action", "direction", "proto", "src", "dst", "src_port", "dst_port")
+ENCODED_COLUMNS = ("rule", "interface", "action", "direction", "proto")
+
+
+def parse_filterlog(line):
+    """
+    Tach 1 dong filterlog thanh (rule, interface, action, direction, proto, src, dst, src_port, dst_port) dang str.
+    Tra ve None neu khong phai filterlog. Truong khong co (vd port cua icmp) -> ''.
+    """
+    marker = line.find('filterlog')
+    if marker < 0:
+        return None
+    start = line.find(': ', marker)
+    if start < 0:
+        return None
+    fields = line[start + 2:].rstrip('\n').split(',')
+    if len(fields) <= FILTERLOG_IP_VERSION:
+        return None
+    head = (fields[FILTERLOG_RULE], fields[FILTERLOG_INTERFACE], fields[FILTERLOG_ACTION], fields[FILTERLOG_DIRECTION])
+    cols = FILTERLOG_FIELDS.get(fields[FILTERLOG_IP_VERSION])
+    if cols is None or len(fields) <= cols["dst"]:
+        return head + ('', '', '', '', '')
+    proto = fields[cols["proto"]]
+    if proto in FILTERLOG_PORT_PROTOCOLS and len(fields) > cols["dst_port"]:
+        ports = (fields[cols["src_port"]], fields[cols["dst_port"]])
+    else:
+        ports = ('', '')
+    return head + (proto, fields[cols["src"]], fields[cols["dst"]]) + ports
+
+
+def ip_to_int(ip):
+    """IPv4 -> uint32 (None neu khong phai IPv4)."""
+    try:
+        return int.from_bytes(socket.inet_aton(ip), 'big') if ip.count('.') == 3 else None
+    except OSError:
+        return None
+
+
+def int_to_ip(value):
+    return socket.inet_ntoa(int(value).to_bytes(4, 'big'))
+
+
+class _Dictionary:
+    """Ma hoa tu dien: chuoi lap lai (interface, action...) -> so nguyen nho."""
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def encode(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class FilterlogTable:
+    """
+    Luu filterlog dang struct-of-arrays thay cho str/tuple: epoch array('I'), IPv4 uint32,
+    port uint16, rule/interface/action/direction/proto ma hoa tu dien. Xem BYTES_PER_ROW.
+    IPv6 (it gap) luu rieng theo chi so dong, cot src/dst = 0.
+    """
+
+    def __init__(self):
+        self.epoch = array('I')
+        self.src = array('I')
+        self.dst = array('I')
+        self.src_port = array('H')
+        self.dst_port = array('H')
+        self.rule = array('H')
+        self.interface = array('H')
+        self.action = array('B')
+        self.direction = array('B')
+        self.proto = array('B')
+        self.dictionaries = {name: _Dictionary() for name in ENCODED_COLUMNS}
+        self.ipv6 = {}
+
+    def __len__(self):
+        return len(self.epoch)
+
+    def nbytes(self):
+        return sum(getattr(self, name).itemsize * len(self) for name in COLUMNS)
+
+    def append(self, line, epoch):
+        """Them 1 dong; tra ve False neu khong phai filterlog."""
+        return self.append_record(parse_filterlog(line), epoch)
+
+    def append_record(self, fields, epoch):
+        """Them 1 dong da tach bang parse_filterlog()."""
+        if fields is None:
+            return False
+        rule, interface, action, direction, proto, src, dst, src_port, dst_port = fields
+        row = len(self.epoch)
+        dicts = self.dictionaries
+        self.epoch.append(int(epoch or 0))
+        self.rule.append(dicts["rule"].encode(rule))
+        self.interface.append(dicts["interface"].encode(interface))
+        self.action.append(dicts["action"].encode(action))
+        self.direction.append(dicts["direction"].encode(direction))
+        self.proto.append(dicts["proto"].encode(proto))
+        src_int, dst_int = ip_to_int(src), ip_to_int(dst)
+        if (src and src_int is None) or (dst and dst_int is None):
+            self.ipv6[row] = (src, dst)
+        self.src.append(src_int or 0)
+        self.dst.append(dst_int or 0)
+        self.src_port.append(int(src_port) if src_port.isdigit() else 0)
+        self.dst_port.append(int(dst_port) if dst_port.isdigit() else 0)
+        return True
+
+    def column(self, name, start=0, end=None):
+        """
+        View numpy (khong copy) cua 1 cot trong khoang dong [start, end).
+        Khong giu view khi con append (array dang export buffer thi khong mo rong duoc).
+        """
+        data = getattr(self, name)
+        view = np.frombuffer(data, dtype=np.dtype(data.typecode)) if len(data) else np.zeros(0, dtype=np.dtype(data.typecode))
+        return view[start:end]
+
+    def _decode(self, name, value):
+        if name in ENCODED_COLUMNS:
+            return self.dictionaries[name].values[value]
+        if not value:
+            return ''
+        if name in ("src", "dst"):
+            return int_to_ip(value)
+        return str(value)
+
+    def counts(self, name, start=0, end=None):
+        """{gia tri: so dong} cua 1 cot (bo gia tri rong: port 0 / IP 0 / chuoi rong)."""
+        values = self.column(name, start, end)
+        if name in ENCODED_COLUMNS:
+            dictionary = self.dictionaries[name].values
+            counts = np.bincount(values, minlength=len(dictionary))
+            return {dictionary[code]: int(counts[code]) for code in np.nonzero(counts)[0] if dictionary[code]}
+        result = {}
+        if name in ("src", "dst"):
+            # // Dong IPv6 co src/dst = 0 trong cot -> lay tu bang phu
+            side = 0 if name == "src" else 1
+            for row in np.nonzero(values == 0)[0] + start:
+                ip = self.ipv6.get(int(row), ('', ''))[side]
+                if ip:
+                    result[ip] = result.get(ip, 0) + 1
+        keys, counts = np.unique(values[values != 0], return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            result[self._decode(name, key)] = count
+        return result
+
+    def minute_counts(self, start=0, end=None):
+        epochs = self.column("epoch", start, end)
+        epochs = epochs[epochs != 0]
+        minutes, counts = np.unique(epochs.astype(np.int64) // 60, return_counts=True)
+        return dict(zip(minutes.tolist(), counts.tolist()))
+
+    def row(self, index):
+        record = {name: self._decode(name, getattr(self, name)[index]) for name in COLUMNS if name != "epoch"}
+        record["epoch"] = self.epoch[index]
+        if index in self.ipv6:
+            record["src"], record["dst"] = self.ipv6[index]
+        return record
+
+    def sample(self, n, seed=None, start=0, end=None):
+        """Lay ngau nhien n dong (dict) trong khoang [start, end), giu thu tu."""
+        end = len(self) if end is None else end
+        rows = range(start, end)
+        picked = sorted(random.Random(seed).sample(rows, min(n, len(rows))))
+        return [self.row(i) for i in picked]
+
+    def export_csv(self, fileobj, tz=None):
+        """Ghi toan bo bang ra CSV (header = COLUMNS, epoch -> ISO theo tz)."""
+        writer = csv.writer(fileobj)
+        writer.writerow(COLUMNS)
+        for i in range(len(self)):
+            record = self.row(i)
+            record["epoch"] = datetime.fromtimestamp(record["epoch"], tz).isoformat() if record["epoch"] else ""
+            writer.writerow([record[name] for name in COLUMNS])
@@ -1,18 +1,25 @@
 
 import os
+import asyncio
 import logging
 import time
-import threading
+import functools
 import google.generativeai as genai
 from google.api_core import exceptions as google_exceptions
 from modules import state_manager
+from modules import upload_cache
+from modules import rate_limiter
+from modules import token_budget
+from modules import client_pool
+from modules.client_pool import POOL as CLIENT_POOL
 
 # // cau hinh retry
 MAX_RETRIES = 3
 INITIAL_BACKOFF = 2
 
-# // Lock toan cuc cho che do Legacy (thu vien cu)
-_LEGACY_GLOBAL_LOCK = threading.Lock()
+# // genai.configure() toan cuc chi con dung cho upload file (hiem, da cache); generate/count dung CLIENT_POOL theo key.
+# // Dung chung khoa voi che do fallback cua client_pool (SDK khong co _ClientManager).
+_UPLOAD_CONFIG_LOCK = client_pool.CONFIGURE_LOCK
 
 def _upload_and_wait_file(path, host_id):
     """Helper de upload file len Gemini va doi processing (neu can)."""
@@ -35,14 +42,81 @@ def _upload_and_wait_file(path, host_id):
         logging.error(f"[{host_id}] Error uploading context file '{path}': {e}")
         return None
 
-def analyze_with_gemini(host_id, content, bonus_context, api_key, prompt_file, model_name, key_alias="Unknown", test_mode=False, context_file_paths=None):
-    """
-    Gui yeu cau phan tich toi Gemini.
-    Ho tro File API cho PDF/Images.
-    """
+def _upload_with_key(path, api_key, host_id):
+    """upload_file/get_file cua genai dung cau hinh toan cuc -> giu lock trong luc upload (chi khi cache miss)."""
+    with _UPLOAD_CONFIG_LOCK:
+        genai.configure(api_key=api_key)
+        return _upload_and_wait_file(path, host_id)
+
+def _get_file_with_key(name, api_key):
+    with _UPLOAD_CONFIG_LOCK:
+        genai.configure(api_key=api_key)
+        return genai.get_file(name)
+
+@functools.lru_cache(maxsize=32)
+def _estimator(model_name):
+    return token_budget.TokenEstimator(model_name)
+
+def _add_queue_wait(usage_out, waited):
+    if usage_out is not None:
+        usage_out['queue_wait_seconds'] = round(usage_out.get('queue_wait_seconds', 0.0) + waited, 3)
+
+def _wait_for_slot(host_id, api_key, model_name, prompt_text, key_alias, test_mode, usage_out):
+    """Cho slot rate limiter (RPM/TPM theo key + model); cong don thoi gian cho vao usage_out['queue_wait_seconds']."""
+    try:
+        waited = rate_limiter.acquire(api_key, model_name, _estimator(model_name).estimate(prompt_text), key_alias, test_mode)
+    except (OSError, TimeoutError) as e:
+        # // State rate limit loi -> khong chan request, de Gemini tu tra 429 neu qua quota
+        logging.warning(f"[{host_id}] Rate limiter loi ({e}), goi Gemini khong cho slot.")
+        waited = 0.0
+    _add_queue_wait(usage_out, waited)
+
+async def _wait_for_slot_async(host_id, api_key, model_name, prompt_text, key_alias, test_mode, usage_out):
+    """Nhu _wait_for_slot cho engine async: cho bang asyncio.sleep tren loop (rate_limiter.acquire_async)."""
+    try:
+        waited = await rate_limiter.acquire_async(api_key, model_name, _estimator(model_name).estimate(prompt_text), key_alias, test_mode)
+    except (OSError, TimeoutError) as e:
+        logging.warning(f"[{host_id}] Rate limiter loi ({e}), goi Gemini khong cho slot.")
+        waited = 0.0
+    _add_queue_wait(usage_out, waited)
+
+def _record_usage(response, usage_out):
+    """Chep usage_metadata (prompt/output tokens that) cua response vao usage_out neu nguoi goi can."""
+    if usage_out is None:
+        return
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return
+    usage_out['prompt_tokens'] = getattr(usage, 'prompt_token_count', None)
+    usage_out['output_tokens'] = getattr(usage, 'candidates_token_count', None)
+
+def count_tokens(content, api_key, model_name):
+    """Dem token that cua content qua API countTokens (dung lam hook cho token_budget.TokenEstimator)."""
+    with CLIENT_POOL.legacy_model(api_key, model_name) as model:
+        return model.count_tokens(content).total_tokens
+
+# // Safety settings
+SAFETY_SETTINGS_MODERN = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"}
+]
+
+SAFETY_SETTINGS_LEGACY = {
+    'HARM_CATEGORY_HARASSMENT': 'BLOCK_NONE',
+    'HARM_CATEGORY_HATE_SPEECH': 'BLOCK_NONE',
+    'HARM_CATEGORY_SEXUALLY_EXPLICIT': 'BLOCK_NONE',
+    'HARM_CATEGORY_DANGEROUS_CONTENT': 'BLOCK_NONE'
+}
+
+RETRY_EXHAUSTED_MESSAGE = "Fatal Gemini Error: Không thể nhận phân tích từ Gemini sau nhiều lần thử lại (Lỗi mạng hoặc Rate Limit)."
+
+def _prepare_request(host_id, content, bonus_context, api_key, prompt_file, test_mode, context_file_paths):
+    """Dung prompt + file dinh kem. Tra ve (request_contents, prompt_text, None) hoac (None, None, chuoi tra ve ngay)."""
     if not content or not content.strip():
         logging.warning(f"[{host_id}] Noi dung trong, bo qua phan tich.")
-        return "Không có dữ liệu nào để phân tích trong khoảng thời gian được chọn."
+        return None, None, "Không có dữ liệu nào để phân tích trong khoảng thời gian được chọn."
 
     # 1. Chuan bi Prompt Text
     try:
@@ -50,7 +124,7 @@ def analyze_with_gemini(host_id, content, bonus_context, api_key, prompt_file, m
             prompt_template = f.read()
     except FileNotFoundError:
         logging.error(f"[{host_id}] Loi: Khong tim thay file template '{prompt_file}'.")
-        return f"Fatal Gemini Error: Không tìm thấy file '{prompt_file}'."
+        return None, None, f"Fatal Gemini Error: Không tìm thấy file '{prompt_file}'."
 
     prompt_filename = os.path.basename(prompt_file).lower()
     is_summary_or_final = 'summary' in prompt_filename
@@ -62,55 +136,102 @@ def analyze_with_gemini(host_id, content, bonus_context, api_key, prompt_file, m
             prompt_text = prompt_template.format(logs_content=content, bonus_context=bonus_context)
     except KeyError as e:
         logging.error(f"[{host_id}] Loi placeholder trong prompt '{prompt_file}'. Chi tiet: {e}")
-        return f"Fatal Gemini Error: Placeholder không đúng trong file prompt '{prompt_file}'."
-
-    # // Kiem tra xem co phai ban moi (ho tro Client) hay khong
-    has_client_support = hasattr(genai, 'Client')
-    
-    # // Safety settings
-    safety_settings_modern = [
-        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"}
-    ]
-    
-    safety_settings_legacy = {
-        'HARM_CATEGORY_HARASSMENT': 'BLOCK_NONE',
-        'HARM_CATEGORY_HATE_SPEECH': 'BLOCK_NONE',
-        'HARM_CATEGORY_SEXUALLY_EXPLICIT': 'BLOCK_NONE',
-        'HARM_CATEGORY_DANGEROUS_CONTENT': 'BLOCK_NONE'
-    }
-
-    logging.info(f"[{host_id}] Su dung Gemini model: '{model_name}' (Mode: {'Modern/Parallel' if has_client_support else 'Legacy/Serialized'})")
+        return None, None, f"Fatal Gemini Error: Placeholder không đúng trong file prompt '{prompt_file}'."
 
     uploaded_files = []
     
     if context_file_paths:
         try:
-            genai.configure(api_key=api_key)
+            # // Cache theo (sha256 file, API key): chi upload khi chua co / het han / da bi xoa
             for path in context_file_paths:
-                f_obj = _upload_and_wait_file(path, host_id)
-                if f_obj:
-                    uploaded_files.append(f_obj)
+                entry = upload_cache.get_or_upload(path, api_key, lambda p: _upload_with_key(p, api_key, host_id),
+                                                   lambda name: _get_file_with_key(name, api_key), host_id, test_mode)
+                if entry:
+                    uploaded_files.append(upload_cache.to_part(entry))
         except Exception as e:
             logging.error(f"[{host_id}] Loi cau hinh API Key de upload file: {e}")
 
-
     request_contents = [prompt_text]
     if uploaded_files:
         request_contents.extend(uploaded_files)
+    return request_contents, prompt_text, None
+
+def _modern_text(response):
+    """Text cua response genai.Client -> (text, None) hoac (None, chuoi loi)."""
+    # // FIX CRASH: Handle response.text accessor error safely
+    try:
+        text_response = response.text
+    except ValueError:
+        finish_reason = "UNKNOWN"
+        try:
+            # Safety check cho candidates
+            if hasattr(response, 'candidates') and response.candidates:
+                if hasattr(response.candidates[0], 'finish_reason'):
+                    finish_reason = response.candidates[0].finish_reason.name
+        except: pass
+        
+        return None, f"Fatal Gemini Error: Gemini blocked response. Reason: {finish_reason}"
+    
+    if not text_response:
+         return None, f"Fatal Gemini Error: Empty response from Gemini."
+    return text_response, None
+
+def _legacy_text(response):
+    """Text cua response GenerativeModel (legacy) -> (text, None) hoac (None, chuoi loi)."""
+    if not response.parts:
+        try:
+            if response.prompt_feedback and response.prompt_feedback.block_reason:
+                return None, f"Fatal Gemini Error: Gemini blocked response. Reason: {response.prompt_feedback.block_reason}"
+        except: pass
+        return None, "Fatal Gemini Error: Gemini blocked response (Empty response parts)."
+    return response.text, None
+
+def _on_rate_limited(host_id, api_key, model_name, test_mode, usage_out, attempt, max_retries):
+    """Xu ly 429: tra ve None (thu lai ngay), so giay can ngu truoc lan thu sau, hoac False (het luot thu)."""
+    if usage_out is not None:
+        usage_out['rate_limited'] = usage_out.get('rate_limited', 0) + 1
+    # // Lan thu cuoi: tra ve ngay (key pool chuyen sang key khac), khong ngu vo ich
+    if attempt + 1 >= max_retries:
+        rate_limiter.penalize(api_key, model_name, test_mode)
+        return False
+    # // Model co [RateLimits]: xa bucket, lan thu sau cho slot qua rate limiter thay vi ngu mu
+    if rate_limiter.penalize(api_key, model_name, test_mode):
+        logging.warning(f"[{host_id}] Quota exceeded (429). Cho slot rate limiter...")
+        return None
+    wait_time = INITIAL_BACKOFF * (10 ** attempt)
+    logging.warning(f"[{host_id}] Quota exceeded (429). Waiting {wait_time}s...")
+    return wait_time
+
+def _legacy_generate_locked(api_key, model_name, request_contents):
+    with CLIENT_POOL.legacy_model(api_key, model_name) as model:
+        return model.generate_content(request_contents, safety_settings=SAFETY_SETTINGS_LEGACY)
+
+def analyze_with_gemini(host_id, content, bonus_context, api_key, prompt_file, model_name, key_alias="Unknown", test_mode=False, context_file_paths=None, usage_out=None, max_retries=MAX_RETRIES):
+    """
+    Gui yeu cau phan tich toi Gemini.
+    Ho tro File API cho PDF/Images.
+    usage_out (dict, tuy chon): duoc dien prompt_tokens / output_tokens tu usage_metadata cua response.
+    max_retries: key pool dung 1 -> gap 429 tra ve ngay de chuyen sang key khac thay vi cho tren key nay.
+    """
+    request_contents, prompt_text, early_result = _prepare_request(host_id, content, bonus_context, api_key, prompt_file, test_mode, context_file_paths)
+    if early_result is not None:
+        return early_result
 
-    for attempt in range(MAX_RETRIES):
+    # // Kiem tra xem co phai ban moi (ho tro Client) hay khong
+    has_client_support = hasattr(genai, 'Client')
+
+    logging.info(f"[{host_id}] Su dung Gemini model: '{model_name}' (Mode: {'Modern' if has_client_support else 'Legacy'}, client pool theo key)")
+
+    for attempt in range(max_retries):
         try:
             if attempt > 0:
-                logging.info(f"[{host_id}] Retry attempt {attempt+1}/{MAX_RETRIES}...")
+                logging.info(f"[{host_id}] Retry attempt {attempt+1}/{max_retries}...")
 
-            text_response = ""
+            _wait_for_slot(host_id, api_key, model_name, prompt_text, key_alias, test_mode, usage_out)
 
             if has_client_support:
                 from google.generativeai import types
-                client = genai.Client(api_key=api_key)
+                client = CLIENT_POOL.client(api_key)
                 
                 logging.info(f"[{host_id}] Counting API usage for alias: {key_alias}")
                 state_manager.increment_api_usage(key_alias, test_mode)
@@ -118,57 +239,35 @@ def analyze_with_gemini(host_id, content, bonus_context, api_key, prompt_file, m
                 response = client.models.generate_content(
                     model=model_name,
                     contents=request_contents,
-                    config=types.GenerateContentConfig(safety_settings=safety_settings_modern)
+                    config=types.GenerateContentConfig(safety_settings=SAFETY_SETTINGS_MODERN)
                 )
-                
-                # // FIX CRASH: Handle response.text accessor error safely
-                try:
-                    text_response = response.text
-                except ValueError:
-                    finish_reason = "UNKNOWN"
-                    try:
-                        # Safety check cho candidates
-                        if hasattr(response, 'candidates') and response.candidates:
-                            if hasattr(response.candidates[0], 'finish_reason'):
-                                finish_reason = response.candidates[0].finish_reason.name
-                    except: pass
-                    
-                    return f"Fatal Gemini Error: Gemini blocked response. Reason: {finish_reason}"
-                
-                if not text_response:
-                     return f"Fatal Gemini Error: Empty response from Gemini."
+                text_response, error = _modern_text(response)
 
             else:
-                # --- LEGACY MODE (LOCKED) ---
-                with _LEGACY_GLOBAL_LOCK:
-                    genai.configure(api_key=api_key)
-                    model = genai.GenerativeModel(model_name)
-                    
+                # --- LEGACY MODE: model + client rieng theo key (SDK khong ho tro -> configure + lock toan cuc) ---
+                with CLIENT_POOL.legacy_model(api_key, model_name) as model:
                     # Tracking Usage
                     logging.info(f"[{host_id}] Counting API usage for alias: {key_alias}")
                     state_manager.increment_api_usage(key_alias, test_mode)
                     
                     response = model.generate_content(
                         request_contents,
-                        safety_settings=safety_settings_legacy
+                        safety_settings=SAFETY_SETTINGS_LEGACY
                     )
-                    
-                    if not response.parts:
-                        try:
-                            if response.prompt_feedback and response.prompt_feedback.block_reason:
-                                return f"Fatal Gemini Error: Gemini blocked response. Reason: {response.prompt_feedback.block_reason}"
-                        except: pass
-                        return "Fatal Gemini Error: Gemini blocked response (Empty response parts)."
-
-                    text_response = response.text
+                text_response, error = _legacy_text(response)
 
+            if error is not None:
+                return error
+            _record_usage(response, usage_out)
             logging.info(f"[{host_id}] Nhan phan tich tu Gemini thanh cong.")
             return text_response
 
         except google_exceptions.ResourceExhausted:
-            wait_time = INITIAL_BACKOFF * (10 ** attempt)
-            logging.warning(f"[{host_id}] Quota exceeded (429). Waiting {wait_time}s...")
-            time.sleep(wait_time)
+            wait_time = _on_rate_limited(host_id, api_key, model_name, test_mode, usage_out, attempt, max_retries)
+            if wait_time is False:
+                break
+            if wait_time:
+                time.sleep(wait_time)
             
         except (google_exceptions.ServiceUnavailable, google_exceptions.DeadlineExceeded) as e:
             wait_time = INITIAL_BACKOFF
@@ -179,4 +278,69 @@ def analyze_with_gemini(host_id, content, bonus_context, api_key, prompt_file, m
             logging.error(f"[{host_id}] Fatal Gemini Error: {e}")
             return f"Fatal Gemini Error: {str(e)}"
 
-    return "Fatal Gemini Error: Không thể nhận phân tích từ Gemini sau nhiều lần thử lại (Lỗi mạng hoặc Rate Limit)."
+    return RETRY_EXHAUSTED_MESSAGE
+
+async def analyze_with_gemini_async(host_id, content, bonus_context, api_key, prompt_file, model_name, key_alias="Unknown", test_mode=False, context_file_paths=None, usage_out=None, max_retries=MAX_RETRIES, deadline=None):
+    """
+    Ban async cua analyze_with_gemini (generate_content_async / client.aio), cung ket qua va cach retry.
+    deadline (giay, tuy chon): han cua moi lan goi generate; qua han -> tinh nhu DeadlineExceeded (thu lai).
+    Huy task (CancelledError) duoc truyen ra ngay, khong bi nuot thanh chuoi loi.
+    Cho slot rate limiter bang asyncio.sleep tren loop; I/O ngan (doc prompt, upload, state) chay qua asyncio.to_thread.
+    """
+    request_contents, prompt_text, early_result = await asyncio.to_thread(
+        _prepare_request, host_id, content, bonus_context, api_key, prompt_file, test_mode, context_file_paths)
+    if early_result is not None:
+        return early_result
+
+    has_client_support = hasattr(genai, 'Client')
+
+    for attempt in range(max_retries):
+        try:
+            if attempt > 0:
+                logging.info(f"[{host_id}] Retry attempt {attempt+1}/{max_retries}...")
+
+            await _wait_for_slot_async(host_id, api_key, model_name, prompt_text, key_alias, test_mode, usage_out)
+            await asyncio.to_thread(state_manager.increment_api_usage, key_alias, test_mode)
+
+            if has_client_support:
+                from google.generativeai import types
+                call = CLIENT_POOL.client(api_key).aio.models.generate_content(
+                    model=model_name,
+                    contents=request_contents,
+                    config=types.GenerateContentConfig(safety_settings=SAFETY_SETTINGS_MODERN)
+                )
+                response = await asyncio.wait_for(call, deadline)
+                text_response, error = _modern_text(response)
+            elif client_pool.PER_KEY_CLIENTS:
+                model = CLIENT_POOL.async_generative_model(api_key, model_name)
+                call = model.generate_content_async(request_contents, safety_settings=SAFETY_SETTINGS_LEGACY)
+                response = await asyncio.wait_for(call, deadline)
+                text_response, error = _legacy_text(response)
+            else:
+                # // Fallback: generate dong bo duoi CONFIGURE_LOCK trong thread rieng
+                response = await asyncio.wait_for(asyncio.to_thread(_legacy_generate_locked, api_key, model_name, request_contents), deadline)
+                text_response, error = _legacy_text(response)
+
+            if error is not None:
+                return error
+            _record_usage(response, usage_out)
+            logging.info(f"[{host_id}] Nhan phan tich tu Gemini thanh cong.")
+            return text_response
+
+        except google_exceptions.ResourceExhausted:
+            wait_time = await asyncio.to_thread(_on_rate_limited, host_id, api_key, model_name, test_mode, usage_out, attempt, max_retries)
+            if wait_time is False:
+                break
+            if wait_time:
+                await asyncio.sleep(wait_time)
+
+        except (google_exceptions.ServiceUnavailable, google_exceptions.DeadlineExceeded, asyncio.TimeoutError) as e:
+            wait_time = INITIAL_BACKOFF
+            logging.warning(f"[{host_id}] Network/Service error: {e or 'deadline ' + str(deadline) + 's'}. Retrying in {wait_time}s...")
+            await asyncio.sleep(wait_time)
+
+        except Exception as e:
+            logging.error(f"[{host_id}] Fatal Gemini Error: {e}")
+            return f"Fatal Gemini Error: {str(e)}"
+
+    return RETRY_EXHAUSTED_MESSAGE
@@ -0,0 +1,127 @@
+import math
+import asyncio
+import time
+import logging
+import threading
+from modules import state_manager
+from modules import rate_limiter
+
+# // 429 / loi gan day anh huong diem cua key, giam dan theo e^(-tuoi / HEALTH_DECAY_SECONDS)
+HEALTH_DECAY_SECONDS = 300
+# // Diem tinh theo "giay tuong duong": 429 vua xong ~ cham them 30s, loi khac ~ 10s
+RATE_LIMIT_PENALTY = 30.0
+FAILURE_PENALTY = 10.0
+# // Key chua co du lieu latency
+DEFAULT_LATENCY_SECONDS = 5.0
+
+# // So request dang chay theo key (trong process): chia tai giua cac key khoe nhu nhau
+_IN_FLIGHT = {}
+_IN_FLIGHT_LOCK = threading.Lock()
+
+
+def parse_pool(raw):
+    """key_pool cua stage (list hoac chuoi 'a, b') -> ['profile:a', 'profile:b']; ten profile tran duoc them 'profile:'."""
+    if isinstance(raw, str):
+        raw = raw.split(',')
+    entries = []
+    for item in raw or ():
+        item = str(item).strip()
+        if item and not item.startswith('profile:'):
+            item = f"profile:{item}"
+        if item and item not in entries:
+            entries.append(item)
+    return entries
+
+
+def score(health, in_flight=0, quota_wait=0.0, now=None):
+    """Diem cua 1 key (thap = khoe): latency EWMA x (1 + so request dang chay) + cho quota + phat 429/loi gan day."""
+    now = time.time() if now is None else now
+    health = health or {}
+    latency = health.get("latency_ewma") or DEFAULT_LATENCY_SECONDS
+    value = latency * (1 + in_flight) + quota_wait
+    for field, penalty in (("last_rate_limited_at", RATE_LIMIT_PENALTY), ("last_failure_at", FAILURE_PENALTY)):
+        at = health.get(field)
+        if at:
+            value += penalty * math.exp(-max(0.0, now - at) / HEALTH_DECAY_SECONDS)
+    return value
+
+
+class KeyPool:
+    """
+    Pool API key (profile trong Gemini_Keys) cua 1 stage: moi request gui toi key khoe nhat con quota,
+    loi/429 -> chuyen sang key tiep theo. Ket qua theo key ghi vao api_usage_stats.json (key_health).
+    keys: [(api_key, alias)] da resolve.
+    """
+
+    def __init__(self, keys, model_name, test_mode=False):
+        self.keys = [(k, a) for k, a in keys if k]
+        self.model_name = model_name
+        self.test_mode = test_mode
+
+    def __len__(self):
+        return len(self.keys)
+
+    def ranked(self, tokens=0, now=None):
+        """Key theo thu tu uu tien: key con slot rate limit truoc, trong moi nhom diem thap truoc."""
+        now = time.time() if now is None else now
+        health = state_manager.get_key_health(self.test_mode)
+        with _IN_FLIGHT_LOCK:
+            in_flight = dict(_IN_FLIGHT)
+        ranked = []
+        for order, (api_key, alias) in enumerate(self.keys):
+            wait = rate_limiter.pending_wait(api_key, self.model_name, tokens, self.test_mode)
+            ranked.append((wait > 0, score(health.get(alias), in_flight.get(alias, 0), wait, now), order, api_key, alias))
+        ranked.sort()
+        return [(api_key, alias) for _, _, _, api_key, alias in ranked]
+
+    def _begin(self, alias):
+        with _IN_FLIGHT_LOCK:
+            _IN_FLIGHT[alias] = _IN_FLIGHT.get(alias, 0) + 1
+        return time.monotonic()
+
+    def _finish(self, label, alias, result, started, usage):
+        """Giam in-flight, ghi ket qua key; tra ve True neu request thanh cong."""
+        with _IN_FLIGHT_LOCK:
+            _IN_FLIGHT[alias] -= 1
+        ok = "Fatal Gemini Error" not in result and "Gemini blocked response" not in result
+        # // Thoi gian cho slot rate limit khong tinh vao latency cua key
+        latency = max(0.0, time.monotonic() - started - usage.get('queue_wait_seconds', 0.0))
+        state_manager.record_key_outcome(alias, ok, latency, usage.get('rate_limited', 0), self.test_mode)
+        if not ok:
+            logging.warning(f"[{label}] Key '{alias}' loi ({result[:120]}), chuyen sang key tiep theo trong pool.")
+        return ok
+
+    def call(self, label, request, tokens=0):
+        """
+        request(api_key, alias, usage) -> chuoi ket qua cua analyze_with_gemini (usage: dict usage_out).
+        Thu lan luot cac key theo ranked() toi khi thanh cong. Tra ve (result, alias, usage) cua lan cuoi.
+        """
+        result, alias, usage = "Fatal Gemini Error: Key pool rong.", None, {}
+        for api_key, alias in self.ranked(tokens):
+            usage = {}
+            started = self._begin(alias)
+            try:
+                result = request(api_key, alias, usage)
+            except Exception as e:
+                result = f"Fatal Gemini Error: {e}"
+            if self._finish(label, alias, result, started, usage):
+                break
+        return result, alias, usage
+
+    async def call_async(self, label, request, tokens=0):
+        """Nhu call() voi request(api_key, alias, usage) la coroutine (analyze_with_gemini_async); huy task -> huy luon."""
+        result, alias, usage = "Fatal Gemini Error: Key pool rong.", None, {}
+        for api_key, alias in await asyncio.to_thread(self.ranked, tokens):
+            usage = {}
+            started = self._begin(alias)
+            try:
+                result = await request(api_key, alias, usage)
+            except asyncio.CancelledError:
+                with _IN_FLIGHT_LOCK:
+                    _IN_FLIGHT[alias] -= 1
+                raise
+            except Exception as e:
+                result = f"Fatal Gemini Error: {e}"
+            if await asyncio.to_thread(self._finish, label, alias, result, started, usage):
+                break
+        return result, alias, usage
@@ -0,0 +1,178 @@
+import re
+import calendar
+import logging
+from modules.timestamp_parser import FastTimestampParser, MONTHS
+
+# // Format mac dinh: thu BSD syslog roi ISO tren moi dong (hanh vi cu)
+AUTO_FORMAT = "auto"
+# // So dong mau de nhan dien format va ty le dong khop toi thieu
+DETECT_SAMPLE_LINES = 200
+DETECT_MIN_RATIO = 0.5
+
+
+class BsdSyslogParser(FastTimestampParser):
+    """"Oct 16 10:00:00 host prog[pid]: msg" - chi thu 1 layout."""
+
+    def parse(self, line):
+        last_prefix = self._last_prefix
+        if last_prefix is not None and line.startswith(last_prefix):
+            return self._last_epoch
+        return self._parse_syslog(line)
+
+
+class IsoParser(FastTimestampParser):
+    """"2025-10-16 10:00:00 ..." / "2025-10-16T10:00:00 ..." theo tz cua host."""
+
+    def parse(self, line):
+        last_prefix = self._last_prefix
+        if last_prefix is not None and line.startswith(last_prefix):
+            return self._last_epoch
+        return self._parse_iso(line)
+
+
+class Rfc5424Parser(FastTimestampParser):
+    """
+    "<134>1 2025-10-16T10:00:00.123+07:00 host app ..." - offset nam trong timestamp,
+    khong can tra tz cua host.
+    """
+
+    probe_bytes = 64
+
+    def parse(self, line):
+        if line[:1] != '<':
+            return None
+        start = line.find(' ') + 1
+        end = line.find(' ', start)
+        if start == 0 or end < 0:
+            return None
+        stamp = line[start:end]
+        if stamp == self._last_prefix:
+            return self._last_epoch
+        if len(stamp) < 20 or stamp[4] != '-' or stamp[10] != 'T':
+            return None
+        try:
+            base = calendar.timegm((int(stamp[0:4]), int(stamp[5:7]), int(stamp[8:10]),
+                                    int(stamp[11:13]), int(stamp[14:16]), int(stamp[17:19])))
+            tail = stamp[19:]
+            if tail[:1] == '.':
+                tail = tail.lstrip('.0123456789')
+            if tail == 'Z':
+                offset = 0
+            elif len(tail) == 6 and tail[0] in '+-' and tail[3] == ':':
+                offset = (int(tail[1:3]) * 3600 + int(tail[4:6]) * 60) * (1 if tail[0] == '+' else -1)
+            else:
+                return None
+        except ValueError:
+            return None
+        return self._remember(stamp, base - offset)
+
+
+class PfSenseFilterlogParser(BsdSyslogParser):
+    """pfSense filterlog (CSV) qua BSD syslog: timestamp giong bsd_syslog, format rieng de cac buoc sau nhan biet."""
+
+
+class NginxAccessParser(FastTimestampParser):
+    """'1.2.3.4 - - [16/Oct/2025:10:00:00 +0700] "GET / HTTP/1.1" ...' - timestamp nam trong []."""
+
+    probe_bytes = 160
+
+    def parse(self, line):
+        start = line.find('[') + 1
+        if start == 0:
+            return None
+        stamp = line[start:start + 26]
+        if stamp == self._last_prefix:
+            return self._last_epoch
+        if len(stamp) < 26 or stamp[2] != '/' or stamp[6] != '/' or stamp[11] != ':' or stamp[20] != ' ':
+            return None
+        month = MONTHS.get(stamp[3:6])
+        if not month:
+            return None
+        try:
+            base = calendar.timegm((int(stamp[7:11]), month, int(stamp[0:2]),
+                                    int(stamp[12:14]), int(stamp[15:17]), int(stamp[18:20])))
+            offset = (int(stamp[22:24]) * 3600 + int(stamp[24:26]) * 60) * (1 if stamp[21] == '+' else -1)
+        except ValueError:
+            return None
+        return self._remember(stamp, base - offset)
+
+
+class CiscoIosParser(FastTimestampParser):
+    """
+    Log Cisco IOS ("service timestamps log datetime localtime show-timezone"):
+    "000123: *Oct 16 10:00:00.123 ICT: %LINK-3-UPDOWN: ..." - bo so thu tu va dau '*'/'.' (clock chua dong bo).
+    Nhan ca dang co nam: "Oct 16 2025 10:00:00".
+    """
+
+    probe_bytes = 64
+
+    def parse(self, line):
+        if line[:1].isdigit():
+            sep = line.find(': ')
+            if sep > 0 and line[:sep].isdigit():
+                line = line[sep + 2:]
+        if line[:1] in ('*', '.'):
+            line = line[1:]
+        last_prefix = self._last_prefix
+        if last_prefix is not None and line.startswith(last_prefix):
+            return self._last_epoch
+        if len(line) > 20 and line[6] == ' ' and line[7:11].isdigit() and line[11] == ' ':
+            month = MONTHS.get(line[:3])
+            if not month or line[14] != ':' or line[17] != ':':
+                return None
+            try:
+                epoch = self._to_epoch(int(line[7:11]), month, int(line[4:6]),
+                                       int(line[12:14]), int(line[15:17]), int(line[18:20]))
+            except ValueError:
+                return None
+            return self._remember(line[:20], epoch)
+        return self._parse_syslog(line)
+
+
+class LogFormat:
+    """1 format log: regex nhan dien (chi dung luc detect) + class parser timestamp fast-path."""
+
+    def __init__(self, name, signature, parser_class, description):
+        self.name = name
+        self.signature = re.compile(signature)
+        self.parser_class = parser_class
+        self.description = description
+
+
+# // Thu tu = do uu tien khi so dong khop bang nhau (format cu the truoc format chung)
+FORMATS = {}
+
+def register_format(log_format):
+    FORMATS[log_format.name] = log_format
+    return log_format
+
+register_format(LogFormat("rfc5424", r'^<\d{1,3}>\d{1,2} \d{4}-\d\d-\d\dT\d\d:\d\d:\d\d', Rfc5424Parser, "Syslog RFC 5424"))
+register_format(LogFormat("pfsense_filterlog", r'^[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d \S+ filterlog(\[\d+\])?: \d', PfSenseFilterlogParser, "pfSense filterlog CSV (BSD syslog)"))
+register_format(LogFormat("cisco_ios", r'^(\d+: )?[*.]?[A-Z][a-z]{2} [ \d]\d (\d{4} )?\d\d:\d\d:\d\d(\.\d+)?( [A-Z]{2,5})?: %[A-Z0-9_]+-\d-', CiscoIosParser, "Cisco IOS / L3 switch"))
+register_format(LogFormat("nginx_access", r'^\S+ \S+ \S+ \[\d\d/[A-Z][a-z]{2}/\d{4}:\d\d:\d\d:\d\d [+-]\d{4}\] "', NginxAccessParser, "Nginx access log (combined)"))
+register_format(LogFormat("bsd_syslog", r'^[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d ', BsdSyslogParser, "BSD syslog (RFC 3164)"))
+register_format(LogFormat("iso8601", r'^\d{4}-\d\d-\d\d[T ]\d\d:\d\d:\d\d', IsoParser, "ISO 8601 timestamp"))
+
+def make_parser(format_name, tz, reference_time=None):
+    """Tao parser timestamp cho format (ten khong ro / auto -> FastTimestampParser thu ca 2 layout)."""
+    log_format = FORMATS.get(format_name)
+    parser_class = log_format.parser_class if log_format else FastTimestampParser
+    return parser_class(tz, reference_time)
+
+def detect_format(sample_lines):
+    """
+    Chon format co nhieu dong mau khop signature nhat (>= DETECT_MIN_RATIO so dong khong rong).
+    Tra ve ten format hoac AUTO_FORMAT neu khong format nao du.
+    """
+    lines = [l for l in sample_lines if l.strip()][:DETECT_SAMPLE_LINES]
+    if not lines:
+        return AUTO_FORMAT
+    best_name, best_hits = AUTO_FORMAT, 0
+    for name, log_format in FORMATS.items():
+        hits = sum(1 for line in lines if log_format.signature.match(line))
+        if hits > best_hits:
+            best_name, best_hits = name, hits
+    if best_hits < len(lines) * DETECT_MIN_RATIO:
+        logging.info(f"Khong nhan ra format log ({best_hits}/{len(lines)} dong khop '{best_name}'). Dung che do auto.")
+        return AUTO_FORMAT
+    return best_name
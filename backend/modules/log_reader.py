@@ -1,34 +1,106 @@
 import logging
 import pytz
 import os
+import bz2
+import glob
+import gzip
+import heapq
+import mmap
+import shutil
+import tempfile
+import threading
+import zlib
+import concurrent.futures
 from datetime import datetime, timedelta
 from modules import state_manager
+from modules import log_formats
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # // Gioi han so dong log mac dinh xu ly mot lan
-DEFAULT_MAX_LOG_LINES = 10000 
+DEFAULT_MAX_LOG_LINES = 10000
+MAX_LOG_LINES_PER_RUN = DEFAULT_MAX_LOG_LINES
+
+# // So byte truoc offset dung lam dau van tay, phat hien file bi ghi de (copytruncate)
+CHECKPOINT_FINGERPRINT_BYTES = 128
+
+# // Binary search: dung chia doi khi khoang con lai nho hon muc nay, quet tuyen tinh phan con lai
+BISECT_MIN_SPAN = 64 * 1024
+# // Lui them 1 doan truoc diem tim duoc de bat cac dong lech thu tu nhe
+BISECT_SLACK_BYTES = 64 * 1024
+# // So dong toi da doc tai 1 diem do de tim dong co timestamp
+BISECT_MAX_PROBE_LINES = 50
+
+# // Kich thuoc reorder buffer: sap xep lai cac dong lech thu tu nhe ma khong can sort ca cua so
+REORDER_BUFFER_LINES = 512
+
+# // Scanner mmap: tra lai trang da quet cho OS moi khi di qua chung nay byte, giu RSS on dinh voi file GB
+MMAP_RELEASE_BYTES = 4 * 1024 * 1024
+SCAN_BLOCK_BYTES = 1024 * 1024
+COUNT_CHUNK_BYTES = 1024 * 1024
+
+# // Doc song song (process pool) khi doan can quet cua 1 file vuot nguong (cau hinh theo host)
+DEFAULT_PARALLEL_READ_THRESHOLD_MB = 1024
+PARALLEL_READ_WORKERS = os.cpu_count() or 4
+PARALLEL_RANGE_BYTES = 16 * 1024 * 1024
+
+# // Mau dau file dung de nhan dien format log
+FORMAT_SAMPLE_BYTES = 64 * 1024
+
+# // Segment nen (log rotate) duoc giai nen song song bang thread
+COMPRESSED_EXTENSIONS = ('.gz', '.bz2', '.zst', '.zstd')
+DECOMPRESS_WORKERS = 4
+# // Segment giai nen nam trong RAM toi muc nay, lon hon thi tran ra file tam
+DECOMPRESS_SPOOL_BYTES = 64 * 1024 * 1024
+# // Bo qua segment cu co mtime truoc moc bat dau qua khoang nay
+ROTATION_MTIME_SLACK_SECONDS = 300
+
+# // Checkpoint cho commit: chi ghi xuong state khi pipeline chay thanh cong
+_pending_checkpoints = {}
+_pending_lock = threading.Lock()
+
+def _release_mapped(mm, start, end):
+    """Bao OS bo cac trang da doc xong (file-backed, doc lai tu page cache neu can)."""
+    if hasattr(mm, 'madvise'):
+        # // Fault-around cua kernel co the map lai vai trang ngay truoc start -> lui them 1 block
+        start = max(0, start - SCAN_BLOCK_BYTES)
+        start -= start % mmap.PAGESIZE
+        if end > start:
+            mm.madvise(mmap.MADV_DONTNEED, start, end - start)
 
 def count_file_lines(file_path):
     """
-    Dem so dong cua file mot cach toi uu (block reading).
+    Dem so dong cua file bang mmap (khong qua buffer cua file object).
     Dung cho viec thong ke Dashboard.
     """
     if not os.path.exists(file_path):
         return 0
     try:
         lines = 0
-        buf_size = 1024 * 1024
         with open(file_path, 'rb') as f:
-            read_f = f.read
-            buf = read_f(buf_size)
-            while buf:
-                lines += buf.count(b'\n')
-                buf = read_f(buf_size)
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return 0
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                released = 0
+                for start in range(0, size, COUNT_CHUNK_BYTES):
+                    lines += mm[start:start + COUNT_CHUNK_BYTES].count(b'\n')
+                    if start - released >= MMAP_RELEASE_BYTES:
+                        _release_mapped(mm, released, start)
+                        released = start
         return lines
     except Exception as e:
         logging.error(f"Error counting lines for {file_path}: {e}")
         return 0
 
 def try_parse_timestamp_flexible(line, current_year, tz):
+    """
+    Parser cu (strptime + tz.localize), tra ve datetime co tz.
+    Reader da chuyen sang FastTimestampParser; giu lai cho code ngoai va benchmark.
+    """
 
     line = line.strip()
     if not line: return None
@@ -58,27 +130,599 @@ def try_parse_timestamp_flexible(line, current_year, tz):
 
     return None
 
-def read_new_log_entries(file_path, hours, timezone_str, host_id, test_mode=False, custom_limit=None):
+def resolve_log_segments(log_spec):
     """
-    Doc log moi. Ho tro custom_limit de doc nhieu hon khi chay song song.
+    LogFile co the la 1 file, 1 glob (vd /var/log/filter.log*) hoac 1 thu muc.
+    Tra ve danh sach file (segment), cu nhat truoc theo mtime.
+    """
+    if os.path.isdir(log_spec):
+        paths = [os.path.join(log_spec, name) for name in os.listdir(log_spec)]
+    elif glob.has_magic(log_spec):
+        paths = glob.glob(log_spec)
+    else:
+        return [log_spec]
+
+    segments = []
+    for path in paths:
+        try:
+            if os.path.isfile(path) and not path.endswith('.lock'):
+                segments.append((os.path.getmtime(path), path))
+        except OSError:
+            continue
+    segments.sort()
+    return [path for _, path in segments]
+
+def is_compressed(path):
+    return path.lower().endswith(COMPRESSED_EXTENSIONS)
+
+def _open_compressed(path):
+    lower = path.lower()
+    if lower.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if lower.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    if zstandard is None:
+        raise RuntimeError(f"Can cai 'zstandard' de doc file {os.path.basename(path)}")
+    return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+
+def _decompress_segment(path):
+    """Giai nen 1 segment vao SpooledTemporaryFile (RAM, tran ra dia neu lon) de con seek/bisect duoc."""
+    spool = tempfile.SpooledTemporaryFile(max_size=DECOMPRESS_SPOOL_BYTES)
+    try:
+        with _open_compressed(path) as src:
+            shutil.copyfileobj(src, spool, 1024 * 1024)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+def count_log_lines(log_spec):
+    """Dem tong so dong cua cac segment khong nen (glob/thu muc/file don). Dung cho Dashboard."""
+    return sum(count_file_lines(path) for path in resolve_log_segments(log_spec) if not is_compressed(path))
+
+def _read_fingerprint(file_path, offset):
+    """CRC cua doan byte ngay truoc offset, dung de nhan dien file bi thay noi dung."""
+    if offset <= 0:
+        return 0
+    start = max(0, offset - CHECKPOINT_FINGERPRINT_BYTES)
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        return zlib.crc32(f.read(offset - start))
+
+def _load_segment_checkpoints(checkpoint):
+    """
+    Checkpoint luu theo inode: {"segments": {inode: {path, offset, fingerprint}}, "last_timestamp"}.
+    Tu dong chuyen dinh dang cu (1 file) sang dinh dang moi.
+    """
+    if not checkpoint:
+        return {}
+    if 'segments' not in checkpoint:
+        if 'inode' not in checkpoint:
+            return {}
+        checkpoint = {"segments": {str(checkpoint['inode']): checkpoint}}
+    result = {}
+    for inode, entry in checkpoint.get('segments', {}).items():
+        try:
+            result[int(inode)] = entry
+        except (ValueError, TypeError):
+            continue
+    return result
+
+def _validate_checkpoint(file_path, st, entry, host_id):
+    """
+    Kiem tra checkpoint cua 1 segment (cung inode) con khop voi file hien tai khong.
+    Tra ve offset de seek, hoac None neu file da truncate/ghi de (phai quet theo timestamp).
+    Segment nen: offset tinh tren du lieu da giai nen, chi hop le khi file nen khong doi (size + mtime).
+    """
+    if not entry:
+        return None
+    try:
+        offset = int(entry.get('offset', 0))
+        if is_compressed(file_path):
+            if entry.get('source_size') != st.st_size or entry.get('source_mtime') != st.st_mtime:
+                logging.warning(f"[{host_id}] File nen da thay doi ({os.path.basename(file_path)}). Quet lai theo timestamp.")
+                return None
+            return offset
+        if st.st_size < offset:
+            logging.warning(f"[{host_id}] Phat hien file log bi truncate ({os.path.basename(file_path)}: {st.st_size} < {offset}). Quet lai theo timestamp.")
+            return None
+        if _read_fingerprint(file_path, offset) != entry.get('fingerprint'):
+            logging.warning(f"[{host_id}] Noi dung truoc checkpoint da thay doi ({os.path.basename(file_path)}). Quet lai theo timestamp.")
+            return None
+        return offset
+    except (OSError, ValueError, TypeError) as e:
+        logging.warning(f"[{host_id}] Checkpoint khong hop le: {e}")
+        return None
+
+def _set_pending_checkpoint(host_id, test_mode, checkpoint):
+    with _pending_lock:
+        _pending_checkpoints[(host_id, test_mode)] = checkpoint
+
+def commit_checkpoint(host_id, test_mode=False):
+    """
+    Ghi checkpoint cua lan doc gan nhat xuong state.
+    Goi cung luc voi save_last_run_timestamp de dam bao transactional.
+    """
+    with _pending_lock:
+        checkpoint = _pending_checkpoints.pop((host_id, test_mode), None)
+    if checkpoint:
+        state_manager.save_log_checkpoint(host_id, checkpoint, test_mode)
+
+def _seek_line_start(f, offset):
+    """Seek toi offset roi dong bo ve dau dong ke tiep. Tra ve vi tri dau dong."""
+    if offset <= 0:
+        f.seek(0)
+        return 0
+    f.seek(offset - 1)
+    if f.read(1) != b'\n':
+        f.readline()
+    return f.tell()
+
+def _probe_timestamp(f, offset, limit_offset, parser):
+    """
+    Lay timestamp (epoch) cua dong dau tien parse duoc ke tu offset (truoc limit_offset).
+    Tra ve (epoch, line_start) hoac (None, None).
+    """
+    line_start = _seek_line_start(f, offset)
+    for _ in range(BISECT_MAX_PROBE_LINES):
+        if line_start >= limit_offset:
+            break
+        raw_line = f.readline()
+        if not raw_line:
+            break
+        parsed_epoch = parser.parse(raw_line.decode('utf-8', errors='ignore'))
+        if parsed_epoch is not None:
+            return parsed_epoch, line_start
+        line_start += len(raw_line)
+    return None, None
+
+def _bisect_offset(f, size, target_epoch, parser):
+    """Binary search tren file object da mo (file that hoac segment da giai nen)."""
+    lo, hi = 0, size
+    while hi - lo > BISECT_MIN_SPAN:
+        mid = (lo + hi) // 2
+        probe_epoch, line_start = _probe_timestamp(f, mid, hi, parser)
+        if probe_epoch is not None and probe_epoch < target_epoch:
+            lo = line_start
+        else:
+            hi = mid
+
+    pos = _seek_line_start(f, max(0, lo - BISECT_SLACK_BYTES))
+    for raw_line in f:
+        parsed_epoch = parser.parse(raw_line.decode('utf-8', errors='ignore'))
+        if parsed_epoch is not None and parsed_epoch >= target_epoch:
+            return pos
+        pos += len(raw_line)
+    return pos
+
+def find_offset_for_time(file_path, target_time, timezone_str, end_time=None, log_format=None):
+    """
+    Binary search vi tri byte cua dong dau tien co timestamp >= target_time.
+    Syslog gan nhu tang dan theo thoi gian nen chi can O(log n) lan seek + doc 1 dong,
+    doan cuoi (< BISECT_MIN_SPAN) va mot khoang lui BISECT_SLACK_BYTES duoc quet tuyen tinh
+    de bat cac dong bi lech thu tu nhe.
+    """
+    tz = pytz.timezone(timezone_str)
+    parser = log_formats.make_parser(log_format, tz, end_time or datetime.now(tz))
+
+    with open(file_path, 'rb') as f:
+        return _bisect_offset(f, os.fstat(f.fileno()).st_size, target_time.timestamp(), parser)
+
+def _iter_line_blocks(f, start_offset, end_offset, use_mmap):
+    """
+    Yield cac block bytes gom nguyen dong (ket thuc bang '\n'), tach dong bang bytes.split o C.
+    use_mmap: cat block truc tiep tren mmap, khong qua buffer cua file object.
+    Dung truoc dong cuoi chua co '\n' (dang duoc ghi do, de lan sau doc).
+    """
+    if use_mmap:
+        size = os.fstat(f.fileno()).st_size
+        if start_offset >= size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            limit = end_offset if end_offset is not None else size
+            pos = released = start_offset
+            while pos < limit:
+                cut = mm.rfind(b'\n', pos, min(pos + SCAN_BLOCK_BYTES, limit)) + 1
+                if cut == 0:
+                    # // Dong dai hon 1 block
+                    cut = mm.find(b'\n', pos) + 1
+                    if cut == 0:
+                        break
+                yield mm[pos:cut]
+                pos = cut
+                if pos - released >= MMAP_RELEASE_BYTES:
+                    _release_mapped(mm, released, pos)
+                    released = pos
+        return
+
+    # // Segment da giai nen (SpooledTemporaryFile) -> doc theo block, giu lai phan dong do dang
+    f.seek(start_offset)
+    pos = start_offset
+    tail = b''
+    while end_offset is None or pos < end_offset:
+        data = f.read(SCAN_BLOCK_BYTES if end_offset is None else min(SCAN_BLOCK_BYTES, end_offset - pos))
+        if not data:
+            break
+        pos += len(data)
+        data = tail + data
+        cut = data.rfind(b'\n') + 1
+        tail = data[cut:]
+        if cut:
+            yield data[:cut]
+
+def _scan_lines(blocks, pos, start_epoch, window_end_epoch, fallback_epoch, accept_all, parse_bytes, last_valid_epoch, scan_state):
+    """
+    Vong lap loc dong chung cho doc tuan tu va process pool. Yield (epoch, end_pos, line).
+    last_valid_epoch=None (dau 1 byte range): dong khong co timestamp truoc dong co timestamp dau tien
+    duoc yield voi epoch None, khong loc - nguoi goi tu gan timestamp cua range truoc.
+    Ket thuc: scan_state["pos"], scan_state["last_valid_epoch"].
+    """
+    for block in blocks:
+        lines = block.split(b'\n')
+        # // Block ket thuc bang '\n' -> phan tu cuoi rong
+        lines.pop()
+        for raw_line in lines:
+            pos += len(raw_line) + 1
+            parsed_epoch = parse_bytes(raw_line)
+            
+            if parsed_epoch is not None:
+                current_epoch = parsed_epoch
+                last_valid_epoch = parsed_epoch
+            elif last_valid_epoch is None:
+                yield None, pos, raw_line.decode('utf-8', errors='ignore') + '\n'
+                continue
+            else:
+                current_epoch = last_valid_epoch if last_valid_epoch > start_epoch else fallback_epoch
+
+            # // So sanh voi moc thoi gian lan chay truoc
+            if accept_all or (current_epoch > start_epoch and (window_end_epoch is None or current_epoch <= window_end_epoch)):
+                yield current_epoch, pos, raw_line.decode('utf-8', errors='ignore') + '\n'
+
+    scan_state["pos"] = pos
+    scan_state["last_valid_epoch"] = last_valid_epoch
+
+def _scan_range(path, range_start, range_end, filter_args, tz, end_time, last_valid_epoch, log_format=None):
+    """Worker cua process pool: loc 1 byte range [range_start, range_end) da canh theo dau dong."""
+    parser = log_formats.make_parser(log_format, tz, end_time)
+    scan_state = {}
+    with open(path, 'rb') as f:
+        items = list(_scan_lines(_iter_line_blocks(f, range_start, range_end, True), range_start,
+                                 *filter_args, parser.parse_bytes, last_valid_epoch, scan_state))
+    return items, scan_state["last_valid_epoch"], scan_state["pos"]
+
+def _split_ranges(f, start_offset, end_offset, range_bytes):
+    """Chia [start_offset, end_offset) thanh cac byte range ~range_bytes, moi bien nam ngay sau '\n'."""
+    bounds = [start_offset]
+    target = start_offset + range_bytes
+    while target < end_offset:
+        f.seek(target)
+        f.readline()
+        cut = f.tell()
+        if cut >= end_offset:
+            break
+        bounds.append(cut)
+        target = cut + range_bytes
+    bounds.append(end_offset)
+    return list(zip(bounds, bounds[1:]))
+
+def _iter_ranges_parallel(seg, start_offset, end_offset, filter_args, tz, end_time, scan_state):
+    """
+    Chia segment thanh byte range va loc song song trong ProcessPoolExecutor (khong bi GIL).
+    Ket qua duoc yield dung thu tu range; so range dang chay/cho bi gioi han de giu bo nho on dinh.
+    """
+    start_epoch, fallback_epoch = filter_args[0], filter_args[2]
+    window_end_epoch, accept_all = filter_args[1], filter_args[3]
+    with open(seg["path"], 'rb') as f:
+        ranges = _split_ranges(f, start_offset, end_offset, PARALLEL_RANGE_BYTES)
+
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=PARALLEL_READ_WORKERS)
+    try:
+        pending = []
+        next_range = 0
+        last_valid_epoch = start_epoch
+        pos = start_offset
+        while next_range < len(ranges) or pending:
+            while next_range < len(ranges) and len(pending) <= PARALLEL_READ_WORKERS:
+                range_start, range_end = ranges[next_range]
+                # // Range dau tien biet timestamp truoc do (start_epoch), cac range sau thi chua
+                initial = start_epoch if next_range == 0 else None
+                pending.append(pool.submit(_scan_range, seg["path"], range_start, range_end, filter_args, tz, end_time, initial, seg.get("log_format")))
+                next_range += 1
+
+            items, range_last_valid, pos = pending.pop(0).result()
+            for epoch, end_pos, line in items:
+                if epoch is None:
+                    # // Dong dau range khong co timestamp -> thua huong tu range truoc
+                    epoch = last_valid_epoch if last_valid_epoch > start_epoch else fallback_epoch
+                    if not (accept_all or (epoch > start_epoch and (window_end_epoch is None or epoch <= window_end_epoch))):
+                        continue
+                yield epoch, end_pos, line
+            if range_last_valid is not None:
+                last_valid_epoch = range_last_valid
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    scan_state["pos"] = pos
+
+def _iter_segment(seg, start_epoch, window_end_epoch, tz, end_time, accept_all=False, parallel_threshold=0):
+    """
+    Generator doc 1 segment, yield (epoch, end_pos, line) cho dong co timestamp > start_epoch
+    (va <= window_end_epoch neu co). Vi tri bat dau: seg["resume_offset"] neu co checkpoint,
+    nguoc lai binary search theo start_epoch. Cap nhat seg: start_offset, scanned_offset.
+    Timestamp duoc parse tu bytes; chi dong nam trong cua so moi bi decode sang str.
+    Doan can quet >= parallel_threshold byte (file thuong, > 0) -> loc song song bang process pool.
+    """
+    parser = log_formats.make_parser(seg.get("log_format"), tz, end_time)
+    f = seg["opener"]()
+    try:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        start_offset = seg.get("resume_offset")
+        if start_offset is None:
+            start_offset = _bisect_offset(f, size, start_epoch, parser)
+        end_offset = _bisect_offset(f, size, window_end_epoch + 1, parser) if window_end_epoch is not None else None
+        seg["start_offset"] = start_offset
+        seg["size"] = size
+
+        fallback_epoch = seg["mtime"] if seg["mtime"] > start_epoch else end_time.timestamp()
+        filter_args = (start_epoch, window_end_epoch, fallback_epoch, accept_all)
+        scan_end = end_offset if end_offset is not None else size
+        scan_state = {}
+
+        if parallel_threshold and not seg["compressed"] and scan_end - start_offset >= parallel_threshold:
+            f.close()
+            logging.info(f"[{seg['host_id']}] Doc song song {os.path.basename(seg['path'])}: {(scan_end - start_offset) / (1024 * 1024):.0f} MB, {PARALLEL_READ_WORKERS} process.")
+            yield from _iter_ranges_parallel(seg, start_offset, scan_end, filter_args, tz, end_time, scan_state)
+        else:
+            blocks = _iter_line_blocks(f, start_offset, end_offset, not seg["compressed"])
+            yield from _scan_lines(blocks, start_offset, *filter_args, parser.parse_bytes, start_epoch, scan_state)
+
+        seg["scanned_offset"] = scan_state["pos"]
+    finally:
+        f.close()
+
+def _tag_segment(idx, source):
+    for epoch, end_pos, line in source:
+        yield epoch, idx, end_pos, line
+
+def _merge_segments(sources, limit, merge_stats, segments):
+    """
+    K-way merge (heap) cac segment theo timestamp, dung ngay khi du `limit` dong
+    (khong quet tiep phan con lai). Chi nhin truoc 1 dong de biet con backlog hay khong.
+    merge_stats: kept_end {idx: offset cuoi dong duoc giu}, has_backlog, remaining_bytes, remaining_lines.
+    """
+    kept = 0
+    kept_chars = 0
+    kept_end = merge_stats.setdefault("kept_end", {})
+    merge_stats["has_backlog"] = False
+    tagged = [_tag_segment(idx, source) for idx, source in enumerate(sources)]
+    merged = heapq.merge(*tagged)
+    try:
+        for epoch, idx, end_pos, line in merged:
+            if kept >= limit:
+                merge_stats["has_backlog"] = True
+                break
+            kept += 1
+            kept_chars += len(line)
+            # // Ghi lai offset theo segment de checkpoint biet chinh xac cho doc tiep
+            kept_end[idx] = end_pos
+            yield epoch, line
+    finally:
+        # // Dong generator con lai -> giai phong mmap / file tam ngay, khong doi GC
+        merged.close()
+        for source in sources:
+            source.close()
+
+    if merge_stats["has_backlog"]:
+        remaining = sum(seg["size"] - kept_end.get(idx, seg["start_offset"])
+                        for idx, seg in enumerate(segments) if "start_offset" in seg)
+        merge_stats["remaining_bytes"] = remaining
+        merge_stats["remaining_lines"] = int(remaining / (kept_chars / kept)) if kept else 0
+
+def _read_format_sample(log_spec):
+    """Lay vai tram dong dau cua segment moi nhat de nhan dien format."""
+    paths = resolve_log_segments(log_spec)
+    for path in reversed(paths):
+        try:
+            opener = _open_compressed if is_compressed(path) else (lambda p: open(p, 'rb'))
+            with opener(path) as f:
+                data = f.read(FORMAT_SAMPLE_BYTES)
+        except (OSError, RuntimeError, EOFError):
+            continue
+        lines = data.decode('utf-8', errors='ignore').splitlines()
+        if len(data) == FORMAT_SAMPLE_BYTES:
+            # // Dong cuoi co the bi cat ngang
+            lines = lines[:-1]
+        if lines:
+            return lines
+    return []
+
+def resolve_log_format(host_id, log_spec, configured=None, test_mode=False, persist=True):
+    """
+    Format log cua host: gia tri cau hinh (log_format) neu hop le, nguoc lai nhan dien 1 lan
+    tu mau file va cache trong state (nhan dien lai khi LogFile doi).
+    persist=False: chi nhan dien trong bo nho, khong ghi state (doc theo cua so / ad-hoc).
+    """
+    if configured and configured != log_formats.AUTO_FORMAT:
+        if configured in log_formats.FORMATS:
+            return configured
+        logging.warning(f"[{host_id}] log_format '{configured}' khong ton tai. Tu nhan dien.")
+
+    cached = state_manager.get_log_format(host_id, test_mode)
+    if cached and cached.get('log_spec') == log_spec and cached.get('format') in log_formats.FORMATS:
+        return cached['format']
+
+    sample = _read_format_sample(log_spec)
+    if not sample:
+        return log_formats.AUTO_FORMAT
+    detected = log_formats.detect_format(sample)
+    logging.info(f"[{host_id}] Nhan dien format log: {detected}.")
+    if not persist:
+        return detected
+    state_manager.save_log_format(host_id, {
+        "format": detected,
+        "log_spec": log_spec,
+        "detected_at": datetime.now().isoformat()
+    }, test_mode)
+    return detected
+
+def _plan_segments(log_spec, since_epoch, host_id, decompress_pool, seg_checkpoints=None, log_format=None):
+    """
+    Lap danh sach segment can doc. Bo qua segment cu (mtime truoc since_epoch), tru file moi nhat.
+    Segment nen duoc dua vao thread pool giai nen ngay, segment thuong mo truc tiep.
+    """
+    paths = resolve_log_segments(log_spec)
+    if not paths:
+        raise FileNotFoundError(log_spec)
+
+    segments = []
+    for i, path in enumerate(paths):
+        st = os.stat(path)
+        is_newest = (i == len(paths) - 1)
+        if not is_newest and st.st_mtime < since_epoch - ROTATION_MTIME_SLACK_SECONDS:
+            logging.debug(f"[{host_id}] Bo qua segment cu: {path}")
+            continue
+
+        seg = {"host_id": host_id, "log_format": log_format, "path": path, "inode": st.st_ino, "mtime": st.st_mtime, "compressed": is_compressed(path), "resume_offset": None}
+        if seg["compressed"]:
+            seg["opener"] = decompress_pool.submit(_decompress_segment, path).result
+            seg["source_size"] = st.st_size
+        else:
+            seg["opener"] = lambda p=path: open(p, 'rb')
+        if seg_checkpoints:
+            entry = seg_checkpoints.get(st.st_ino)
+            if entry is None and not seg["compressed"]:
+                logging.info(f"[{host_id}] Segment moi / da rotate: {os.path.basename(path)}. Quet theo timestamp.")
+            seg["resume_offset"] = _validate_checkpoint(path, st, entry, host_id)
+        segments.append(seg)
+
+    if len(paths) > 1:
+        logging.info(f"[{host_id}] Doc {len(segments)}/{len(paths)} segment log ({sum(1 for s in segments if s['compressed'])} segment nen).")
+    return segments
+
+class LogStream:
+    """
+    Ket qua doc log dang stream. Duyet iter_chunks()/iter_lines() de lay du lieu,
+    cac thuoc tinh log_count, latest_timestamp chi day du sau khi duyet het.
+    Bo nho chi giu 1 chunk + reorder buffer, khong giu ca cua so log.
+    """
+
+    def __init__(self, host_id, start_time, end_time, limit, source, stats, empty_timestamp, on_complete=None, log_format=None):
+        self.host_id = host_id
+        # // Ten format da resolve (khong con 'auto' neu nhan dien duoc) -> dung cho thong ke cuc bo
+        self.log_format = log_format
+        self.start_time = start_time
+        self.end_time = end_time
+        self.limit = limit
+        self.log_count = 0
+        self.has_backlog = False
+        self.remaining_bytes = 0
+        self.remaining_lines = 0
+        self.latest_timestamp = None
+        self.completed = False
+        self._source = source
+        self._stats = stats
+        self._empty_timestamp = empty_timestamp
+        self._on_complete = on_complete
+
+    def iter_lines(self):
+        """Yield tung dong (giu '\n'), gan dung thu tu thoi gian nho reorder buffer nho."""
+        heap = []
+        seq = 0
+        latest_epoch = None
+        for epoch, line in self._source:
+            heapq.heappush(heap, (epoch, seq, line))
+            seq += 1
+            if len(heap) > REORDER_BUFFER_LINES:
+                epoch, _, line = heapq.heappop(heap)
+                if latest_epoch is None or epoch > latest_epoch: latest_epoch = epoch
+                self.log_count += 1
+                yield line
+        while heap:
+            epoch, _, line = heapq.heappop(heap)
+            if latest_epoch is None or epoch > latest_epoch: latest_epoch = epoch
+            self.log_count += 1
+            yield line
+
+        self.has_backlog = self._stats.get("has_backlog", False)
+        self.remaining_bytes = self._stats.get("remaining_bytes", 0)
+        self.remaining_lines = self._stats.get("remaining_lines", 0)
+        if latest_epoch is not None:
+            self.latest_timestamp = datetime.fromtimestamp(latest_epoch, self._empty_timestamp.tzinfo)
+        else:
+            # // Khong co log moi -> day timestamp len hien tai
+            self.latest_timestamp = self._empty_timestamp
+
+        if self.has_backlog:
+            remaining_mb = self.remaining_bytes / (1024 * 1024)
+            logging.warning(f"[{self.host_id}] Log volume qua lon. Chi xu ly {self.limit} dong DAU TIEN, con ~{self.remaining_lines} dong ({remaining_mb:.1f} MB) cho dot sau.")
+            # // Canh bao AI (dong canh bao van tinh vao log_count nhu read_new_log_entries cu)
+            self.log_count += 1
+            yield f"\n!!! WARNING: Con khoang {self.remaining_lines} dong log ({remaining_mb:.1f} MB) chua xu ly trong dot nay. !!!\n"
+
+        self.completed = True
+        logging.info(f"[{self.host_id}] Da loc duoc {self.log_count} dong log phu hop.")
+        if self._on_complete:
+            self._on_complete(self)
+
+    def iter_chunks(self, chunk_size):
+        """
+        Gom dong thanh chunk (string) toi da chunk_size dong, yield ngay khi du.
+        Chunk day chi duoc yield khi co dong tiep theo; canh bao backlog cuoi luon ghep vao chunk cuoi
+        (khong tach thanh 1 chunk rieng).
+        """
+        buf = []
+        for line in self.iter_lines():
+            if len(buf) >= chunk_size and not line.startswith('\n!!!'):
+                yield "".join(buf)
+                buf = []
+            buf.append(line)
+        if buf:
+            yield "".join(buf)
+
+def open_log_stream(file_path, hours, timezone_str, host_id, test_mode=False, custom_limit=None, window=None, parallel_threshold_mb=None, log_format=None):
+    """
+    Mo luong doc log moi (hoac theo cua so window=(start, end)). Tra ve LogStream hoac None neu loi.
+    file_path co the la file, glob hoac thu muc; cac segment duoc merge theo timestamp.
+    Production: segment co checkpoint (inode, offset) hop le thi seek thang toi du lieu moi,
+    nguoc lai dung binary search theo timestamp de tim diem bat dau.
+    Checkpoint moi chi duoc dat (pending) khi stream da duyet het.
+    parallel_threshold_mb: doan can quet cua 1 file >= nguong nay thi loc song song (0 = tat).
+    log_format: ten format trong log_formats.FORMATS; None/"auto" -> nhan dien tu file (cache trong state).
     """
     limit_to_use = custom_limit if custom_limit else DEFAULT_MAX_LOG_LINES
+    if parallel_threshold_mb is None: parallel_threshold_mb = DEFAULT_PARALLEL_READ_THRESHOLD_MB
+    parallel_threshold = parallel_threshold_mb * 1024 * 1024
     
-    logging.info(f"[{host_id}] Bat dau doc log tu '{file_path}' (Limit: {limit_to_use}).")
     try:
         tz = pytz.timezone(timezone_str)
         end_time = datetime.now(tz) 
-        current_year = end_time.year
+
+        # // Doc theo cua so / test mode: nhan dien trong bo nho, khong ghi vao state cua host
+        log_format = resolve_log_format(host_id, file_path, log_format, test_mode, persist=not (window or test_mode))
+
+        if window:
+            return _open_window_stream(file_path, window[0], window[1], tz, host_id, limit_to_use, end_time, parallel_threshold, log_format)
+
+        logging.info(f"[{host_id}] Bat dau doc log tu '{file_path}' (Limit: {limit_to_use}).")
 
         if test_mode:
             logging.info(f"[{host_id}] TEST MODE: Doc toan bo file log.")
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                all_entries = f.readlines()
+            all_entries = []
+            for path in resolve_log_segments(file_path):
+                if is_compressed(path):
+                    with _open_compressed(path) as f:
+                        all_entries.extend(l.decode('utf-8', errors='ignore') for l in f)
+                else:
+                    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                        all_entries.extend(f.readlines())
             start_time = end_time - timedelta(days=30) 
             
             if len(all_entries) > limit_to_use:
                  all_entries = all_entries[-limit_to_use:] 
-            return ("".join(all_entries), start_time, end_time, len(all_entries), end_time)
+            end_epoch = end_time.timestamp()
+            source = ((end_epoch, line) for line in all_entries)
+            return LogStream(host_id, start_time, end_time, limit_to_use, source, {}, end_time, log_format=log_format)
 
         # // PRODUCTION MODE LOGIC
         last_run_time = state_manager.get_last_run_timestamp(host_id, test_mode)
@@ -89,66 +733,104 @@ def read_new_log_entries(file_path, hours, timezone_str, host_id, test_mode=Fals
         else:
             start_time = end_time - timedelta(hours=hours)
             logging.info(f"[{host_id}] Lan chay dau tien. Doc log {hours}h qua.")
+        start_epoch = start_time.timestamp()
 
-        new_entries = []
-        
-        last_valid_timestamp = start_time
-        
+        # // Checkpoint hop le -> seek thang toi du lieu moi, khong can loc theo thoi gian
+        seg_checkpoints = _load_segment_checkpoints(state_manager.get_log_checkpoint(host_id, test_mode))
+        decompress_pool = concurrent.futures.ThreadPoolExecutor(max_workers=DECOMPRESS_WORKERS)
         try:
-            file_mtime = datetime.fromtimestamp(os.path.getmtime(file_path), tz=tz)
-            if file_mtime > start_time:
-                fallback_timestamp = file_mtime
-            else:
-                fallback_timestamp = end_time
-        except:
-            fallback_timestamp = end_time
+            segments = _plan_segments(file_path, start_epoch, host_id, decompress_pool, seg_checkpoints, log_format)
+        finally:
+            # // Khong doi giai nen xong; thread van chay, generator tu doi khi toi luot segment do
+            decompress_pool.shutdown(wait=False)
 
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            for line in f:
-                parsed_time = try_parse_timestamp_flexible(line, current_year, tz)
-                
-                if parsed_time:
-                    if parsed_time > end_time + timedelta(days=1):
-                         parsed_time = parsed_time.replace(year=current_year - 1)
-                    current_log_time = parsed_time
-                    last_valid_timestamp = parsed_time
-                else:
-                    current_log_time = last_valid_timestamp if last_valid_timestamp > start_time else fallback_timestamp
-
-                # // So sanh voi moc thoi gian lan chay truoc
-                if current_log_time > start_time:
-                    # // Luu tuple (timestamp, line) de sort va loc sau
-                    new_entries.append((current_log_time, line))
+        for seg in segments:
+            if seg["resume_offset"] is not None:
+                logging.info(f"[{host_id}] Tiep tuc tu checkpoint: {os.path.basename(seg['path'])} byte {seg['resume_offset']}.")
 
-        new_entries.sort(key=lambda x: x[0])
+        merge_stats = {}
+        sources = [_iter_segment(seg, start_epoch, None, tz, end_time, accept_all=seg["resume_offset"] is not None, parallel_threshold=parallel_threshold) for seg in segments]
+        source = _merge_segments(sources, limit_to_use, merge_stats, segments)
 
-        total_found = len(new_entries)
-        if total_found > limit_to_use:
-            logging.warning(f"[{host_id}] Log volume qua lon ({total_found}). Chi xu ly {limit_to_use} dong DAU TIEN.")
-            new_entries = new_entries[:limit_to_use]
-            
-            # // Canh bao AI
-            final_lines = [x[1] for x in new_entries]
-            final_lines.append(f"\n!!! WARNING: Con {total_found - limit_to_use} dong log nua chua xu ly trong dot nay. !!!\n")
-            
-            # // Timestamp moi la thoi gian cua dong log cuoi cung duoc lay
-            new_latest_timestamp = new_entries[-1][0]
-        else:
-            final_lines = [x[1] for x in new_entries]
-            if new_entries:
-                new_latest_timestamp = new_entries[-1][0]
-            else:
-                # // Khong co log moi -> day timestamp len hien tai
-                new_latest_timestamp = end_time
+        def _on_complete(stream):
+            new_segments = {}
+            live_inodes = set()
+            for idx, seg in enumerate(segments):
+                live_inodes.add(seg["inode"])
+                if "start_offset" not in seg:
+                    continue
+                # // Dung som -> diem doc tiep la ngay sau dong cuoi duoc giu cua tung segment
+                offset = merge_stats["kept_end"].get(idx, seg["start_offset"]) if stream.has_backlog else seg["scanned_offset"]
+                entry = {"path": os.path.abspath(seg["path"]), "offset": offset}
+                if seg["compressed"]:
+                    entry.update(source_size=seg["source_size"], source_mtime=seg["mtime"])
+                else:
+                    entry["fingerprint"] = _read_fingerprint(seg["path"], offset)
+                new_segments[str(seg["inode"])] = entry
+            # // Giu checkpoint cua segment con ton tai nhung lan nay bo qua (khong co du lieu moi)
+            for path in resolve_log_segments(file_path):
+                try:
+                    inode = os.stat(path).st_ino
+                except OSError:
+                    continue
+                if inode not in live_inodes and inode in seg_checkpoints:
+                    new_segments[str(inode)] = seg_checkpoints[inode]
+            _set_pending_checkpoint(host_id, test_mode, {
+                "segments": new_segments,
+                "last_timestamp": stream.latest_timestamp.isoformat()
+            })
 
-        log_count = len(final_lines)
-        logging.info(f"[{host_id}] Da loc duoc {log_count} dong log phu hop.")
-        
-        return ("".join(final_lines), start_time, end_time, log_count, new_latest_timestamp)
+        return LogStream(host_id, start_time, end_time, limit_to_use, source, merge_stats, end_time, on_complete=_on_complete, log_format=log_format)
 
     except FileNotFoundError:
         logging.error(f"[{host_id}] Loi: Khong tim thay file log '{file_path}'.")
-        return (None, None, None, 0, None)
+        return None
     except Exception as e:
         logging.error(f"[{host_id}] Loi khong mong muon: {e}")
-        return (None, None, None, 0, None)
\ No newline at end of file
+        return None
+
+def _open_window_stream(file_path, window_start, window_end, tz, host_id, limit_to_use, now, parallel_threshold=0, log_format=None):
+    """Stream cho cua so [window_start, window_end]: binary search ca 2 dau moi segment, khong dung state."""
+    if window_start.tzinfo is None: window_start = tz.localize(window_start)
+    if window_end.tzinfo is None: window_end = tz.localize(window_end)
+    window_start, window_end = window_start.astimezone(tz), window_end.astimezone(tz)
+
+    logging.info(f"[{host_id}] Doc log theo cua so {window_start.isoformat()} -> {window_end.isoformat()} (Limit: {limit_to_use}).")
+
+    # // start loai tru -> lui 1 micro giay de lay ca dong dung bang window_start
+    start_epoch = window_start.timestamp() - 1e-6
+    decompress_pool = concurrent.futures.ThreadPoolExecutor(max_workers=DECOMPRESS_WORKERS)
+    try:
+        segments = _plan_segments(file_path, start_epoch, host_id, decompress_pool, log_format=log_format)
+    finally:
+        decompress_pool.shutdown(wait=False)
+
+    merge_stats = {}
+    sources = [_iter_segment(seg, start_epoch, window_end.timestamp(), tz, now, parallel_threshold=parallel_threshold) for seg in segments]
+    source = _merge_segments(sources, limit_to_use, merge_stats, segments)
+    return LogStream(host_id, window_start, window_end, limit_to_use, source, merge_stats, window_end, log_format=log_format)
+
+def _stream_to_tuple(stream):
+    """Doc het stream thanh tuple (content, start, end, count, latest) nhu API cu."""
+    if stream is None:
+        return (None, None, None, 0, None)
+    try:
+        content = "".join(stream.iter_lines())
+    except Exception as e:
+        logging.error(f"[{stream.host_id}] Loi khong mong muon: {e}")
+        return (None, None, None, 0, None)
+    return (content, stream.start_time, stream.end_time, stream.log_count, stream.latest_timestamp)
+
+def read_new_log_entries(file_path, hours, timezone_str, host_id, test_mode=False, custom_limit=None):
+    """
+    Doc log moi vao 1 string. Ho tro custom_limit de doc nhieu hon khi chay song song.
+    Pipeline dung open_log_stream() de khong giu ca cua so log trong bo nho.
+    """
+    return _stream_to_tuple(open_log_stream(file_path, hours, timezone_str, host_id, test_mode, custom_limit))
+
+def read_log_window(file_path, window_start, window_end, timezone_str, host_id, custom_limit=None):
+    """
+    Doc log trong cua so thoi gian [window_start, window_end] (backfill / phan tich theo yeu cau).
+    Dung binary search cho ca 2 dau nen khong doc ca file. Khong dung toi checkpoint/state.
+    """
+    return _stream_to_tuple(open_log_stream(file_path, None, timezone_str, host_id, custom_limit=custom_limit, window=(window_start, window_end)))
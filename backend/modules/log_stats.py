@@ -0,0 +1,155 @@
+import re
+from datetime import datetime
+import numpy as np
+from modules import log_formats
+from modules import filterlog
+
+# // So muc top (IP nguon, cong dich) dua vao prompt / summary_stats
+TOP_N = 5
+
+NGINX_RE = re.compile(r'^(\S+) \S+ \S+ \[[^\]]+\] "[^"]*" (\d{3}) ')
+# // Log chung (iptables, sshd, IOS...): action theo tu khoa, IP/port theo key=value hoac "from x port y"
+ACTION_RE = re.compile(r'\b(block|blocked|pass|drop|dropped|deny|denied|accept|accepted|reject|rejected|allow|allowed|permit|permitted|failed)\b', re.IGNORECASE)
+SRC_RE = re.compile(r'\b(?:SRC=|src[=: ]|from )\[?(\d{1,3}(?:\.\d{1,3}){3}|[0-9a-fA-F:]*:[0-9a-fA-F:]+)')
+DPORT_RE = re.compile(r'\b(?:DPT=|dport[=: ]|dst_port[=: ]|port )(\d{1,5})\b')
+IPV4_RE = re.compile(r'\b(\d{1,3}(?:\.\d{1,3}){3})\b')
+
+
+def extract_fields(line):
+    """Tach (action, src_ip, dst_port) tu 1 dong; truong khong co -> None."""
+    fields = filterlog.parse_filterlog(line)
+    if fields is not None:
+        return fields[2] or None, fields[5] or None, fields[8] or None
+
+    match = NGINX_RE.match(line)
+    if match:
+        return f"HTTP {match.group(2)}", match.group(1), None
+
+    action = ACTION_RE.search(line)
+    src = SRC_RE.search(line) or IPV4_RE.search(line)
+    port = DPORT_RE.search(line)
+    return (action.group(1).lower() if action else None,
+            src.group(1) if src else None,
+            port.group(1) if port else None)
+
+
+def _merge(target, counts):
+    for value, count in counts.items():
+        target[value] = target.get(value, 0) + count
+
+
+def _top(values):
+    """Dem gia tri (bo None) bang np.unique, tra ve [(gia tri, so lan)] giam dan."""
+    column = np.array([v for v in values if v is not None], dtype=object)
+    if column.size == 0:
+        return []
+    keys, counts = np.unique(column.astype(str), return_counts=True)
+    order = np.argsort(-counts, kind='stable')
+    return [(str(keys[i]), int(counts[i])) for i in order]
+
+
+class LogStatsAggregator:
+    """
+    Thong ke chinh xac tren cac cot da tach (action, IP nguon, cong dich, phut) truoc khi goi Gemini.
+    Dong filterlog luu vao filterlog.FilterlogTable (struct-of-arrays), dong khac dem theo gia tri.
+    feed() tra ve thong ke cua 1 chunk; summary() la tong cua ca lan chay.
+    """
+
+    def __init__(self, tz, log_format=None):
+        self.tz = tz
+        self.parser = log_formats.make_parser(log_format, tz)
+        self.table = filterlog.FilterlogTable()
+        self.other_total = 0
+        self.actions = {}
+        self.src_ips = {}
+        self.dst_ports = {}
+        self.minutes = {}
+
+    def feed(self, chunk_str):
+        first_row = len(self.table)
+        actions, srcs, ports, epochs = [], [], [], []
+        for line in chunk_str.splitlines():
+            if not line.strip() or line.startswith('!!!'):
+                continue
+            epoch = self.parser.parse(line)
+            if self.table.append(line, epoch):
+                continue
+            action, src, port = extract_fields(line)
+            actions.append(action)
+            srcs.append(src)
+            ports.append(port)
+            if epoch is not None:
+                epochs.append(epoch)
+
+        minute_counts = {}
+        if epochs:
+            minutes, counts = np.unique(np.asarray(epochs, dtype=np.int64) // 60, return_counts=True)
+            minute_counts = dict(zip(minutes.tolist(), counts.tolist()))
+        other = {"actions": dict(_top(actions)), "src_ips": dict(_top(srcs)), "dst_ports": dict(_top(ports)), "minutes": minute_counts}
+        self.other_total += len(actions)
+        for key, target in (("actions", self.actions), ("src_ips", self.src_ips), ("dst_ports", self.dst_ports), ("minutes", self.minutes)):
+            _merge(target, other[key])
+
+        table = self._table_counts(first_row)
+        for key in other:
+            _merge(other[key], table[key])
+        return self._to_stats(len(actions) + len(self.table) - first_row, other["actions"], other["src_ips"], other["dst_ports"], other["minutes"])
+
+    def _table_counts(self, start=0):
+        return {
+            "actions": self.table.counts("action", start),
+            "src_ips": self.table.counts("src", start),
+            "dst_ports": self.table.counts("dst_port", start),
+            "minutes": self.table.minute_counts(start),
+        }
+
+    def summary(self):
+        merged = {"actions": dict(self.actions), "src_ips": dict(self.src_ips), "dst_ports": dict(self.dst_ports), "minutes": dict(self.minutes)}
+        for key, counts in self._table_counts().items():
+            _merge(merged[key], counts)
+        return self._to_stats(self.other_total + len(self.table), merged["actions"], merged["src_ips"], merged["dst_ports"], merged["minutes"])
+
+    def _to_stats(self, total, actions, src_ips, dst_ports, minutes):
+        rate = None
+        if minutes:
+            keys = np.fromiter(minutes.keys(), dtype=np.int64)
+            counts = np.fromiter(minutes.values(), dtype=np.int64)
+            peak = int(np.argmax(counts))
+            span = int(keys.max() - keys.min()) + 1
+            rate = {
+                "avg_per_minute": round(float(counts.sum()) / span, 2),
+                "peak_per_minute": int(counts[peak]),
+                "peak_minute": datetime.fromtimestamp(int(keys[peak]) * 60, self.tz).isoformat(),
+                "minutes": span,
+            }
+        by_count = lambda d: sorted(d.items(), key=lambda kv: (-kv[1], kv[0]))
+        return {
+            "total_events": total,
+            "actions": dict(by_count(actions)),
+            "top_src_ips": [list(kv) for kv in by_count(src_ips)[:TOP_N]],
+            "top_dst_ports": [list(kv) for kv in by_count(dst_ports)[:TOP_N]],
+            "unique_src_ips": len(src_ips),
+            "event_rate": rate,
+        }
+
+
+def render_table(stats):
+    """Bang markdown gon de dat truoc log trong prompt."""
+    def _pairs(items):
+        return ", ".join(f"{k} ({v})" for k, v in items) or "N/A"
+
+    rate = stats.get("event_rate")
+    rate_text = "N/A"
+    if rate:
+        rate_text = f"TB {rate['avg_per_minute']}/phut, dinh {rate['peak_per_minute']}/phut luc {rate['peak_minute'][11:16]} ({rate['minutes']} phut)"
+    rows = [
+        ("Tong so dong", stats["total_events"]),
+        ("Action", _pairs(stats["actions"].items())),
+        (f"Top IP nguon ({stats['unique_src_ips']} IP)", _pairs(stats["top_src_ips"])),
+        ("Top cong dich", _pairs(stats["top_dst_ports"])),
+        ("Toc do su kien", rate_text),
+    ]
+    out = ["### THONG KE CUC BO (dem chinh xac tu log, dung so lieu nay, khong can dem lai)\n",
+           "| Chi so | Gia tri |\n", "|---|---|\n"]
+    out.extend(f"| {label} | {value} |\n" for label, value in rows)
+    return "".join(out) + "\n"
@@ -0,0 +1,191 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import configparser
+from modules import state_manager
+from modules.token_budget import MODEL_LIST_FILE
+from modules.upload_cache import key_fingerprint
+
+# // model_list.ini [RateLimits]: <model ID> = <requests/phut>, <tokens/phut> (0 = khong gioi han)
+RATE_LIMIT_SECTION = "RateLimits"
+# // Ngu toi da 1 lan trong luc cho slot roi doc lai bucket (process khac co the da tra/lay slot)
+MAX_POLL_SECONDS = 5
+# // Sai so float khi nap lai bucket: thieu it hon muc nay coi nhu du (tranh vong cho vo han voi thoi gian ~0)
+EPSILON = 1e-6
+
+_LIMITS = {}
+_LOCAL_LOCKS = {}
+_LOCAL_LOCKS_GUARD = threading.Lock()
+
+
+def load_limits(path=MODEL_LIST_FILE):
+    """Doc gioi han (rpm, tpm) theo model; nho theo mtime file. File/section khong co -> {}."""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    cached = _LIMITS.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    config = configparser.ConfigParser()
+    config.read(path, encoding='utf-8')
+    limits = {}
+    if config.has_section(RATE_LIMIT_SECTION):
+        for model, value in config.items(RATE_LIMIT_SECTION):
+            try:
+                rpm, tpm = (int(v.strip() or 0) for v in (value.split(',') + ['0'])[:2])
+            except ValueError:
+                logging.warning(f"Rate limit khong hop le cho model '{model}': {value}")
+                continue
+            limits[model] = (max(rpm, 0), max(tpm, 0))
+    _LIMITS[path] = (mtime, limits)
+    return limits
+
+
+def limits_for(model_name, path=MODEL_LIST_FILE):
+    # // ConfigParser ha chu thuong key
+    return load_limits(path).get((model_name or '').lower(), (0, 0))
+
+
+def _local_lock(bucket):
+    """Trong 1 process, cac thread cung bucket xep hang qua lock nay (chi 1 thread doc/ghi state tai 1 thoi diem)."""
+    with _LOCAL_LOCKS_GUARD:
+        return _LOCAL_LOCKS.setdefault(bucket, threading.Lock())
+
+
+def _refill(entry, rpm, tpm, now):
+    elapsed = max(0.0, now - entry.get("updated_at", now))
+    entry["requests"] = min(float(rpm), entry.get("requests", float(rpm)) + elapsed * rpm / 60.0)
+    entry["tokens"] = min(float(tpm), entry.get("tokens", float(tpm)) + elapsed * tpm / 60.0)
+    entry["updated_at"] = now
+
+
+def _take(data, bucket, rpm, tpm, tokens, now):
+    """Lay 1 request + tokens khoi bucket. Tra ve 0 neu lay duoc, nguoc lai so giay can cho."""
+    entry = data.setdefault("buckets", {}).setdefault(bucket, {"updated_at": now})
+    _refill(entry, rpm, tpm, now)
+    wait = 0.0
+    if rpm and entry["requests"] < 1 - EPSILON:
+        wait = max(wait, (1 - entry["requests"]) * 60.0 / rpm)
+    if tpm and entry["tokens"] < tokens - EPSILON:
+        wait = max(wait, (tokens - entry["tokens"]) * 60.0 / tpm)
+    if wait > 0:
+        return wait
+    if rpm:
+        entry["requests"] = max(0.0, entry["requests"] - 1)
+    if tpm:
+        entry["tokens"] = max(0.0, entry["tokens"] - tokens)
+    return 0.0
+
+
+def _record_wait(data, key_alias, model_name, waited):
+    m = data.setdefault("metrics", {}).setdefault(key_alias, {}).setdefault(model_name, {
+        "calls": 0, "queued_calls": 0, "total_wait_seconds": 0.0, "max_wait_seconds": 0.0})
+    m["calls"] += 1
+    if waited >= 0.01:
+        m["queued_calls"] += 1
+    m["total_wait_seconds"] = round(m["total_wait_seconds"] + waited, 3)
+    m["max_wait_seconds"] = round(max(m["max_wait_seconds"], waited), 3)
+    m["avg_wait_seconds"] = round(m["total_wait_seconds"] / m["calls"], 3)
+    m["last_wait_seconds"] = round(waited, 3)
+
+
+def try_acquire(api_key, model_name, tokens=0, key_alias="", test_mode=False, path=MODEL_LIST_FILE, clock=time.time, started=None):
+    """
+    1 lan thu lay slot, khong cho: tra ve 0 neu lay duoc, nguoc lai so giay can cho truoc lan thu sau.
+    started: thoi diem bat dau cho (ghi metrics thoi gian cho khi lay duoc slot).
+    Model khong cau hinh trong [RateLimits] -> 0 ngay, khong doc/ghi state.
+    """
+    rpm, tpm = limits_for(model_name, path)
+    if not rpm and not tpm:
+        return 0.0
+    bucket = f"{key_fingerprint(api_key)}:{model_name}"
+    # // Request lon hon ca bucket: chi doi bucket day (khong thi cho mai)
+    tokens = min(int(tokens or 0), tpm) if tpm else 0
+    alias = key_alias or key_fingerprint(api_key)
+    started = clock() if started is None else started
+
+    def _try(data):
+        now = clock()
+        wait = _take(data, bucket, rpm, tpm, tokens, now)
+        if wait <= 0:
+            _record_wait(data, alias, model_name, now - started)
+        return wait
+
+    return state_manager.update_rate_limits(_try, test_mode)
+
+
+def _log_wait(api_key, key_alias, model_name, waited):
+    if waited >= 1:
+        logging.info(f"[{key_alias or key_fingerprint(api_key)}] Cho slot rate limit model '{model_name}' {waited:.1f}s.")
+
+
+def acquire(api_key, model_name, tokens=0, key_alias="", test_mode=False, path=MODEL_LIST_FILE, clock=time.time, sleep=time.sleep):
+    """
+    Cho toi khi bucket (API key, model) con 1 request va `tokens` token roi lay ra. Tra ve so giay da cho.
+    Bucket luu trong state (rate_limits.json, file lock) -> dung chung moi host/worker va ca main.py lan api.py.
+    Model khong cau hinh trong [RateLimits] -> khong gioi han (tra ve 0 ngay).
+    """
+    rpm, tpm = limits_for(model_name, path)
+    if not rpm and not tpm:
+        return 0.0
+    started = clock()
+    with _local_lock(f"{key_fingerprint(api_key)}:{model_name}"):
+        while True:
+            wait = try_acquire(api_key, model_name, tokens, key_alias, test_mode, path, clock, started)
+            if wait <= 0:
+                break
+            sleep(min(wait, MAX_POLL_SECONDS))
+    waited = clock() - started
+    _log_wait(api_key, key_alias, model_name, waited)
+    return waited
+
+
+async def acquire_async(api_key, model_name, tokens=0, key_alias="", test_mode=False, path=MODEL_LIST_FILE, clock=time.time, sleep=asyncio.sleep):
+    """
+    Nhu acquire() cho event loop: moi lan thu la try_acquire (doc/ghi state ngan, trong thread),
+    thoi gian cho la asyncio.sleep tren loop -> khong giu thread hay lock cua process trong luc cho.
+    """
+    rpm, tpm = limits_for(model_name, path)
+    if not rpm and not tpm:
+        return 0.0
+    started = clock()
+    while True:
+        wait = await asyncio.to_thread(try_acquire, api_key, model_name, tokens, key_alias, test_mode, path, clock, started)
+        if wait <= 0:
+            break
+        await sleep(min(wait, MAX_POLL_SECONDS))
+    waited = clock() - started
+    _log_wait(api_key, key_alias, model_name, waited)
+    return waited
+
+
+def pending_wait(api_key, model_name, tokens=0, test_mode=False, path=MODEL_LIST_FILE, clock=time.time):
+    """So giay phai cho neu acquire ngay bay gio (chi doc state, khong lay slot). Dung de chon key trong pool."""
+    rpm, tpm = limits_for(model_name, path)
+    if not rpm and not tpm:
+        return 0.0
+    entry = dict(state_manager.get_rate_limits(test_mode).get("buckets", {}).get(f"{key_fingerprint(api_key)}:{model_name}", {}))
+    tokens = min(int(tokens or 0), tpm) if tpm else 0
+    return _take({"buckets": {"b": entry}}, "b", rpm, tpm, tokens, clock())
+
+
+def penalize(api_key, model_name, test_mode=False, path=MODEL_LIST_FILE, clock=time.time):
+    """
+    Van nhan 429 (quota thuc te thap hon cau hinh / bi dung chung key): xa het request cua bucket
+    de moi worker cung cho lai qua acquire. Tra ve False neu model khong co gioi han (nguoi goi tu backoff).
+    """
+    rpm, tpm = limits_for(model_name, path)
+    if not rpm and not tpm:
+        return False
+    bucket = f"{key_fingerprint(api_key)}:{model_name}"
+
+    def _drain(data):
+        entry = data.setdefault("buckets", {}).setdefault(bucket, {"updated_at": clock()})
+        _refill(entry, rpm, tpm, clock())
+        entry["requests" if rpm else "tokens"] = 0.0
+        return True
+
+    return state_manager.update_rate_limits(_drain, test_mode)
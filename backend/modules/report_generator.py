@@ -5,6 +5,7 @@ import logging
 import pytz
 import re
 from datetime import datetime
+from modules import report_index
 
 def slugify(text):
     """Tao slug safe cho ten thu muc."""
@@ -31,6 +32,11 @@ def save_structured_report(host_id, report_data, timezone_str, base_report_dir,
         os.makedirs(report_folder_path, exist_ok=True)
         
         report_file_path = os.path.join(report_folder_path, time_filename)
+        # // Nhieu chunk cung worker trong 1 giay -> them hau to, khong ghi de
+        suffix = 1
+        while os.path.exists(report_file_path):
+            report_file_path = os.path.join(report_folder_path, f"{now.strftime('%H-%M-%S')}_{suffix}.json")
+            suffix += 1
 
 
         report_data['report_type'] = stage_name
@@ -39,6 +45,11 @@ def save_structured_report(host_id, report_data, timezone_str, base_report_dir,
             json.dump(report_data, f, ensure_ascii=False, indent=4)
             
         logging.info(f"[{host_id}] Da luu bao cao JSON ({stage_name}) vao: '{report_file_path}'")
+        # // Loi index khong lam mat bao cao: chay report_index.rebuild() de dong bo lai
+        try:
+            report_index.index_report(base_report_dir, report_file_path, report_data)
+        except Exception as e:
+            logging.warning(f"[{host_id}] Khong cap nhat duoc index bao cao: {e}")
         return report_file_path
     except Exception as e:
         logging.error(f"[{host_id}] Loi khi luu file JSON: {e}")
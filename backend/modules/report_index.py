@@ -0,0 +1,182 @@
+import os
+import glob
+import json
+import logging
+import sqlite3
+from datetime import datetime
+
+# // Index SQLite dat ngay trong thu muc bao cao (moi report_directory 1 index)
+INDEX_FILENAME = "report_index.sqlite3"
+# // Cho khoa ghi (nhieu thread/process cung luu bao cao)
+BUSY_TIMEOUT_SECONDS = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    rel_path TEXT PRIMARY KEY,
+    host TEXT NOT NULL,
+    stage_slug TEXT NOT NULL,
+    report_type TEXT,
+    stage_index INTEGER,
+    start_time TEXT,
+    end_time TEXT,
+    mtime REAL NOT NULL,
+    raw_log_count INTEGER NOT NULL DEFAULT 0,
+    summary_stats TEXT,
+    status TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_reports_host_stage ON reports (host, stage_slug, mtime);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def index_path(base_report_dir):
+    return os.path.join(base_report_dir, INDEX_FILENAME)
+
+
+def _connect(base_report_dir):
+    """Mo index (tao schema neu chua co). Index chua tung build -> quet lai cay bao cao hien co."""
+    os.makedirs(base_report_dir, exist_ok=True)
+    conn = sqlite3.connect(index_path(base_report_dir), timeout=BUSY_TIMEOUT_SECONDS)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    _migrate(conn)
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'built_at'").fetchone() is None:
+        _rebuild(conn, base_report_dir)
+    return conn
+
+
+def _migrate(conn):
+    """Index tao tu ban cu chua co cot status (CREATE IF NOT EXISTS khong them cot)."""
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(reports)")}
+    if 'status' not in columns:
+        try:
+            conn.execute("ALTER TABLE reports ADD COLUMN status TEXT")
+        except sqlite3.OperationalError:
+            # // Process khac vua them cot
+            pass
+
+
+def _row_values(base_report_dir, path, data):
+    rel_path = os.path.relpath(path, base_report_dir)
+    parts = rel_path.split(os.sep)
+    stats = data.get('summary_stats') if isinstance(data.get('summary_stats'), dict) else {}
+    count = data.get('raw_log_count') or stats.get('raw_log_count') or 0
+    try:
+        count = int(count)
+    except (TypeError, ValueError):
+        count = 0
+    stage_index = data.get('stage_index')
+    return (rel_path, parts[0], parts[1] if len(parts) > 2 else '', data.get('report_type'),
+            stage_index if isinstance(stage_index, int) else None,
+            data.get('analysis_start_time'), data.get('analysis_end_time'),
+            os.path.getmtime(path), count, json.dumps(stats, ensure_ascii=False), data.get('status'))
+
+
+def _upsert(conn, base_report_dir, path, data):
+    conn.execute("INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", _row_values(base_report_dir, path, data))
+
+
+def _rebuild(conn, base_report_dir):
+    count = 0
+    with conn:
+        conn.execute("DELETE FROM reports")
+        for path in glob.glob(os.path.join(base_report_dir, '*', '**', '*.json'), recursive=True):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    _upsert(conn, base_report_dir, path, data)
+                    count += 1
+            except (OSError, ValueError) as e:
+                logging.debug(f"Bo qua bao cao loi khi build index {path}: {e}")
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('built_at', ?)", (datetime.now().isoformat(),))
+    logging.info(f"Da build index bao cao '{base_report_dir}': {count} bao cao.")
+    return count
+
+
+def rebuild(base_report_dir):
+    """Quet lai toan bo cay bao cao (bao cao cu, sua/xoa bang tay). Tra ve so bao cao."""
+    conn = _connect(base_report_dir)
+    try:
+        return _rebuild(conn, base_report_dir)
+    finally:
+        conn.close()
+
+
+def index_report(base_report_dir, path, data):
+    """Ghi/cap nhat 1 bao cao vao index (goi sau khi file JSON da ghi xong)."""
+    conn = _connect(base_report_dir)
+    try:
+        with conn:
+            _upsert(conn, base_report_dir, path, data)
+    finally:
+        conn.close()
+
+
+def remove_report(base_report_dir, path):
+    conn = _connect(base_report_dir)
+    try:
+        with conn:
+            conn.execute("DELETE FROM reports WHERE rel_path = ?", (os.path.relpath(path, base_report_dir),))
+    finally:
+        conn.close()
+
+
+def _to_dict(base_report_dir, row):
+    record = dict(row)
+    record['path'] = os.path.join(base_report_dir, record['rel_path'])
+    record['summary_stats'] = json.loads(record['summary_stats'] or '{}')
+    return record
+
+
+def query_reports(base_report_dir, host=None, stage_slugs=None, stage_index=None, newest_first=False, limit=None, after=None):
+    """
+    Lay bao cao tu index (thu tu theo mtime). Tra ve list dict: path, rel_path, host, stage_slug, report_type,
+    stage_index, start_time, end_time, mtime, raw_log_count, summary_stats, status (bao cao worker: success/failed).
+    after = (mtime, rel_path): chi lay bao cao dung sau vi tri nay (cursor cua Stage N).
+    Dong tro toi file da bi xoa ngoai API duoc bo khoi index.
+    """
+    clauses, params = [], []
+    if host is not None:
+        clauses.append("host = ?")
+        params.append(host)
+    if stage_slugs is not None:
+        clauses.append(f"stage_slug IN ({', '.join('?' * len(stage_slugs))})")
+        params.extend(stage_slugs)
+    if stage_index is not None:
+        clauses.append("stage_index = ?")
+        params.append(stage_index)
+    if after is not None:
+        clauses.append("(mtime > ? OR (mtime = ? AND rel_path > ?))")
+        params.extend([after[0], after[0], after[1]])
+    sql = "SELECT * FROM reports"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += f" ORDER BY mtime {'DESC' if newest_first else 'ASC'}, rel_path"
+
+    conn = _connect(base_report_dir)
+    try:
+        records, missing = [], []
+        for row in conn.execute(sql, params):
+            record = _to_dict(base_report_dir, row)
+            if not os.path.exists(record['path']):
+                missing.append(row['rel_path'])
+                continue
+            records.append(record)
+            if limit is not None and len(records) >= limit:
+                break
+        if missing:
+            with conn:
+                conn.executemany("DELETE FROM reports WHERE rel_path = ?", [(p,) for p in missing])
+        return records
+    finally:
+        conn.close()
+
+
+def total_raw_log_count(base_report_dir, stage_index=0):
+    conn = _connect(base_report_dir)
+    try:
+        return conn.execute("SELECT COALESCE(SUM(raw_log_count), 0) FROM reports WHERE stage_index = ?", (stage_index,)).fetchone()[0]
+    finally:
+        conn.close()
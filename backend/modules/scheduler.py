@@ -0,0 +1,159 @@
+import heapq
+import time
+import logging
+import threading
+import concurrent.futures
+from datetime import datetime
+from modules import state_manager
+
+# // So host chay pipeline cung luc (System: scheduler_max_parallel_hosts)
+DEFAULT_MAX_PARALLEL_HOSTS = 4
+# // Ngu toi da giua 2 lan doc lai config (host moi / bi tat) khi chua co host nao den han
+MAX_IDLE_SECONDS = 300
+
+
+class HostScheduler:
+    """
+    Lich chay pipeline theo host: min-heap (thoi diem den han, host), host den han duoc dua vao pool gioi han.
+    Host dang chay khong nam trong heap -> moi host chi 1 pipeline tai 1 thoi diem; chay xong moi tinh han tiep.
+    next_due(host, now, after_run) tra ve epoch den han (after_run=False: lan dau dua host vao lich).
+    Do tre (bat dau thuc te trong pool - den han, gom ca thoi gian cho slot) theo host luu vao state (scheduler_metrics.json).
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_PARALLEL_HOSTS, test_mode=False):
+        self.max_workers = max_workers
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="host")
+        # // Pool cu sau resize: cac host da submit van chay xong tren pool do
+        self._retired = []
+        self.test_mode = test_mode
+        self.metrics = state_manager.get_scheduler_metrics(test_mode) or {}
+        self._heap = []
+        # // Han hien hanh cua host dang cho; muc heap khac gia tri nay la muc cu (da reschedule) -> bo qua
+        self._due = {}
+        self._running = set()
+        # // Thoi diem host bat dau chay that (trong thread cua pool)
+        self._started_at = {}
+        self._active = set()
+        # // RLock: add_done_callback chay ngay trong dispatch neu future da xong
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+
+    def _push(self, host, due):
+        heapq.heappush(self._heap, (due, host))
+        self._due[host] = due
+        self.metrics.setdefault(host, {})["next_due"] = datetime.fromtimestamp(due).isoformat()
+
+    def sync(self, hosts, next_due, now=None):
+        """Cap nhat danh sach host dang bat: host moi vao lich, host bi tat bi bo khi toi luot."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._active = set(hosts)
+            for host in hosts:
+                if host not in self._due and host not in self._running:
+                    self._push(host, next_due(host, now, False))
+
+    def reschedule(self, hosts, next_due, now=None):
+        """Tinh lai han cua cac host vua doi config (host dang chay se tinh lai khi chay xong)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            for host in hosts:
+                if host in self._active and host not in self._running:
+                    self._push(host, next_due(host, now, False))
+        self._wake.set()
+
+    def dispatch(self, run_host, next_due, now=None):
+        """Dua moi host da den han vao pool. Tra ve danh sach host vua dispatch."""
+        now = time.time() if now is None else now
+        started = []
+        with self._lock:
+            # // Lay het muc den han truoc khi submit: host chay xong ngay (callback dong bo) chi vao lan dispatch sau
+            due_hosts = []
+            while self._heap and self._heap[0][0] <= now:
+                due, host = heapq.heappop(self._heap)
+                if self._due.get(host) != due:
+                    continue
+                del self._due[host]
+                if host in self._active and host not in self._running:
+                    due_hosts.append((due, host))
+            for due, host in due_hosts:
+                self._running.add(host)
+                m = self.metrics.setdefault(host, {})
+                m["last_due"] = datetime.fromtimestamp(due).isoformat()
+                future = self.executor.submit(self._run, host, due, run_host)
+                future.add_done_callback(lambda f, h=host: self._on_done(h, f, next_due))
+                started.append(host)
+            self._save_metrics()
+        return started
+
+    def _run(self, host, due, run_host):
+        """Chay trong thread cua pool: do tre tinh tai luc bat dau that (sau khi cho slot trong pool)."""
+        start = time.time()
+        lateness = max(0.0, start - due)
+        with self._lock:
+            self._started_at[host] = start
+            m = self.metrics.setdefault(host, {})
+            m["runs"] = m.get("runs", 0) + 1
+            m["last_started"] = datetime.fromtimestamp(start).isoformat()
+            m["lateness_seconds"] = round(lateness, 3)
+            m["max_lateness_seconds"] = round(max(m.get("max_lateness_seconds", 0.0), lateness), 3)
+            m["total_lateness_seconds"] = round(m.get("total_lateness_seconds", 0.0) + lateness, 3)
+            m["avg_lateness_seconds"] = round(m["total_lateness_seconds"] / m["runs"], 3)
+            self._save_metrics()
+        if lateness >= 1:
+            logging.info(f"[{host}] Bat dau tre {lateness:.1f}s so voi lich.")
+        run_host(host)
+
+    def _on_done(self, host, future, next_due):
+        finished = time.time()
+        exc = future.exception()
+        if exc is not None:
+            logging.error(f"[{host}] Pipeline loi: {exc}")
+        with self._lock:
+            self._running.discard(host)
+            m = self.metrics.setdefault(host, {})
+            m["last_duration_seconds"] = round(finished - self._started_at.pop(host, finished), 3)
+            m["last_error"] = str(exc) if exc is not None else None
+            if host in self._active:
+                try:
+                    due = next_due(host, finished, True)
+                except Exception as e:
+                    logging.error(f"[{host}] Khong tinh duoc lich tiep theo: {e}")
+                    due = finished + MAX_IDLE_SECONDS
+                self._push(host, due)
+            self._save_metrics()
+        self._wake.set()
+
+    def resize(self, max_workers):
+        """Doi so host chay song song (config reload): dispatch sau dung pool moi, host dang chay/da submit chay tiep tren pool cu."""
+        with self._lock:
+            if max_workers == self.max_workers:
+                return
+            logging.info(f"Scheduler: doi so host chay song song {self.max_workers} -> {max_workers}.")
+            self._retired.append(self.executor)
+            self.executor.shutdown(wait=False)
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="host")
+            self.max_workers = max_workers
+
+    def _save_metrics(self):
+        try:
+            state_manager.save_scheduler_metrics(self.metrics, self.test_mode)
+        except OSError as e:
+            logging.warning(f"Khong luu duoc scheduler metrics: {e}")
+
+    def seconds_until_next(self, now=None, max_idle=MAX_IDLE_SECONDS):
+        now = time.time() if now is None else now
+        with self._lock:
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return max_idle
+            return min(max(0.0, self._heap[0][0] - now), max_idle)
+
+    def wait(self, max_idle=MAX_IDLE_SECONDS):
+        """Ngu dung den host den han tiep theo (hoac den khi 1 host chay xong / max_idle)."""
+        self._wake.wait(self.seconds_until_next(max_idle=max_idle))
+        self._wake.clear()
+
+    def shutdown(self, wait=True):
+        for executor in self._retired + [self.executor]:
+            executor.shutdown(wait=wait)
@@ -14,6 +14,9 @@ BACKEND_DIR = os.path.dirname(CURRENT_MODULE_DIR)
 MAIN_STATE_DIR = os.path.join(BACKEND_DIR, 'states', 'main')
 TEST_STATE_DIR = os.path.join(BACKEND_DIR, 'states', 'test')
 
+# Ket qua Reduce trung gian (tree-reduce) giu toi da bao lau de retry
+REDUCE_CACHE_TTL_HOURS = 48
+
 def _get_state_file_path(filename, test_mode=False):
     """
     Helper de lay duong dan file state tuyet doi.
@@ -59,16 +62,203 @@ def save_last_cycle_run_timestamp(timestamp, host_id, test_mode=False):
     with open(file_path, 'w') as f:
         f.write(timestamp.isoformat())
 
-def get_stage_buffer_count(host_id, stage_index, test_mode=False):
-    """Lay so luong bao cao dang cho (buffer) cho stage cu the."""
+def get_log_checkpoint(host_id, test_mode=False):
+    """
+    Lay checkpoint doc log (inode, byte offset, last timestamp) cua host.
+    Tra ve dict hoac None neu chua co / file hong.
+    """
+    file_path = _get_state_file_path(f"log_checkpoint_{host_id}.json", test_mode)
+    if not os.path.exists(file_path):
+        return None
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else None
+    except (json.JSONDecodeError, ValueError, OSError):
+        return None
+
+def save_log_checkpoint(host_id, checkpoint, test_mode=False):
+    """Luu checkpoint doc log. Chi goi khi pipeline da xu ly xong doan log."""
+    file_path = _get_state_file_path(f"log_checkpoint_{host_id}.json", test_mode)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, indent=2)
+
+def get_log_format(host_id, test_mode=False):
+    """Lay format log da nhan dien cho host: {"format", "log_spec", "detected_at"} hoac None."""
+    file_path = _get_state_file_path(f"log_format_{host_id}.json", test_mode)
+    if not os.path.exists(file_path):
+        return None
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else None
+    except (json.JSONDecodeError, ValueError, OSError):
+        return None
+
+def save_log_format(host_id, detection, test_mode=False):
+    file_path = _get_state_file_path(f"log_format_{host_id}.json", test_mode)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(detection, f, indent=2)
+
+def get_template_state(host_id, test_mode=False):
+    """Lay state template log (Drain) cua host: {"next_id", "clusters"} hoac None."""
+    file_path = _get_state_file_path(f"log_templates_{host_id}.json", test_mode)
+    if not os.path.exists(file_path):
+        return None
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else None
+    except (json.JSONDecodeError, ValueError, OSError):
+        return None
+
+def save_template_state(host_id, state, test_mode=False):
+    file_path = _get_state_file_path(f"log_templates_{host_id}.json", test_mode)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+
+def _load_reduce_cache(file_path):
+    if not os.path.exists(file_path):
+        return {}
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (json.JSONDecodeError, ValueError, OSError):
+        return {}
+
+def get_reduce_cache(host_id, key, test_mode=False):
+    """Lay ket qua Reduce (trung gian/cuoi) da cache theo khoa noi dung; khong co -> None."""
+    entry = _load_reduce_cache(_get_state_file_path(f"reduce_cache_{host_id}.json", test_mode)).get(key)
+    return entry.get("result") if isinstance(entry, dict) else None
+
+def save_reduce_cache(host_id, key, result, test_mode=False):
+    """Luu 1 ket qua Reduce (file lock: cac nhom tree-reduce ghi song song); bo cac muc qua REDUCE_CACHE_TTL_HOURS."""
+    file_path = _get_state_file_path(f"reduce_cache_{host_id}.json", test_mode)
+    with utils.file_lock(file_path):
+        now = datetime.now()
+        cache = {}
+        for cached_key, entry in _load_reduce_cache(file_path).items():
+            try:
+                if (now - datetime.fromisoformat(entry["saved_at"])).total_seconds() < REDUCE_CACHE_TTL_HOURS * 3600:
+                    cache[cached_key] = entry
+            except (KeyError, TypeError, ValueError):
+                continue
+        cache[key] = {"result": result, "saved_at": now.isoformat()}
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+
+def get_backlog_status(host_id, test_mode=False):
+    """
+    Lay trang thai backlog log cua host (ghi sau moi chu ky Stage 0).
+    Tra ve dict (has_backlog, remaining_lines, remaining_bytes, eta_seconds, ...) hoac None.
+    """
+    file_path = _get_state_file_path(f"backlog_status_{host_id}.json", test_mode)
+    if not os.path.exists(file_path):
+        return None
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else None
+    except (json.JSONDecodeError, ValueError, OSError):
+        return None
+
+def save_backlog_status(host_id, status, test_mode=False):
+    file_path = _get_state_file_path(f"backlog_status_{host_id}.json", test_mode)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(status, f, indent=2)
+
+def get_stage_cursor(host_id, stage_index, test_mode=False):
+    """
+    Lay cursor bao cao nguon da tieu thu cua Stage N: {"mtime", "rel_path", "consumed_total", "last_batch", ...}
+    hoac None (chua chay lan nao -> moi bao cao deu chua tieu thu).
+    """
+    file_path = _get_state_file_path(f"stage_cursor_{host_id}_{stage_index}.json", test_mode)
+    if not os.path.exists(file_path):
+        return None
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) and "mtime" in data and "rel_path" in data else None
+    except (json.JSONDecodeError, ValueError, OSError):
+        return None
+
+def save_stage_cursor(host_id, stage_index, cursor, test_mode=False):
+    file_path = _get_state_file_path(f"stage_cursor_{host_id}_{stage_index}.json", test_mode)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(cursor, f, indent=2, ensure_ascii=False)
+
+def get_scheduler_metrics(test_mode=False):
+    """Lay metrics scheduler theo host (runs, lateness_seconds, max/avg lateness, next_due...) hoac None."""
+    file_path = _get_state_file_path("scheduler_metrics.json", test_mode)
+    if not os.path.exists(file_path):
+        return None
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else None
+    except (json.JSONDecodeError, ValueError, OSError):
+        return None
+
+def save_scheduler_metrics(metrics, test_mode=False):
+    file_path = _get_state_file_path("scheduler_metrics.json", test_mode)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(metrics, f, indent=2, ensure_ascii=False)
+
+def get_upload_cache(test_mode=False):
+    """Lay cache file da upload len Gemini: {"<sha256>:<key fingerprint>": {name, uri, mime_type, expires_at, ...}}."""
+    file_path = _get_state_file_path("upload_cache.json", test_mode)
+    if not os.path.exists(file_path):
+        return {}
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (json.JSONDecodeError, ValueError, OSError):
+        return {}
+
+def update_upload_cache(key, entry, test_mode=False):
+    """Ghi 1 muc cache upload (file lock: nhieu process cung ghi); bo cac muc da het han."""
+    file_path = _get_state_file_path("upload_cache.json", test_mode)
+    now = datetime.now().timestamp()
+    with utils.file_lock(file_path):
+        cache = {k: v for k, v in get_upload_cache(test_mode).items() if isinstance(v, dict) and v.get("expires_at", 0) > now}
+        cache[key] = entry
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=2, ensure_ascii=False)
+
+def get_rate_limits(test_mode=False):
+    """Lay state rate limiter: {"buckets": {"<key fingerprint>:<model>": {...}}, "metrics": {alias: {model: {...}}}}."""
+    file_path = _get_state_file_path("rate_limits.json", test_mode)
+    if not os.path.exists(file_path):
+        return {}
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (json.JSONDecodeError, ValueError, OSError):
+        return {}
+
+def update_rate_limits(mutate, test_mode=False):
+    """Doc - mutate(data) - ghi rate_limits.json duoi file lock (bucket dung chung giua cac process). Tra ve ket qua mutate."""
+    file_path = _get_state_file_path("rate_limits.json", test_mode)
+    with utils.file_lock(file_path):
+        data = get_rate_limits(test_mode)
+        result = mutate(data)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+    return result
+
+def get_stage_buffer_count(host_id, stage_index, test_mode=False, default=0):
+    """Lay so luong bao cao dang cho (buffer) cho stage cu the. Chua co file -> default."""
     file_path = _get_state_file_path(f"buffer_count_{host_id}_{stage_index}", test_mode)
     if not os.path.exists(file_path):
-        return 0
+        return default
     try:
         with open(file_path, 'r') as f:
             return int(f.read().strip())
     except (ValueError, FileNotFoundError):
-        return 0
+        return default
 
 def save_stage_buffer_count(host_id, stage_index, count, test_mode=False):
     """Luu so luong buffer."""
@@ -116,6 +306,46 @@ def increment_api_usage(key_alias="Unknown", test_mode=False):
     except Exception as e:
         logging.error(f"Error updating API usage stats: {e}")
 
+def record_key_outcome(key_alias, ok, latency_seconds, rate_limited=0, test_mode=False):
+    """
+    Ghi ket qua 1 request theo key alias vao api_usage_stats.json (muc "key_health", canh "breakdown"):
+    successes/failures/rate_limited, latency_ewma, last_*_at. Dung cho diem suc khoe cua key pool.
+    """
+    file_path = _get_state_file_path("api_usage_stats.json", test_mode)
+    now = datetime.now().timestamp()
+    try:
+        with utils.file_lock(file_path):
+            data = {"total": 0, "breakdown": {}}
+            if os.path.exists(file_path):
+                try:
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        content = f.read().strip()
+                        if content:
+                            data = json.loads(content)
+                except (json.JSONDecodeError, ValueError):
+                    pass
+
+            h = data.setdefault("key_health", {}).setdefault(key_alias, {"successes": 0, "failures": 0, "rate_limited": 0})
+            h["successes" if ok else "failures"] += 1
+            if rate_limited:
+                h["rate_limited"] += rate_limited
+                h["last_rate_limited_at"] = now
+            if ok:
+                previous = h.get("latency_ewma")
+                h["latency_ewma"] = round(latency_seconds if previous is None else 0.7 * previous + 0.3 * latency_seconds, 3)
+            else:
+                h["last_failure_at"] = now
+            h["last_used_at"] = now
+
+            with open(file_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+    except Exception as e:
+        logging.error(f"Error updating key health: {e}")
+
+def get_key_health(test_mode=False):
+    """{alias: {successes, failures, rate_limited, latency_ewma, last_rate_limited_at, ...}}."""
+    return get_api_usage_stats(test_mode).get("key_health", {})
+
 def get_api_usage_stats(test_mode=False):
     """
     Lay thong tin thong ke API usage.
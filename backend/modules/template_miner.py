@@ -0,0 +1,235 @@
+import re
+import logging
+from datetime import datetime
+from modules import state_manager
+
+# // Drain: cay co dinh do sau (so token -> DRAIN_DEPTH token dau -> danh sach cluster)
+DRAIN_DEPTH = 2
+SIMILARITY_THRESHOLD = 0.4
+MAX_CHILDREN = 100
+# // So template toi da giu trong state cua host (bo template cu, it gap nhat)
+MAX_CLUSTERS = 2000
+WILDCARD = "<*>"
+# // Bien moi vi tri <*>: dem toi da MAX_TRACKED_VALUES gia tri khac nhau, in VARIABLE_SAMPLES gia tri hay gap
+MAX_TRACKED_VALUES = 256
+VARIABLE_SAMPLES = 3
+MAX_SAMPLE_CHARS = 48
+
+# // Tach token theo khoang trang va dau ',' (CSV filterlog), giu lai dau phan cach de dung lai dong
+SPLIT_RE = re.compile(r'(\s+|,)')
+# // Token chac chan la bien: so, IPv4[:port|/mask], IPv6, hex, MAC, gio
+VARIABLE_RE = re.compile(
+    r'^(?:[+-]?\d+(?:\.\d+)*'
+    r'|\d{1,3}(?:\.\d{1,3}){3}(?:[:/]\d+)?'
+    r'|0x[0-9a-fA-F]+'
+    r'|[0-9a-fA-F]{0,4}(?::[0-9a-fA-F]{0,4}){2,7}'
+    r'|[0-9a-fA-F]{2}(?:[:-][0-9a-fA-F]{2}){5}'
+    r'|\d\d:\d\d:\d\d(?:\.\d+)?)$'
+)
+
+
+def _tokenize(line):
+    """Tra ve (tokens, delims): tokens[i] + delims[i] + tokens[i+1] ... dung lai dung dong goc."""
+    parts = SPLIT_RE.split(line.strip())
+    return parts[0::2], parts[1::2]
+
+
+class LogCluster:
+    """1 template: token co dinh hoac WILDCARD, so dong da khop (moi chu ky)."""
+
+    def __init__(self, cluster_id, template, delims, size=0, last_seen=None):
+        self.cluster_id = cluster_id
+        self.template = template
+        self.delims = delims
+        self.size = size
+        self.last_seen = last_seen
+
+    def text(self, fixed=None):
+        """Dung lai template; fixed = {vi_tri: gia tri} thay cho <*> (bien chi co 1 gia tri trong chunk)."""
+        tokens = [fixed.get(i, t) for i, t in enumerate(self.template)] if fixed else self.template
+        out = [tokens[0]]
+        for delim, token in zip(self.delims, tokens[1:]):
+            out.append(' ' if delim.isspace() else delim)
+            out.append(token)
+        return "".join(out)
+
+    def to_dict(self):
+        return {"id": self.cluster_id, "template": self.template, "delims": self.delims,
+                "size": self.size, "last_seen": self.last_seen}
+
+
+class TemplateMiner:
+    """
+    Gom dong log thanh template kieu Drain (He et al., ICWS 2017), tang dan tung dong.
+    State (danh sach template) luu theo host giua cac chu ky: template da hoc khong phai hoc lai.
+    """
+
+    def __init__(self, clusters=None, next_id=1):
+        self.clusters = {}
+        self.next_id = next_id
+        self._tree = {}
+        for cluster in clusters or []:
+            self.clusters[cluster.cluster_id] = cluster
+            self._add_to_tree(cluster)
+            self.next_id = max(self.next_id, cluster.cluster_id + 1)
+
+    def _prefix_keys(self, tokens):
+        keys = []
+        for token in tokens[:DRAIN_DEPTH]:
+            keys.append(WILDCARD if token == WILDCARD or any(c.isdigit() for c in token) else token)
+        return keys
+
+    def _add_to_tree(self, cluster):
+        tokens = cluster.template
+        node = self._tree.setdefault(len(tokens), {})
+        keys = self._prefix_keys(tokens)
+        for depth, key in enumerate(keys):
+            # // Nut qua nhieu nhanh -> gom vao nhanh WILDCARD
+            if key not in node and len(node) >= MAX_CHILDREN:
+                key = WILDCARD
+            node = node.setdefault(key, [] if depth == len(keys) - 1 else {})
+        node.append(cluster)
+
+    def _candidates(self, tokens):
+        """Cluster co the khop: di theo token dau cua dong va ca nhanh WILDCARD o moi tang."""
+        nodes = [self._tree.get(len(tokens))]
+        for key in self._prefix_keys(tokens):
+            nodes = [child for node in nodes if node
+                     for child in (node.get(key), node.get(WILDCARD) if key != WILDCARD else None) if child]
+        return [cluster for leaf in nodes for cluster in leaf]
+
+    @staticmethod
+    def _similarity(template, tokens):
+        same = params = 0
+        for t_token, token in zip(template, tokens):
+            if t_token == WILDCARD:
+                params += 1
+            elif t_token == token:
+                same += 1
+        return same / len(tokens), params
+
+    def add_line(self, line):
+        """Gan 1 dong vao template (tao moi / tong quat hoa template cu). Tra ve (cluster, tokens) hoac (None, None) neu dong rong."""
+        tokens, delims = _tokenize(line)
+        if tokens == ['']:
+            return None, None
+        masked = [WILDCARD if VARIABLE_RE.match(token) else token for token in tokens]
+
+        best, best_key = None, (-1.0, -1)
+        for cluster in self._candidates(masked):
+            key = self._similarity(cluster.template, masked)
+            if key > best_key:
+                best, best_key = cluster, key
+
+        if best is None or best_key[0] < SIMILARITY_THRESHOLD:
+            best = LogCluster(self.next_id, masked, delims)
+            self.next_id += 1
+            self.clusters[best.cluster_id] = best
+            self._add_to_tree(best)
+        else:
+            # // Vi tri khac nhau -> WILDCARD (cay khong doi: prefix da la WILDCARD hoac giong nhau)
+            template = best.template
+            for i, token in enumerate(masked):
+                if template[i] != token and template[i] != WILDCARD:
+                    template[i] = WILDCARD
+        best.size += 1
+        return best, tokens
+
+    def prune(self):
+        """Giu toi da MAX_CLUSTERS template: bo template lau khong gap va it dong nhat."""
+        if len(self.clusters) <= MAX_CLUSTERS:
+            return
+        keep = sorted(self.clusters.values(), key=lambda c: (c.last_seen or "", c.size), reverse=True)[:MAX_CLUSTERS]
+        self.__init__(keep, self.next_id)
+
+    def to_state(self):
+        return {"next_id": self.next_id, "clusters": [c.to_dict() for c in self.clusters.values()]}
+
+    @classmethod
+    def from_state(cls, state):
+        clusters = [LogCluster(c["id"], c["template"], c["delims"], c.get("size", 0), c.get("last_seen"))
+                    for c in (state or {}).get("clusters", [])
+                    if len(c.get("delims", [])) == len(c.get("template", [])) - 1]
+        return cls(clusters, (state or {}).get("next_id", 1))
+
+
+class ChunkSummary:
+    """Thong ke template cua 1 chunk: so dong + gia tri bien hay gap theo tung vi tri <*>."""
+
+    def __init__(self):
+        self.order = []
+        self.counts = {}
+        self.variables = {}
+
+    def add(self, cluster, tokens):
+        cid = cluster.cluster_id
+        if cid not in self.counts:
+            self.order.append(cluster)
+            self.counts[cid] = 0
+            self.variables[cid] = {}
+        self.counts[cid] += 1
+        positions = self.variables[cid]
+        for i, t_token in enumerate(cluster.template):
+            if t_token != WILDCARD:
+                continue
+            values = positions.setdefault(i, {})
+            value = tokens[i]
+            if value in values:
+                values[value] += 1
+            elif len(values) < MAX_TRACKED_VALUES:
+                values[value] = 1
+
+    def render(self, total_lines):
+        clusters = sorted(self.order, key=lambda c: self.counts[c.cluster_id], reverse=True)
+        out = [f"### LOG DA GOM THEO TEMPLATE: {total_lines} dong -> {len(clusters)} template. "
+               f"<*> = gia tri thay doi; #vi_tri = gia tri hay gap (so lan).\n"]
+        for cluster in clusters:
+            cid = cluster.cluster_id
+            fixed, samples = {}, []
+            for i, values in sorted(self.variables[cid].items()):
+                # // Vi tri bi tong quat hoa sau khi da gap dong trong chunk -> chua co gia tri
+                if cluster.template[i] != WILDCARD or not values:
+                    continue
+                if len(values) == 1 and next(iter(values.values())) == self.counts[cid]:
+                    fixed[i] = next(iter(values))
+                    continue
+                top = sorted(values.items(), key=lambda kv: kv[1], reverse=True)[:VARIABLE_SAMPLES]
+                text = ", ".join(f"{v[:MAX_SAMPLE_CHARS]}({n})" for v, n in top)
+                more = f" +{len(values) - len(top)}{'+' if len(values) >= MAX_TRACKED_VALUES else ''} khac" if len(values) > len(top) else ""
+                samples.append(f"#{i} {text}{more}")
+            out.append(f"[T{cid}] x{self.counts[cid]} | {cluster.text(fixed)}\n")
+            if samples:
+                out.append(f"    vars: {' | '.join(samples)}\n")
+        return "".join(out)
+
+
+def compress_chunk(miner, chunk_str):
+    """
+    Thay chunk log tho bang "template x so dong + bien mau". Tra ve (text, so template trong chunk).
+    Dong canh bao '!!!' cua log_reader duoc giu nguyen o cuoi.
+    """
+    summary = ChunkSummary()
+    passthrough = []
+    total = 0
+    now = datetime.now().isoformat()
+    for line in chunk_str.splitlines():
+        if line.startswith('!!!'):
+            passthrough.append(line + "\n")
+            continue
+        cluster, tokens = miner.add_line(line)
+        if cluster is None:
+            continue
+        cluster.last_seen = now
+        summary.add(cluster, tokens)
+        total += 1
+    return summary.render(total) + "".join(passthrough), len(summary.order)
+
+
+def load_miner(host_id, test_mode=False):
+    return TemplateMiner.from_state(state_manager.get_template_state(host_id, test_mode))
+
+
+def save_miner(host_id, miner, test_mode=False):
+    miner.prune()
+    state_manager.save_template_state(host_id, miner.to_state(), test_mode)
+    logging.info(f"[{host_id}] Da luu {len(miner.clusters)} template log.")
@@ -0,0 +1,119 @@
+import calendar
+from datetime import datetime
+
+# // Bang thang cho BSD syslog ("Oct 16 10:00:00")
+MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
+}
+
+SYSLOG_PREFIX_LEN = 15
+ISO_PREFIX_LEN = 19
+# // So byte dau dong du de chua timestamp (ke ca vai ky tu trang o dau)
+TIMESTAMP_PROBE_BYTES = 48
+
+class FastTimestampParser:
+    """
+    Parse timestamp dau dong ra epoch (int, giay UTC) thay cho strptime + tz.localize.
+    - Cat chuoi theo vi tri co dinh roi int(), khong dung strptime.
+    - Nho prefix cua giay gan nhat: cac dong lien tiep cung giay chi ton 1 phep so sanh chuoi.
+    - Cache offset UTC theo ngay (ngay co chuyen DST thi cache theo gio).
+    Moi instance dung cho 1 luong doc (khong thread-safe).
+    """
+
+    # // So byte dau dong can decode de tim timestamp (parser theo format co the doi)
+    probe_bytes = TIMESTAMP_PROBE_BYTES
+
+    def __init__(self, tz, reference_time=None):
+        self.tz = tz
+        reference_time = reference_time or datetime.now(tz)
+        self.current_year = reference_time.year
+        # // Syslog khong co nam: dong "tuong lai" qua 1 ngay la log cua nam truoc
+        self.rollover_epoch = reference_time.timestamp() + 86400
+        self._last_prefix = None
+        self._last_prefix_bytes = None
+        self._last_epoch = None
+        self._day_cache = {}
+
+    def _utc_offset(self, year, month, day, hour):
+        key = (year, month, day)
+        cached = self._day_cache.get(key)
+        if cached is None:
+            first = int(self.tz.localize(datetime(year, month, day, 0)).utcoffset().total_seconds())
+            last = int(self.tz.localize(datetime(year, month, day, 23, 59, 59)).utcoffset().total_seconds())
+            # // Offset dong nhat ca ngay -> luu int, nguoc lai luu dict theo gio
+            cached = first if first == last else {}
+            self._day_cache[key] = cached
+        if isinstance(cached, int):
+            return cached
+        offset = cached.get(hour)
+        if offset is None:
+            offset = int(self.tz.localize(datetime(year, month, day, hour)).utcoffset().total_seconds())
+            cached[hour] = offset
+        return offset
+
+    def _to_epoch(self, year, month, day, hour, minute, second):
+        # // Ngay khong hop le (vd 31/02) se raise ValueError khi tao datetime trong _utc_offset
+        if not (hour < 24 and minute < 60 and second <= 61):
+            return None
+        return calendar.timegm((year, month, day, hour, minute, second)) - self._utc_offset(year, month, day, hour)
+
+    def _remember(self, prefix, epoch):
+        if epoch is not None:
+            self._last_prefix = prefix
+            self._last_epoch = epoch
+        return epoch
+
+    def _parse_syslog(self, line):
+        """BSD syslog: "Oct 16 10:00:00" / "Oct  6 10:00:00" (khong co nam)."""
+        if len(line) < SYSLOG_PREFIX_LEN or line[3] != ' ' or line[9] != ':' or line[12] != ':':
+            return None
+        month = MONTHS.get(line[:3])
+        if not month:
+            return None
+        try:
+            day, hour, minute, second = int(line[4:6]), int(line[7:9]), int(line[10:12]), int(line[13:15])
+            epoch = self._to_epoch(self.current_year, month, day, hour, minute, second)
+            if epoch is not None and epoch > self.rollover_epoch:
+                epoch = self._to_epoch(self.current_year - 1, month, day, hour, minute, second)
+        except ValueError:
+            return None
+        return self._remember(line[:SYSLOG_PREFIX_LEN], epoch)
+
+    def _parse_iso(self, line):
+        """ISO: "2025-10-16 10:00:00" / "2025-10-16T10:00:00" (gio theo tz cua host)."""
+        if (len(line) < ISO_PREFIX_LEN or line[0] != '2' or line[1] != '0'
+                or line[4] != '-' or line[7] != '-' or line[10] not in ' T' or line[13] != ':' or line[16] != ':'):
+            return None
+        try:
+            epoch = self._to_epoch(int(line[0:4]), int(line[5:7]), int(line[8:10]),
+                                   int(line[11:13]), int(line[14:16]), int(line[17:19]))
+        except ValueError:
+            return None
+        return self._remember(line[:ISO_PREFIX_LEN], epoch)
+
+    def parse(self, line):
+        """Tra ve epoch (int) cua timestamp dau dong, hoac None neu khong nhan ra."""
+        last_prefix = self._last_prefix
+        if last_prefix is not None and line.startswith(last_prefix):
+            return self._last_epoch
+
+        if line[:1] in (' ', '\t'):
+            line = line.lstrip()
+        epoch = self._parse_syslog(line)
+        if epoch is None:
+            epoch = self._parse_iso(line)
+        return epoch
+
+    def parse_bytes(self, raw):
+        """
+        Nhu parse() nhung nhan bytes (1 dong, khong gom '\n'). Chi decode probe_bytes
+        dau dong, phan con lai cua dong khong bi decode.
+        """
+        last_prefix = self._last_prefix_bytes
+        if last_prefix is not None and raw.startswith(last_prefix):
+            return self._last_epoch
+        epoch = self.parse(raw[:self.probe_bytes].decode('latin-1'))
+        if epoch is not None and self._last_prefix is not None:
+            self._last_prefix_bytes = self._last_prefix.encode('latin-1')
+        return epoch
@@ -0,0 +1,115 @@
+import os
+import math
+import logging
+import configparser
+
+MODEL_LIST_FILE = "model_list.ini"
+# // model_list.ini [TokenCalibration]: <model ID> = so ky tu / token (do tu usage_metadata cua log that)
+CALIBRATION_SECTION = "TokenCalibration"
+DEFAULT_CHARS_PER_TOKEN = 4.0
+
+_CALIBRATION = {}
+
+
+def load_calibration(path=MODEL_LIST_FILE):
+    """Doc he so ky tu/token theo model; nho theo mtime file. File/section khong co -> {}."""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    cached = _CALIBRATION.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    config = configparser.ConfigParser()
+    config.read(path, encoding='utf-8')
+    calibration = {}
+    if config.has_section(CALIBRATION_SECTION):
+        for model, value in config.items(CALIBRATION_SECTION):
+            try:
+                ratio = float(value)
+            except ValueError:
+                logging.warning(f"He so token khong hop le cho model '{model}': {value}")
+                continue
+            if ratio > 0:
+                calibration[model] = ratio
+    _CALIBRATION[path] = (mtime, calibration)
+    return calibration
+
+
+class TokenEstimator:
+    """
+    Uoc tinh token cua 1 doan text: count_tokens(text) neu co hook (vd goi API countTokens),
+    nguoc lai len(text) / chars_per_token cua model (model_list.ini [TokenCalibration]).
+    """
+
+    def __init__(self, model_name=None, chars_per_token=None, count_tokens=None, calibration=None):
+        if chars_per_token is None:
+            if calibration is None:
+                calibration = load_calibration()
+            # // ConfigParser ha chu thuong key
+            chars_per_token = calibration.get((model_name or '').lower(), DEFAULT_CHARS_PER_TOKEN)
+        self.model_name = model_name
+        self.chars_per_token = chars_per_token
+        self.count_tokens = count_tokens
+
+    def estimate(self, text):
+        """Uoc tinh nhanh (khong goi hook), dung de xep dong vao chunk."""
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def count(self, text):
+        """So token cua ca chunk: hook neu co (loi -> quay ve uoc tinh)."""
+        if self.count_tokens is not None:
+            try:
+                return int(self.count_tokens(text))
+            except Exception as e:
+                logging.warning(f"count_tokens hook loi ({e}), dung uoc tinh theo ky tu.")
+        return self.estimate(text)
+
+
+def is_continuation(line, parser):
+    """Dong tiep noi cua su kien nhieu dong (stack trace...): thut dau dong hoac khong co timestamp."""
+    if line[:1] in (' ', '\t'):
+        return True
+    return parser.parse(line) is None
+
+
+def _iter_events(lines, parser):
+    """Gom dong thanh su kien: dong co timestamp mo su kien moi, dong tiep noi di kem su kien truoc."""
+    event = []
+    has_timestamp = False
+    for line in lines:
+        if event and has_timestamp and line.strip() and is_continuation(line, parser):
+            event.append(line)
+            continue
+        if event:
+            yield "".join(event)
+        event = [line]
+        has_timestamp = not line[:1].isspace() and parser.parse(line) is not None
+    if event:
+        yield "".join(event)
+
+
+def iter_token_chunks(lines, token_budget, estimator, parser):
+    """
+    Xep su kien vao chunk den khi cham token_budget (uoc tinh), khong bao gio cat doi su kien nhieu dong.
+    Su kien lon hon budget di 1 minh 1 chunk. Canh bao backlog ('!!!') luon nam trong chunk cuoi.
+    Yield (chunk_str, planned_tokens): planned_tokens = estimator.count(chunk) (hook count_tokens neu co).
+    """
+    buf, planned = [], 0
+    for event in _iter_events(lines, parser):
+        tokens = estimator.estimate(event)
+        if event.lstrip('\n').startswith('!!!'):
+            buf.append(event)
+            planned += tokens
+            continue
+        if buf and planned + tokens > token_budget:
+            chunk = "".join(buf)
+            yield chunk, estimator.count(chunk)
+            buf, planned = [], 0
+        if tokens > token_budget:
+            logging.warning(f"Su kien {tokens} token vuot token budget {token_budget}, gui nguyen trong 1 chunk.")
+        buf.append(event)
+        planned += tokens
+    if buf:
+        chunk = "".join(buf)
+        yield chunk, estimator.count(chunk)
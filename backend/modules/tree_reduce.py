@@ -0,0 +1,102 @@
+import hashlib
+import logging
+import threading
+import concurrent.futures
+from modules import state_manager
+
+# // Token toi da cua 1 lan Reduce (System: reduce_token_budget); vuot -> reduce theo cay
+DEFAULT_REDUCE_TOKEN_BUDGET = 200000
+MIN_FAN_IN = 2
+# // So Reduce trung gian chay song song
+REDUCE_WORKERS = 4
+PART_SEPARATOR = "\n\n"
+
+_CACHE_LOCK = threading.Lock()
+
+
+class ReduceFailed(Exception):
+    """1 lan goi Reduce (sau khi da retry) that bai."""
+
+
+def cache_key(text, identity):
+    """Khoa cache: noi dung dau vao + model/prompt (identity)."""
+    return hashlib.sha256(f"{identity}\0{text}".encode('utf-8')).hexdigest()
+
+
+def plan_groups(token_counts, token_budget):
+    """
+    Chia cac phan lien tiep thanh nhom co tong token <= token_budget (fan-in k chon theo budget).
+    Khong gop duoc nhom nao (moi phan > budget/2) -> ghep tung cap de cay van ngan lai.
+    Tra ve list cac list chi so.
+    """
+    groups, current, current_tokens = [], [], 0
+    for idx, tokens in enumerate(token_counts):
+        if current and current_tokens + tokens > token_budget:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(idx)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    if len(groups) == len(token_counts):
+        groups = [list(range(i, min(i + MIN_FAN_IN, len(token_counts)))) for i in range(0, len(token_counts), MIN_FAN_IN)]
+    return groups
+
+
+def tree_reduce(host_id, parts, reduce_fn, estimator, token_budget, identity, header="", test_mode=False, max_workers=REDUCE_WORKERS):
+    """
+    Reduce cac phan (theo thu tu) ve 1 ket qua. Tong token <= token_budget -> 1 lan goi reduce_fn nhu cu;
+    nguoc lai reduce tung nhom song song, lap lai tren ket qua trung gian den khi vua budget.
+    Moi ket qua (ke ca trung gian) duoc cache theo noi dung: retry sau loi khong phai chay lai cac nhanh da xong.
+    header chi dat truoc noi dung cua lan Reduce cuoi. reduce_fn(text) tra ve text hoac raise ReduceFailed.
+    Tra ve (ket qua, stats).
+    """
+    stats = {"levels": 0, "calls": 0, "cache_hits": 0, "estimated_tokens": 0, "fan_in": []}
+    stats_lock = threading.Lock()
+
+    def _reduce(text):
+        key = cache_key(text, identity)
+        cached = state_manager.get_reduce_cache(host_id, key, test_mode)
+        if cached is not None:
+            with stats_lock:
+                stats["cache_hits"] += 1
+            return cached
+        with stats_lock:
+            stats["calls"] += 1
+            stats["estimated_tokens"] += estimator.estimate(text)
+        result = reduce_fn(text)
+        with _CACHE_LOCK:
+            state_manager.save_reduce_cache(host_id, key, result, test_mode)
+        return result
+
+    level = list(parts)
+    while True:
+        token_counts = [estimator.estimate(part) for part in level]
+        total = sum(token_counts) + estimator.estimate(header)
+        if total <= token_budget or len(level) <= 1:
+            if total > token_budget:
+                logging.warning(f"[{host_id}] Reduce cuoi ~{total} token vuot budget {token_budget}, van gui 1 lan.")
+            return _reduce(header + PART_SEPARATOR.join(level)), stats
+
+        groups = plan_groups(token_counts, token_budget)
+        stats["levels"] += 1
+        stats["fan_in"].append(max(len(g) for g in groups))
+        logging.info(f"[{host_id}] Tree-reduce tang {stats['levels']}: {len(level)} phan -> {len(groups)} nhom (fan-in toi da {stats['fan_in'][-1]}).")
+
+        texts = [PART_SEPARATOR.join(level[i] for i in group) for group in groups]
+        results = [None] * len(groups)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for idx, (group, text) in enumerate(zip(groups, texts)):
+                if len(group) == 1:
+                    results[idx] = text
+                else:
+                    futures[executor.submit(_reduce, text)] = idx
+            for future in concurrent.futures.as_completed(futures):
+                # // Loi 1 nhanh -> ca cay loi; cac nhanh da xong van nam trong cache cho lan retry
+                results[futures[future]] = future.result()
+
+        level = [
+            text if len(group) == 1 else f"--- INTERMEDIATE SUMMARY {stats['levels']}.{idx + 1} (PARTS {group[0] + 1}-{group[-1] + 1}) ---\n{text}"
+            for idx, (group, text) in enumerate(zip(groups, results))
+        ]
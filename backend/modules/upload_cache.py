@@ -0,0 +1,113 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+import concurrent.futures
+from datetime import datetime, timezone
+from modules import state_manager
+
+# // File API cua Gemini giu file 48h; het han som hon 1 chut de khong gui handle sap het han
+DEFAULT_FILE_TTL_SECONDS = 48 * 3600
+EXPIRY_MARGIN_SECONDS = 3600
+# // Handle con han nhung co the da bi xoa: kiem tra lai (get_file) toi da moi N giay
+VERIFY_INTERVAL_SECONDS = 600
+
+_LOCK = threading.Lock()
+_INFLIGHT = {}
+_HASHES = {}
+
+
+def file_sha256(path):
+    """sha256 noi dung file, nho theo (path, mtime, size) de khong bam lai PDF moi lan goi."""
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _HASHES.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    _HASHES[path] = (stamp, digest.hexdigest())
+    return _HASHES[path][1]
+
+
+def key_fingerprint(api_key):
+    """File upload thuoc ve project cua API key: dung hash (khong luu key that) lam 1 phan khoa cache."""
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:16]
+
+
+def _expiry_epoch(file_obj, now):
+    expiration = getattr(file_obj, 'expiration_time', None)
+    if isinstance(expiration, datetime):
+        if expiration.tzinfo is None:
+            expiration = expiration.replace(tzinfo=timezone.utc)
+        return expiration.timestamp()
+    return now + DEFAULT_FILE_TTL_SECONDS
+
+
+def to_part(entry):
+    """Handle da cache -> phan file_data cua request generate_content."""
+    return {"file_data": {"mime_type": entry["mime_type"], "file_uri": entry["uri"]}}
+
+
+def _is_usable(entry, now, get_file):
+    if entry is None or entry.get("expires_at", 0) - EXPIRY_MARGIN_SECONDS <= now:
+        return False
+    if now - entry.get("verified_at", 0) < VERIFY_INTERVAL_SECONDS:
+        return True
+    try:
+        remote = get_file(entry["name"])
+    except Exception as e:
+        logging.info(f"File '{entry.get('display_name')}' khong con tren Gemini ({e}), upload lai.")
+        return False
+    if getattr(getattr(remote, 'state', None), 'name', 'ACTIVE') != "ACTIVE":
+        return False
+    entry["verified_at"] = now
+    return True
+
+
+def get_or_upload(path, api_key, upload_file, get_file, host_id="", test_mode=False):
+    """
+    Tra ve handle (dict: name, uri, mime_type, expires_at...) cua file cho API key nay, hoac None neu upload loi.
+    Khoa cache = (sha256 noi dung, fingerprint API key); cache luu trong state (upload_cache.json) giua cac lan chay.
+    Nhieu worker cung can 1 file -> chi 1 lan upload, cac worker khac doi ket qua do.
+    upload_file(path) -> file object da xu ly xong (hoac None); get_file(name) -> file object / raise neu da xoa.
+    """
+    key = f"{file_sha256(path)}:{key_fingerprint(api_key)}"
+    now = time.time()
+    with _LOCK:
+        entry = state_manager.get_upload_cache(test_mode).get(key)
+        inflight = _INFLIGHT.get(key)
+        owner = inflight is None
+        if owner:
+            inflight = _INFLIGHT[key] = concurrent.futures.Future()
+    if not owner:
+        return inflight.result()
+
+    try:
+        if _is_usable(entry, now, get_file):
+            logging.info(f"[{host_id}] Dung lai file da upload: {entry.get('display_name')} ({entry['uri']})")
+            state_manager.update_upload_cache(key, entry, test_mode)
+            result = entry
+        else:
+            file_obj = upload_file(path)
+            result = None
+            if file_obj is not None:
+                result = {
+                    "name": file_obj.name, "uri": file_obj.uri,
+                    "mime_type": getattr(file_obj, 'mime_type', None) or 'application/octet-stream',
+                    "display_name": getattr(file_obj, 'display_name', None) or os.path.basename(path),
+                    "expires_at": _expiry_epoch(file_obj, now), "uploaded_at": now, "verified_at": now,
+                }
+                state_manager.update_upload_cache(key, result, test_mode)
+        inflight.set_result(result)
+        return result
+    except Exception as e:
+        logging.error(f"[{host_id}] Loi cache upload '{path}': {e}")
+        inflight.set_result(None)
+        return None
+    finally:
+        with _LOCK:
+            _INFLIGHT.pop(key, None)
@@ -0,0 +1,204 @@
+"""
+Benchmark: Stage 0 goi Gemini qua thread pool (analyze_with_gemini) vs engine async (analyze_with_gemini_async + async_engine).
+Gemini duoc thay bang 1 server HTTP gia cuc bo (asyncio, tra loi sau LATENCY giay); model gia goi server do
+bang httpx (sync cho thread, AsyncClient cho async) -> do chi phi cho mang, khong phu thuoc quota that.
+Dem usage (file lock) va rate limiter duoc tat, ep che do legacy (GenerativeModel) de chi so sanh 2 cach chay.
+Lan chay them co rate limit: RATE_LIMITED_CHUNKS chunk, 1 key, model gioi han RATE_LIMIT_RPM request/phut
+(bucket trong state tam) -> chunk vuot bucket phai cho slot: thread giu 1 thread / chunk dang cho, async cho tren loop.
+Chay: python tests/bench_async_engine.py [latency_giay]   (mac dinh 0.5; so chunk dong thoi 10 / 100 / 500)
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import threading
+import multiprocessing
+import concurrent.futures
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import async_engine
+from modules import gemini_analyzer
+from modules import rate_limiter
+from modules import state_manager
+
+CONCURRENCY_LEVELS = (10, 100, 500)
+LATENCY = 0.5
+# // Lan chay co rate limit: 100 chunk, bucket 90 request/phut -> 10 chunk cuoi cho slot (~6-7s)
+RATE_LIMITED_CHUNKS = 100
+RATE_LIMIT_RPM = 90
+RESPONSE = b'{"text": "```json\\n{\\"stat_1_value\\": 1}\\n```\\nok"}'
+
+
+async def _handle(reader, writer, latency):
+    """1 ket noi HTTP/1.1 keep-alive: moi request cho `latency` giay roi tra JSON co dinh."""
+    try:
+        while True:
+            header = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in header.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            if length:
+                await reader.readexactly(length)
+            await asyncio.sleep(latency)
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s" % (len(RESPONSE), RESPONSE))
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def _serve(latency, port_queue):
+    async def _main():
+        server = await asyncio.start_server(lambda r, w: _handle(r, w, latency), "127.0.0.1", 0, backlog=1024)
+        port_queue.put(server.sockets[0].getsockname()[1])
+        await server.serve_forever()
+    asyncio.run(_main())
+
+
+class FakeGeminiServer:
+    """Server Gemini gia (asyncio) trong process rieng: khong tranh GIL voi phia client dang do."""
+
+    def __init__(self, latency):
+        port_queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_serve, args=(latency, port_queue), daemon=True)
+        self.process.start()
+        self.port = port_queue.get(timeout=10)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+
+
+class HttpModel:
+    """GenerativeModel gia goi FakeGeminiServer (generate_content: httpx sync, generate_content_async: httpx async)."""
+
+    def __init__(self, url):
+        self.url = url
+        limits = httpx.Limits(max_connections=1000, max_keepalive_connections=1000)
+        self.sync_client = httpx.Client(limits=limits, timeout=60)
+        self.async_client = None
+        self.limits = limits
+
+    def _response(self, payload):
+        return SimpleNamespace(parts=["x"], text=payload["text"], usage_metadata=None)
+
+    def generate_content(self, contents, safety_settings=None):
+        return self._response(self.sync_client.post(self.url, json={"contents": str(contents[0])[:200]}).json())
+
+    async def generate_content_async(self, contents, safety_settings=None):
+        # // AsyncClient gan voi loop cua async_engine -> tao lan dau tren loop do
+        if self.async_client is None:
+            self.async_client = httpx.AsyncClient(limits=self.limits, timeout=60)
+        response = await self.async_client.post(self.url, json={"contents": str(contents[0])[:200]})
+        return self._response(response.json())
+
+
+def _chunks(count):
+    return [f"2025-10-16 00:00:{i % 60:02d} host sshd[1]: Failed password for root from 203.0.113.{i % 254 + 1}\n" * 20 for i in range(count)]
+
+
+class ThreadSampler:
+    """Lay mau so thread dang song trong luc chay (peak)."""
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(0.02):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+async def _no_wait(*args, **kwargs):
+    return None
+
+
+def run_threads(chunks, prompt_file):
+    with ThreadSampler() as sampler:
+        started = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            futures = [executor.submit(gemini_analyzer.analyze_with_gemini, f"Bench_{i}", chunk, "", "bench-key", prompt_file, "bench-model")
+                       for i, chunk in enumerate(chunks)]
+            results = [f.result() for f in futures]
+        elapsed = time.perf_counter() - started
+    return elapsed, sampler.peak, sum(r.endswith("ok") for r in results)
+
+
+def run_async(chunks, prompt_file):
+    engine = async_engine.get_engine()
+    with ThreadSampler() as sampler:
+        started = time.perf_counter()
+        futures = [engine.submit(gemini_analyzer.analyze_with_gemini_async(f"Bench_{i}", chunk, "", "bench-key", prompt_file, "bench-model"), len(chunks))
+                   for i, chunk in enumerate(chunks)]
+        results = [f.result() for f in futures]
+        elapsed = time.perf_counter() - started
+    return elapsed, sampler.peak, sum(r.endswith("ok") for r in results)
+
+
+def _print_row(count, mode, elapsed, peak_threads, ok):
+    print(f"{count:>7} | {mode:>6} | {elapsed:>9.2f} | {count / elapsed:>8.1f} | {peak_threads:>12} | {ok}/{count}")
+
+
+def run_rate_limited(prompt_file, state_root):
+    """Ca 2 che do qua rate limiter that (state rieng moi lan chay, bucket bat dau day)."""
+    print(f"\nRate limited: {RATE_LIMITED_CHUNKS} chunks, 1 key, {RATE_LIMIT_RPM} RPM")
+    chunks = _chunks(RATE_LIMITED_CHUNKS)
+    with patch.object(rate_limiter, "limits_for", lambda model_name, path=None: (RATE_LIMIT_RPM, 0)):
+        for mode, runner in (("thread", run_threads), ("async", run_async)):
+            with patch.object(state_manager, "MAIN_STATE_DIR", os.path.join(state_root, mode)):
+                elapsed, peak_threads, ok = runner(chunks, prompt_file)
+                waits = [m for models in state_manager.get_rate_limits().get("metrics", {}).values() for m in models.values()]
+            _print_row(RATE_LIMITED_CHUNKS, mode, elapsed, peak_threads, ok)
+            print(f"{'':>7} | {'':>6} | max wait for slot: {max((m['max_wait_seconds'] for m in waits), default=0):.2f}s")
+
+
+def main():
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else LATENCY
+    server = FakeGeminiServer(latency)
+    model = HttpModel(f"http://127.0.0.1:{server.port}/v1beta/models/bench-model:generateContent")
+    pool = MagicMock()
+    pool.generative_model.return_value = model
+    pool.legacy_model.return_value.__enter__.return_value = model
+    pool.async_generative_model.return_value = model
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prompt_file = os.path.join(tmp, "prompt_template.md")
+        with open(prompt_file, "w") as f:
+            f.write("Analyze:\n{logs_content}\n{bonus_context}")
+
+        with patch.object(gemini_analyzer, "CLIENT_POOL", pool), \
+             patch.object(gemini_analyzer, "genai", SimpleNamespace()), \
+             patch.object(gemini_analyzer.client_pool, "PER_KEY_CLIENTS", True), \
+             patch.object(state_manager, "increment_api_usage", lambda *a, **k: None), \
+             patch("logging.info"):
+            print(f"Fake Gemini latency: {latency}s")
+            print(f"{'chunks':>7} | {'mode':>6} | {'wall (s)':>9} | {'req/s':>8} | {'peak threads':>12} | ok")
+            with patch.object(gemini_analyzer, "_wait_for_slot", lambda *a, **k: None), \
+                 patch.object(gemini_analyzer, "_wait_for_slot_async", _no_wait):
+                for count in CONCURRENCY_LEVELS:
+                    chunks = _chunks(count)
+                    for mode, runner in (("thread", run_threads), ("async", run_async)):
+                        _print_row(count, mode, *runner(chunks, prompt_file))
+            run_rate_limited(prompt_file, tmp)
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
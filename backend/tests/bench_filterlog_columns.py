@@ -0,0 +1,62 @@
+"""
+Benchmark: bo nho / dong cua filterlog khi giu (datetime tz, str) vs FilterlogTable (struct-of-arrays).
+Chay: python tests/bench_filterlog_columns.py [so_dong]   (mac dinh 1M dong, ngoai suy ra 10M)
+"""
+import os
+import sys
+import time
+import random
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pytz
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import filterlog
+
+TEMPLATE = "Oct 16 {ts} pfSense filterlog[4721]: 5,,,1000000103,{iface},match,{action},in,4,0x0,,64,0,0,DF,6,tcp,60,203.0.113.{src},10.0.0.{dst},{sport},{dport},0,S,1234567890,,64240,,mss;sackOK;TS;nop;wscale\n"
+START = datetime(2025, 10, 16, 0, 0, 0)
+TARGET_ROWS = 10_000_000
+
+def generate(count, seed=42):
+    rnd = random.Random(seed)
+    for i in range(count):
+        ts = START + timedelta(seconds=i // 20)
+        yield ts, TEMPLATE.format(ts=ts.strftime("%H:%M:%S"), iface=rnd.choice(("igb0", "igb1", "igb2")),
+                                  action=rnd.choice(("block", "pass")), src=rnd.randint(1, 254), dst=rnd.randint(1, 20),
+                                  sport=rnd.randint(1024, 65535), dport=rnd.choice((22, 80, 443, 3389)))
+
+def measure(label, build, count):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    holder = build(count)
+    elapsed = time.perf_counter() - t0
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_row = current / count
+    print(f"{label:<32} {per_row:8.1f} B/dong  {count / elapsed:10.0f} dong/s  -> {TARGET_ROWS:,} dong ~ {per_row * TARGET_ROWS / 1024 ** 2:8.0f} MB")
+    return holder
+
+def build_tuples(count):
+    tz = pytz.UTC
+    return [(tz.localize(ts), line) for ts, line in generate(count)]
+
+def build_table(count):
+    table = filterlog.FilterlogTable()
+    for ts, line in generate(count):
+        table.append(line, ts.replace(tzinfo=pytz.UTC).timestamp())
+    return table
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"{count:,} dong filterlog gia lap\n")
+    measure("list[(datetime tz, str)]", build_tuples, count)
+    table = measure("FilterlogTable (struct-of-arrays)", build_table, count)
+    print(f"\nBYTES_PER_ROW = {filterlog.BYTES_PER_ROW}, nbytes() = {table.nbytes() / count:.1f} B/dong")
+    t0 = time.perf_counter()
+    top = sorted(table.counts("src").items(), key=lambda kv: -kv[1])[:5]
+    print(f"Top IP nguon tren bang: {time.perf_counter() - t0:.3f}s  {top}")
+
+if __name__ == "__main__":
+    main()
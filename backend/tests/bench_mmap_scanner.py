@@ -0,0 +1,144 @@
+"""
+Benchmark: scanner mmap (log_reader._iter_segment, tuan tu va process pool) vs cach doc cu (file object + decode moi dong).
+Moi phuong an chay trong 1 process rieng de do peak RSS (ru_maxrss) doc lap.
+Chay: python tests/bench_mmap_scanner.py [so_MB] [--keep]   (mac dinh 512 MB; 5 GB: 5120)
+Cua so phan tich = 10% cuoi file, giong 1 chu ky binh thuong.
+"""
+import os
+import sys
+import time
+import random
+import resource
+import tempfile
+import multiprocessing
+from datetime import datetime, timedelta
+
+import pytz
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import log_reader
+from modules.timestamp_parser import FastTimestampParser
+
+FILTERLOG_TAIL = "pfsense filterlog[4721]: 5,,,1000000103,igb1,match,block,in,4,0x0,,64,0,0,DF,6,tcp,60,{src},10.0.0.5,{sport},443,0,S,1234567890,,64240,,mss;sackOK;TS;nop;wscale\n"
+LINES_PER_SECOND = 20
+TZ_NAME = "UTC"
+START = datetime(2025, 10, 16, 0, 0, 0)
+
+def generate_file(path, size_mb, seed=42):
+    """Ghi file log gia lap ~ size_mb MB theo block, tra ve so dong."""
+    rnd = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    written = 0
+    count = 0
+    with open(path, 'w') as f:
+        while written < target:
+            block = []
+            for _ in range(10000):
+                ts = (START + timedelta(seconds=count // LINES_PER_SECOND)).strftime("%Y-%m-%d %H:%M:%S")
+                block.append(f"{ts} " + FILTERLOG_TAIL.format(src=f"203.0.113.{rnd.randint(1, 254)}", sport=rnd.randint(1024, 65535)))
+                count += 1
+            data = "".join(block)
+            f.write(data)
+            written += len(data)
+    return count
+
+def _legacy_segment(path, start_epoch, tz):
+    """Vong lap cu cua _iter_segment: lap file object, decode tung dong roi moi parse timestamp."""
+    parser = FastTimestampParser(tz, datetime.now(tz))
+    last_valid_epoch = start_epoch
+    pos = 0
+    with open(path, 'rb') as f:
+        for raw_line in f:
+            if not raw_line.endswith(b'\n'):
+                break
+            pos += len(raw_line)
+            line = raw_line.decode('utf-8', errors='ignore')
+            parsed_epoch = parser.parse(line)
+            if parsed_epoch is not None:
+                last_valid_epoch = parsed_epoch
+            if last_valid_epoch > start_epoch:
+                yield last_valid_epoch, pos, line
+
+def scan_legacy(path, start_epoch, tz):
+    kept = 0
+    for _ in _legacy_segment(path, start_epoch, tz):
+        kept += 1
+    return kept
+
+def scan_mmap(path, start_epoch, tz):
+    """Scanner mmap quet tu dau file (bo qua bisect) de so sanh cong bang."""
+    seg = {"path": path, "mtime": os.path.getmtime(path), "compressed": False, "resume_offset": 0,
+           "opener": lambda: open(path, 'rb')}
+    kept = 0
+    for _ in log_reader._iter_segment(seg, start_epoch, None, tz, datetime.now(tz)):
+        kept += 1
+    return kept
+
+def scan_parallel(path, start_epoch, tz):
+    """Scanner theo byte range trong process pool (parallel_threshold_mb)."""
+    seg = {"host_id": "Bench", "path": path, "mtime": os.path.getmtime(path), "compressed": False, "resume_offset": 0,
+           "opener": lambda: open(path, 'rb')}
+    kept = 0
+    for _ in log_reader._iter_segment(seg, start_epoch, None, tz, datetime.now(tz), parallel_threshold=1):
+        kept += 1
+    return kept
+
+def count_legacy(path, *_):
+    lines = 0
+    with open(path, 'rb') as f:
+        buf = f.read(1024 * 1024)
+        while buf:
+            lines += buf.count(b'\n')
+            buf = f.read(1024 * 1024)
+    return lines
+
+def count_mmap(path, *_):
+    return log_reader.count_file_lines(path)
+
+def _run(fn, path, start_epoch, queue):
+    tz = pytz.timezone(TZ_NAME)
+    t0 = time.perf_counter()
+    result = fn(path, start_epoch, tz)
+    elapsed = time.perf_counter() - t0
+    queue.put((result, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+def bench(label, fn, path, start_epoch, size_mb):
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_run, args=(fn, path, start_epoch, queue))
+    proc.start()
+    result, elapsed, max_rss_kb = queue.get()
+    proc.join()
+    print(f"{label:<28} {elapsed:8.2f}s  {size_mb / elapsed:8.1f} MB/s  peak RSS {max_rss_kb / 1024:7.1f} MB  (ket qua {result})")
+    return elapsed
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    size_mb = int(args[0]) if args else 512
+    keep = '--keep' in sys.argv
+
+    fd, path = tempfile.mkstemp(suffix='.log')
+    os.close(fd)
+    try:
+        print(f"Tao file log gia lap {size_mb} MB: {path}")
+        total = generate_file(path, size_mb)
+        window_seconds = total // LINES_PER_SECOND // 10
+        last_epoch = (START + timedelta(seconds=total // LINES_PER_SECOND)).replace(tzinfo=pytz.UTC).timestamp()
+        start_epoch = last_epoch - window_seconds
+        print(f"{total} dong, cua so {window_seconds}s cuoi file\n")
+
+        legacy = bench("scan: file object + decode", scan_legacy, path, start_epoch, size_mb)
+        fast = bench("scan: mmap + parse_bytes", scan_mmap, path, start_epoch, size_mb)
+        print(f"Speedup scan: {legacy / fast:.1f}x")
+        parallel = bench(f"scan: process pool x{log_reader.PARALLEL_READ_WORKERS}", scan_parallel, path, start_epoch, size_mb)
+        print(f"Speedup scan (process pool): {legacy / parallel:.1f}x\n")
+
+        legacy = bench("count: read(1MB)", count_legacy, path, start_epoch, size_mb)
+        fast = bench("count: mmap", count_mmap, path, start_epoch, size_mb)
+        print(f"Speedup count: {legacy / fast:.1f}x")
+    finally:
+        if not keep:
+            os.remove(path)
+
+if __name__ == "__main__":
+    main()
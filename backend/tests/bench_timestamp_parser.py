@@ -0,0 +1,57 @@
+"""
+Microbenchmark: FastTimestampParser vs try_parse_timestamp_flexible.
+Chay: python tests/bench_timestamp_parser.py [so_dong]   (mac dinh 1,000,000 dong pfSense gia lap)
+"""
+import os
+import sys
+import time
+import random
+from datetime import datetime, timedelta
+
+import pytz
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.log_reader import try_parse_timestamp_flexible
+from modules.timestamp_parser import FastTimestampParser
+
+FILTERLOG_TAIL = "pfSense filterlog[4721]: 5,,,1000000103,igb1,match,block,in,4,0x0,,64,0,0,DF,6,tcp,60,{src},10.0.0.5,{sport},443,0,S,1234567890,,64240,,mss;sackOK;TS;nop;wscale\n"
+
+def generate_lines(count, seed=42):
+    """Log gia lap ~ 20 dong/giay, xen ke dong khong co timestamp."""
+    rnd = random.Random(seed)
+    start = datetime(2025, 10, 16, 0, 0, 0)
+    lines = []
+    for i in range(count):
+        ts = (start + timedelta(seconds=i // 20)).strftime("%b %d %H:%M:%S")
+        if i % 500 == 499:
+            lines.append("    continuation of previous event without timestamp\n")
+            continue
+        src = f"203.0.113.{rnd.randint(1, 254)}"
+        lines.append(f"{ts} " + FILTERLOG_TAIL.format(src=src, sport=rnd.randint(1024, 65535)))
+    return lines
+
+def bench(label, fn, lines):
+    t0 = time.perf_counter()
+    parsed = 0
+    for line in lines:
+        if fn(line) is not None:
+            parsed += 1
+    elapsed = time.perf_counter() - t0
+    print(f"{label:<32} {elapsed:8.3f}s  {len(lines) / elapsed / 1e6:6.2f} M lines/s  (parsed {parsed})")
+    return elapsed
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    tz = pytz.timezone("Asia/Ho_Chi_Minh")
+    reference = tz.localize(datetime(2025, 10, 17))
+    lines = generate_lines(count)
+    print(f"{count} dong pfSense gia lap, tz={tz.zone}")
+
+    legacy = bench("try_parse_timestamp_flexible", lambda l: try_parse_timestamp_flexible(l, 2025, tz), lines)
+    parser = FastTimestampParser(tz, reference)
+    fast = bench("FastTimestampParser.parse", parser.parse, lines)
+    print(f"Speedup: {legacy / fast:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,7 @@ from fastapi.testclient import TestClient
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from api import app
-from modules import utils
+from modules import utils, state_manager
 
 @pytest.fixture
 def client():
@@ -30,4 +30,12 @@ def temp_test_env(tmp_path):
         "config_file": str(config_path),
         "report_dir": str(report_dir),
         "root": tmp_path
-    }
\ No newline at end of file
+    }
+
+@pytest.fixture
+def isolated_state(tmp_path, monkeypatch):
+    """Chuyen thu muc state (main + test) vao tmp de khong dung vao state that."""
+    state_dir = tmp_path / "states"
+    monkeypatch.setattr(state_manager, "MAIN_STATE_DIR", str(state_dir))
+    monkeypatch.setattr(state_manager, "TEST_STATE_DIR", str(state_dir / "test"))
+    return state_dir
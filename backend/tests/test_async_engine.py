@@ -0,0 +1,65 @@
+import time
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from modules import async_engine
+from modules import gemini_analyzer
+
+
+class SlowModel:
+    """GenerativeModel gia: generate_content_async cho `delay` giay, ghi lai lan goi bi huy."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = 0
+
+    async def generate_content_async(self, contents, safety_settings=None):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return SimpleNamespace(parts=["x"], text="ok", usage_metadata=None)
+
+
+def _analyze(tmp_path, model, **kwargs):
+    prompt = tmp_path / "prompt.md"
+    prompt.write_text("{logs_content}{bonus_context}")
+    pool = MagicMock()
+    pool.async_generative_model.return_value = model
+    return pool, gemini_analyzer.analyze_with_gemini_async(
+        "Host_A", "log line", "", "key", str(prompt), "m1", test_mode=False, **kwargs)
+
+
+def test_deadline_retries_then_gives_up(tmp_path, isolated_state, monkeypatch):
+    monkeypatch.setattr(gemini_analyzer, "INITIAL_BACKOFF", 0)
+    model = SlowModel(delay=5)
+    pool, coro = _analyze(tmp_path, model, max_retries=2, deadline=0.05)
+    with patch.object(gemini_analyzer, "CLIENT_POOL", pool):
+        started = time.monotonic()
+        result = asyncio.run(coro)
+
+    assert result == gemini_analyzer.RETRY_EXHAUSTED_MESSAGE
+    assert model.calls == 2 and model.cancelled == 2
+    assert time.monotonic() - started < 2
+
+
+def test_engine_cancel_propagates_to_request(tmp_path, isolated_state):
+    engine = async_engine.get_engine()
+    before = engine.stats()
+    model = SlowModel(delay=5)
+    pool, coro = _analyze(tmp_path, model)
+    with patch.object(gemini_analyzer, "CLIENT_POOL", pool):
+        future = engine.submit(coro, max_in_flight=10)
+        deadline = time.monotonic() + 2
+        while model.calls == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert future.cancel()
+        while engine.stats()["cancelled"] == before["cancelled"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    assert model.cancelled == 1
+    assert engine.stats()["cancelled"] == before["cancelled"] + 1
@@ -0,0 +1,62 @@
+import time
+import threading
+from unittest.mock import patch, MagicMock
+
+from modules import client_pool
+from modules.gemini_analyzer import analyze_with_gemini
+
+
+def test_models_reused_per_key_and_keys_not_serialized(tmp_path, isolated_state):
+    """Moi (key, model) tao 1 lan roi dung lai; 2 key khac nhau goi song song, khong qua lock chung."""
+    prompt = tmp_path / "p.md"
+    prompt.write_text("{logs_content}{bonus_context}")
+    pool = client_pool.POOL
+    pool.clear()
+
+    def slow_generate(*args, **kwargs):
+        time.sleep(0.5)
+        return MagicMock(parts=[1], text="ok", usage_metadata=None)
+
+    with patch("google.generativeai.GenerativeModel", side_effect=lambda name: MagicMock(generate_content=MagicMock(side_effect=slow_generate))):
+        first = pool.generative_model("key-1", "m")
+        assert pool.generative_model("key-1", "m") is first
+        assert pool.generative_model("key-2", "m")._client is not first._client
+
+        before = pool.stats()
+        results = []
+        threads = [threading.Thread(target=lambda k=k: results.append(analyze_with_gemini("H", "log", "", k, str(prompt), "m"))) for k in ("key-1", "key-2")]
+        started = time.monotonic()
+        for t in threads: t.start()
+        for t in threads: t.join()
+        elapsed = time.monotonic() - started
+
+    assert results == ["ok", "ok"] and elapsed < 0.9
+    after = pool.stats()
+    assert after["created"] == before["created"] == 2 and after["reused"] == before["reused"] + 2
+    assert len(after["keys"]) == 2 and "key-1" not in after["keys"]
+    pool.clear()
+
+
+def test_falls_back_to_locked_configure_without_client_manager(tmp_path, isolated_state, monkeypatch):
+    """SDK khong co _ClientManager: moi lan goi genai.configure(key) duoi CONFIGURE_LOCK, cac key xep hang."""
+    prompt = tmp_path / "p.md"
+    prompt.write_text("{logs_content}{bonus_context}")
+    monkeypatch.setattr(client_pool, "PER_KEY_CLIENTS", False)
+    configured = []
+
+    def slow_generate(*args, **kwargs):
+        time.sleep(0.2)
+        return MagicMock(parts=[1], text=f"ok {configured[-1]}", usage_metadata=None)
+
+    with patch("google.generativeai.configure", side_effect=lambda api_key: configured.append(api_key)), \
+         patch("google.generativeai.GenerativeModel", side_effect=lambda name: MagicMock(generate_content=MagicMock(side_effect=slow_generate))):
+        results = []
+        threads = [threading.Thread(target=lambda k=k: results.append(analyze_with_gemini("H", "log", "", k, str(prompt), "m"))) for k in ("key-1", "key-2")]
+        started = time.monotonic()
+        for t in threads: t.start()
+        for t in threads: t.join()
+        elapsed = time.monotonic() - started
+
+    assert sorted(results) == ["ok key-1", "ok key-2"] and elapsed >= 0.4
+    assert sorted(configured) == ["key-1", "key-2"]
+    assert client_pool.POOL.stats()["per_key_clients"] is False
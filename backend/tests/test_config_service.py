@@ -0,0 +1,57 @@
+import os
+import json
+
+import pytest
+
+from modules import config_service
+
+
+def _write(path, interval, mtime_ns):
+    pipeline = json.dumps([{"name": "Periodic", "substages": [{"name": "Sub0"}]}])
+    path.write_text(
+        f"[Host_A]\nsyshostname = A\nrun_interval_seconds = {interval}\npipeline_config = {pipeline}\n\n"
+        f"[Host_B]\nsyshostname = B\nenabled = False\n"
+    )
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_snapshot_cached_until_file_changes_and_notifies_changed_hosts(tmp_path):
+    """Khong doi mtime/size -> cung snapshot; sua file -> nap lai, bao host thay doi; pipeline chi doc."""
+    path = tmp_path / "config.ini"
+    _write(path, 3600, 1_000_000_000)
+    service = config_service.ConfigService(str(path))
+    notified = []
+    service.subscribe(lambda changed, snapshot: notified.append(changed))
+
+    first = service.get()
+    assert service.get() is first
+    assert first.enabled_hosts() == ["Host_A"]
+    assert first.hosts["Host_A"].pipeline[0]["substages"][0]["name"] == "Sub0"
+    with pytest.raises(TypeError):
+        first.hosts["Host_A"].pipeline[0]["name"] = "x"
+
+    _write(path, 60, 2_000_000_000)
+    second = service.get()
+    assert second is not first and second.hosts["Host_A"].run_interval_seconds == 60
+    assert notified == [{"Host_A", "Host_B"}, {"Host_A"}]
+    assert second.hosts["Host_A"].pipeline is first.hosts["Host_A"].pipeline
+
+
+def test_shared_parser_is_read_only_and_services_keyed_by_allow_no_value(tmp_path):
+    """Parser cua snapshot dung chung khong sua duoc; allow_no_value khac nhau -> service khac nhau."""
+    path = tmp_path / "system_settings.ini"
+    path.write_text("[System]\nreport_directory = reports\nflag\n")
+    strict = config_service.service_for(str(path))
+    lenient = config_service.service_for(str(path), allow_no_value=True)
+    assert strict is not lenient and config_service.service_for(str(path), allow_no_value=True) is lenient
+
+    parser = lenient.get().parser
+    assert parser.get("System", "report_directory") == "reports" and parser.has_option("System", "flag")
+    for mutate in (lambda: parser.set("System", "report_directory", "x"),
+                   lambda: parser.add_section("Other"),
+                   lambda: parser.remove_option("System", "flag"),
+                   lambda: parser["System"].__setitem__("report_directory", "x"),
+                   lambda: parser.read_dict({"Other": {"a": "1"}})):
+        with pytest.raises(TypeError):
+            mutate()
+    assert lenient.get().parser.get("System", "report_directory") == "reports"
@@ -0,0 +1,38 @@
+import io
+import csv
+import pytz
+
+from modules import filterlog
+
+LINES = [
+    "Oct 16 10:00:01 pfSense filterlog[4721]: 5,,,1000000103,igb1,match,block,in,4,0x0,,64,0,0,DF,6,tcp,60,203.0.113.9,10.0.0.5,51000,443,0,S,1,,64240,,mss",
+    "Oct 16 10:00:02 pfSense filterlog[4721]: 5,,,1000000103,igb1,match,block,in,4,0x0,,64,0,0,DF,6,tcp,60,203.0.113.9,10.0.0.5,51001,22,0,S,1,,64240,,mss",
+    "Oct 16 10:01:01 pfSense filterlog[4721]: 9,,,1000000105,igb0,match,pass,out,6,0x00,0x00000,64,udp,17,100,2001:db8::1,2001:db8::2,5353,53,100",
+    "Oct 16 10:01:02 pfSense filterlog[4721]: 5,,,1000000103,igb1,match,block,in,4,0x0,,64,0,0,DF,1,icmp,60,198.51.100.7,10.0.0.5,request,1,1",
+    "Oct 16 10:01:03 pfSense sshd[22]: Accepted publickey for admin",
+]
+
+
+def test_filterlog_table_columns_aggregate_sample_export():
+    """filterlog -> struct-of-arrays: dem, lay mau, xuat CSV tren bang ma khong giu lai chuoi goc."""
+    table = filterlog.FilterlogTable()
+    appended = [table.append(line, 1760608800 + i * 30) for i, line in enumerate(LINES)]
+    assert appended == [True, True, True, True, False]
+    assert len(table) == 4 and table.nbytes() == 4 * filterlog.BYTES_PER_ROW
+
+    assert table.counts("action") == {"block": 3, "pass": 1}
+    assert table.counts("interface") == {"igb1": 3, "igb0": 1}
+    assert table.counts("src") == {"203.0.113.9": 2, "198.51.100.7": 1, "2001:db8::1": 1}
+    assert table.counts("dst_port") == {"443": 1, "22": 1, "53": 1}
+    assert table.counts("action", start=2) == {"pass": 1, "block": 1}
+    assert sum(table.minute_counts().values()) == 4
+
+    row = table.row(3)
+    assert (row["proto"], row["src"], row["dst"], row["src_port"], row["dst_port"]) == ("icmp", "198.51.100.7", "10.0.0.5", "", "")
+    assert [r["rule"] for r in table.sample(10, seed=1)] == ["5", "5", "9", "5"]
+    assert len(table.sample(2, seed=1)) == 2
+
+    out = io.StringIO()
+    table.export_csv(out, pytz.UTC)
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert len(rows) == 4 and rows[2]["src"] == "2001:db8::1" and rows[0]["epoch"].startswith("2025-10-16T10:00:00")
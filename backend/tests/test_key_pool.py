@@ -0,0 +1,47 @@
+import configparser
+from unittest.mock import patch
+
+import main
+from modules import key_pool
+from modules import state_manager
+
+
+def _settings():
+    settings = configparser.ConfigParser(interpolation=None)
+    settings.read_dict({"System": {}, "Gemini_Keys": {"a": "key-a", "b": "key-b", "c": "key-c"}})
+    return settings
+
+
+def test_parse_pool_and_unknown_profiles_skipped():
+    assert key_pool.parse_pool("a, profile:b,a") == ["profile:a", "profile:b"]
+    pool = main.build_key_pool(["a", "missing", "c"], "m1", _settings())
+    assert pool.keys == [("key-a", "Profile: a"), ("key-c", "Profile: c")]
+    assert main.build_key_pool([], "m1", _settings()) is None
+
+
+def test_throttled_key_fails_over_and_is_ranked_last(tmp_path, isolated_state):
+    calls = []
+
+    def fake_gemini(host_id, content, bonus, api_key, prompt_file, model, key_alias="", test_mode=False,
+                    context_file_paths=None, usage_out=None, max_retries=3):
+        calls.append(api_key)
+        if api_key == "key-a":
+            usage_out['rate_limited'] = 1
+            return "Fatal Gemini Error: Rate Limit"
+        return "ok"
+
+    pool = main.build_key_pool("a, b", "m1", _settings())
+    worker = {"name": "W", "model": "m1", "prompt_file": "p.md", "gemini_api_key": ""}
+    with patch("modules.gemini_analyzer.analyze_with_gemini", side_effect=fake_gemini):
+        first = main.process_chunk_worker(worker, "log", "Host_A", "", [], _settings(), str(tmp_path), pool=pool)
+        second = main.process_chunk_worker(worker, "log", "Host_A", "", [], _settings(), str(tmp_path), pool=pool)
+
+    # // Lan dau chua co du lieu: thu a (theo thu tu), 429 -> chuyen ngay sang b; lan sau b duoc xep truoc
+    assert calls == ["key-a", "key-b", "key-b"]
+    assert first["status"] == "success" and first["key_alias"] == "Profile: b"
+    assert second["key_alias"] == "Profile: b"
+
+    health = state_manager.get_key_health()
+    assert health["Profile: a"]["rate_limited"] == 1 and health["Profile: a"]["failures"] == 1
+    assert health["Profile: b"]["successes"] == 2
+    assert key_pool.score(health["Profile: a"]) > key_pool.score(health["Profile: b"])
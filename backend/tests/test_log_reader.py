@@ -0,0 +1,306 @@
+import os
+import gzip
+import pytz
+import pytest
+from datetime import datetime, timedelta, timezone
+from modules import log_reader, log_formats, state_manager
+from modules.timestamp_parser import FastTimestampParser
+
+
+def _iso_lines(start, count, text="filterlog: packet", step_seconds=1):
+    lines = []
+    for i in range(count):
+        ts = (start + timedelta(seconds=i * step_seconds)).strftime("%Y-%m-%d %H:%M:%S")
+        lines.append(f"{ts} pfsense {text} {i}\n")
+    return "".join(lines)
+
+
+def test_checkpoint_resumes_from_byte_offset(tmp_path, isolated_state):
+    """
+    Lan doc thu 2 chi lay du lieu ghi them sau checkpoint,
+    ke ca dong co timestamp cu hon moc lan chay truoc.
+    """
+    host_id = "Host_Checkpoint"
+    log_path = tmp_path / "filter.log"
+    base = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=30)
+    log_path.write_text(_iso_lines(base, 5, "first"))
+
+    content, _, _, count, latest = log_reader.read_new_log_entries(str(log_path), 24, "UTC", host_id)
+    assert count == 5
+    state_manager.save_last_run_timestamp(latest, host_id)
+    log_reader.commit_checkpoint(host_id)
+
+    checkpoint = state_manager.get_log_checkpoint(host_id)
+    assert checkpoint["segments"][str(log_path.stat().st_ino)]["offset"] == os.path.getsize(log_path)
+
+    with open(log_path, "a") as f:
+        f.write(_iso_lines(base - timedelta(minutes=5), 3, "late"))
+        f.write("2099-01-01 00:00:00 partial line without newline")
+
+    content, _, _, count, _ = log_reader.read_new_log_entries(str(log_path), 24, "UTC", host_id)
+    assert count == 3
+    assert "first" not in content and "partial" not in content
+
+
+def test_checkpoint_invalidated_by_rotation_and_truncation(tmp_path, isolated_state):
+    host_id = "Host_Rotate"
+    log_path = tmp_path / "filter.log"
+    base = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=30)
+    log_path.write_text(_iso_lines(base, 10, "old"))
+
+    _, _, _, _, latest = log_reader.read_new_log_entries(str(log_path), 24, "UTC", host_id)
+    state_manager.save_last_run_timestamp(latest, host_id)
+    log_reader.commit_checkpoint(host_id)
+
+    # // Truncate: file nho hon offset -> quet theo timestamp, chi lay dong moi hon lan truoc
+    log_path.write_text(_iso_lines(base + timedelta(minutes=1), 2, "after_truncate"))
+    content, _, _, count, _ = log_reader.read_new_log_entries(str(log_path), 24, "UTC", host_id)
+    assert count == 2 and "after_truncate" in content
+
+    # // Rotation: file moi (inode moi) cung kich thuoc lon hon offset
+    rotated = tmp_path / "filter.log.new"
+    rotated.write_text(_iso_lines(base - timedelta(hours=1), 20, "stale") + _iso_lines(base + timedelta(minutes=2), 1, "fresh"))
+    os.replace(rotated, log_path)
+    content, _, _, count, _ = log_reader.read_new_log_entries(str(log_path), 24, "UTC", host_id)
+    assert count == 1 and "fresh" in content
+
+
+def test_checkpoint_not_saved_without_commit(tmp_path, isolated_state):
+    host_id = "Host_NoCommit"
+    log_path = tmp_path / "filter.log"
+    base = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=10)
+    log_path.write_text(_iso_lines(base, 3))
+
+    log_reader.read_new_log_entries(str(log_path), 24, "UTC", host_id)
+    assert state_manager.get_log_checkpoint(host_id) is None
+
+
+def test_glob_merges_rotated_and_compressed_segments(tmp_path, isolated_state):
+    """Glob gom file hien tai + ban rotate .1 + ban nen .2.gz, merge dung thu tu thoi gian."""
+    host_id = "Host_Segments"
+    base = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=3)
+    with gzip.open(tmp_path / "filter.log.2.gz", "wt") as f:
+        f.write(_iso_lines(base, 100, "gz", step_seconds=2))
+    (tmp_path / "filter.log.1").write_text(_iso_lines(base + timedelta(seconds=1), 100, "plain", step_seconds=2))
+    (tmp_path / "filter.log").write_text(_iso_lines(base + timedelta(hours=1), 50, "current"))
+    now = datetime.now().timestamp()
+    for offset, name in enumerate(["filter.log.2.gz", "filter.log.1", "filter.log"]):
+        os.utime(tmp_path / name, (now - 60 + offset, now - 60 + offset))
+
+    content, _, _, count, _ = log_reader.read_new_log_entries(str(tmp_path / "filter.log*"), 24, "UTC", host_id)
+    lines = content.splitlines()
+    assert count == 250
+    assert [l.split()[3] for l in lines[:4]] == ["gz", "plain", "gz", "plain"]
+    assert all("current" in l for l in lines[-50:])
+    assert log_reader.count_log_lines(str(tmp_path / "filter.log*")) == 150
+
+
+def test_checkpoint_follows_renamed_segment(tmp_path, isolated_state):
+    """Rotate kieu rename: file cu doi ten nhung giu inode -> doc tiep dung offset, file moi doc tu dau."""
+    host_id = "Host_Rename"
+    base = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=30)
+    current = tmp_path / "filter.log"
+    current.write_text(_iso_lines(base, 10, "before"))
+
+    spec = str(tmp_path / "filter.log*")
+    _, _, _, count, latest = log_reader.read_new_log_entries(spec, 24, "UTC", host_id)
+    assert count == 10
+    state_manager.save_last_run_timestamp(latest, host_id)
+    log_reader.commit_checkpoint(host_id)
+
+    with open(current, "a") as f:
+        f.write(_iso_lines(base + timedelta(minutes=1), 2, "tail_of_old"))
+    os.rename(current, tmp_path / "filter.log.1")
+    current.write_text(_iso_lines(base + timedelta(minutes=2), 3, "new_file"))
+
+    content, _, _, count, _ = log_reader.read_new_log_entries(spec, 24, "UTC", host_id)
+    assert count == 5
+    assert "before" not in content and content.count("tail_of_old") == 2
+
+
+def test_mmap_scanner_handles_blank_and_untimestamped_lines(tmp_path, isolated_state):
+    """Dong trang / dong khong co timestamp thua huong timestamp dong truoc, khong doc lan sang dong sau."""
+    log_path = tmp_path / "mixed.log"
+    body = (_iso_lines(datetime(2025, 10, 16, 0, 59, 58), 2, "before")
+            + "   \n"
+            + _iso_lines(datetime(2025, 10, 16, 1, 0, 0), 3, "inside")
+            + "\tcontinuation \xff\n"
+            + _iso_lines(datetime(2025, 10, 16, 2, 0, 1), 2, "after"))
+    log_path.write_bytes(body.encode("latin-1") + b"2025-10-16 02:00:00 no newline")
+
+    content, _, _, count, _ = log_reader.read_log_window(
+        str(log_path), datetime(2025, 10, 16, 1, 0, 0), datetime(2025, 10, 16, 2, 0, 0), "UTC", "Host_Mmap"
+    )
+    assert count == 4 and "continuation" in content and "before" not in content and "after" not in content
+    assert log_reader.count_file_lines(str(log_path)) == 9
+
+
+def test_bounded_read_stops_early_and_resumes_exactly(tmp_path, isolated_state, monkeypatch):
+    """Du limit thi dung quet ngay; lan sau doc tiep dung dong ke tiep, ke ca khi cung 1 giay."""
+    host_id = "Host_Backlog"
+    log_path = tmp_path / "filter.log"
+    stamp = (datetime.now(timezone.utc) - timedelta(minutes=10)).strftime("%Y-%m-%d %H:%M:%S")
+    log_path.write_text("".join(f"{stamp} pfsense evt {i}\n" for i in range(300)))
+
+    parsed = []
+    original_parse_bytes = FastTimestampParser.parse_bytes
+    monkeypatch.setattr(FastTimestampParser, "parse_bytes", lambda self, raw: parsed.append(raw) or original_parse_bytes(self, raw))
+
+    seen = []
+    for _ in range(3):
+        stream = log_reader.open_log_stream(str(log_path), 24, "UTC", host_id, custom_limit=100)
+        content = "".join(stream.iter_lines())
+        seen.extend(l.split()[-1] for l in content.splitlines() if "evt" in l)
+        state_manager.save_last_run_timestamp(stream.latest_timestamp, host_id)
+        log_reader.commit_checkpoint(host_id)
+        if len(seen) == 100:
+            assert stream.has_backlog and "!!! WARNING" in content and 190 <= stream.remaining_lines <= 210
+            assert stream.log_count == 101
+            assert len(parsed) < 200
+
+    assert seen == [str(i) for i in range(300)]
+    assert not stream.has_backlog
+
+
+def test_parallel_range_scan_matches_sequential(tmp_path, monkeypatch, isolated_state):
+    """Process pool theo byte range cho ket qua giong het doc tuan tu, ke ca dong khong timestamp o bien range."""
+    monkeypatch.setattr(log_reader, "PARALLEL_RANGE_BYTES", 64 * 1024)
+    monkeypatch.setattr(log_reader, "PARALLEL_READ_WORKERS", 3)
+    log_path = tmp_path / "big.log"
+    base = datetime(2025, 10, 16, 0, 0, 0)
+    with open(log_path, "w") as f:
+        for i in range(40000):
+            f.write(_iso_lines(base + timedelta(seconds=i), 1, "evt").replace(" 0\n", f" {i}\n"))
+            if i % 97 == 0:
+                f.write("    continuation line\n")
+
+    def _read(threshold_mb):
+        stream = log_reader.open_log_stream(
+            str(log_path), 24, "UTC", "Host_Parallel", custom_limit=100000,
+            window=(datetime(2025, 10, 16, 1, 0, 0), datetime(2025, 10, 16, 10, 0, 0)), parallel_threshold_mb=threshold_mb
+        )
+        return "".join(stream.iter_lines())
+
+    ranges = []
+    original_split = log_reader._split_ranges
+    monkeypatch.setattr(log_reader, "_split_ranges", lambda *a: ranges.extend(original_split(*a)) or ranges)
+
+    sequential = _read(0)
+    assert sequential.count("\n") == 32400 + 32400 // 97 + 1 and not ranges
+    assert _read(1) == sequential
+    assert len(ranges) > 10
+
+
+def test_find_offset_for_time_bisects(tmp_path, monkeypatch):
+    """Binary search tim dung dong dau tien >= target voi so lan probe ~ log2(n)."""
+    log_path = tmp_path / "big.log"
+    base = datetime(2025, 10, 16, 0, 0, 0)
+    log_path.write_text(_iso_lines(base, 50000, "evt", step_seconds=2))
+
+    probes = []
+    original_probe = log_reader._probe_timestamp
+    monkeypatch.setattr(log_reader, "_probe_timestamp", lambda *a: probes.append(a) or original_probe(*a))
+
+    target = datetime(2025, 10, 16, 10, 0, 0, tzinfo=timezone.utc)
+    offset = log_reader.find_offset_for_time(str(log_path), target, "UTC")
+
+    with open(log_path, "rb") as f:
+        f.seek(offset)
+        assert f.readline().startswith(b"2025-10-16 10:00:00")
+    assert len(probes) < 30
+
+
+def test_read_log_window_returns_exact_range(tmp_path, isolated_state):
+    log_path = tmp_path / "window.log"
+    base = datetime(2025, 10, 16, 0, 0, 0)
+    log_path.write_text(_iso_lines(base, 20000, "evt", step_seconds=5))
+
+    content, start, end, count, latest = log_reader.read_log_window(
+        str(log_path), datetime(2025, 10, 16, 1, 0, 0), datetime(2025, 10, 16, 2, 0, 0), "UTC", "Host_Window", custom_limit=100000
+    )
+    lines = content.splitlines()
+    assert count == 721
+    assert lines[0].startswith("2025-10-16 01:00:00") and lines[-1].startswith("2025-10-16 02:00:00")
+    assert latest == end
+    # // Doc theo cua so: nhan dien format trong bo nho, khong ghi state
+    assert state_manager.get_log_format("Host_Window") is None
+
+
+@pytest.mark.parametrize("tz_name", ["UTC", "Asia/Ho_Chi_Minh", "Europe/Berlin", "America/New_York"])
+def test_fast_parser_matches_legacy_parser(tz_name):
+    """Epoch tu FastTimestampParser phai trung voi strptime + localize, ke ca ngay chuyen DST."""
+    tz = pytz.timezone(tz_name)
+    parser = FastTimestampParser(tz, tz.localize(datetime(2025, 12, 1)))
+    samples = [
+        "Oct 26 02:30:00 pfSense filterlog[1]: x", "Oct 26 02:30:00 same second",
+        "Mar 30 02:30:00 dst", "Oct  6 10:00:00 single digit day",
+        "2025-03-09T02:30:00 iso", "2025-11-02 01:30:00 iso",
+        "  Oct 16 10:00:01 leading space", "Feb 31 00:00:00 invalid", "no timestamp here at all",
+    ]
+    bytes_parser = FastTimestampParser(tz, tz.localize(datetime(2025, 12, 1)))
+    for line in samples:
+        legacy = log_reader.try_parse_timestamp_flexible(line, 2025, tz)
+        expected = int(legacy.timestamp()) if legacy else None
+        assert parser.parse(line) == expected, line
+        assert bytes_parser.parse_bytes(line.encode()) == expected, line
+
+
+def test_fast_parser_rolls_syslog_year_back():
+    tz = pytz.UTC
+    parser = FastTimestampParser(tz, tz.localize(datetime(2026, 1, 2, 0, 0, 0)))
+    assert parser.parse("Dec 31 23:59:59 host msg") == int(datetime(2025, 12, 31, 23, 59, 59, tzinfo=timezone.utc).timestamp())
+
+
+def test_log_stream_yields_chunks_lazily(tmp_path, isolated_state):
+    """Chunk dau tien co truoc khi file duoc doc het; reorder buffer sap lai dong lech thu tu."""
+    log_path = tmp_path / "stream.log"
+    base = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=2)
+    body = _iso_lines(base, 5000, "evt")
+    swapped = _iso_lines(base + timedelta(seconds=4999), 1, "late") + _iso_lines(base + timedelta(seconds=4998), 1, "early")
+    log_path.write_text(body + swapped)
+
+    stream = log_reader.open_log_stream(str(log_path), 24, "UTC", "Host_Stream", custom_limit=100000)
+    chunks = stream.iter_chunks(1000)
+    first = next(chunks)
+    assert len(first.splitlines()) == 1000 and not stream.completed
+
+    rest = list(chunks)
+    assert stream.completed and stream.log_count == 5002 and len(rest) == 5
+    lines = "".join([first] + rest).splitlines()
+    assert lines[-1].endswith("late 0") and lines[-3].endswith("early 0")
+
+
+@pytest.mark.parametrize("fmt, line, expected_utc", [
+    ("rfc5424", "<134>1 2025-10-16T10:00:00.123+07:00 pfSense filterlog 123 - - 5,,,1000000103,igb1,match,block", datetime(2025, 10, 16, 3, 0, 0)),
+    ("pfsense_filterlog", "Oct 16 10:00:00 pfSense filterlog[4721]: 5,,,1000000103,igb1,match,block,in,4", datetime(2025, 10, 16, 3, 0, 0)),
+    ("cisco_ios", "000123: *Oct 16 10:00:00.123 ICT: %LINK-3-UPDOWN: Interface GigabitEthernet1/0/1, changed state to up", datetime(2025, 10, 16, 3, 0, 0)),
+    ("nginx_access", '10.0.0.5 - - [16/Oct/2025:10:00:00 +0700] "GET / HTTP/1.1" 200 612 "-" "curl/8.0"', datetime(2025, 10, 16, 3, 0, 0)),
+    ("bsd_syslog", "Oct 16 10:00:00 sw01 sshd[22]: Accepted publickey for admin", datetime(2025, 10, 16, 3, 0, 0)),
+    ("iso8601", "2025-10-16T10:00:00 app started", datetime(2025, 10, 16, 3, 0, 0)),
+])
+def test_log_format_detection_and_fast_path(fmt, line, expected_utc):
+    """Moi format duoc nhan dien tu mau va parser rieng tra dung epoch (ke ca dang bytes)."""
+    assert log_formats.detect_format([line] * 5 + ["garbage"]) == fmt
+    tz = pytz.timezone("Asia/Ho_Chi_Minh")
+    parser = log_formats.make_parser(fmt, tz, tz.localize(datetime(2025, 12, 1)))
+    expected = int(expected_utc.replace(tzinfo=timezone.utc).timestamp())
+    assert parser.parse(line) == expected
+    assert parser.parse_bytes(line.encode()) == expected
+    assert log_formats.detect_format(["no timestamp"] * 5) == log_formats.AUTO_FORMAT
+
+
+def test_log_format_resolved_once_and_cached_per_host(tmp_path, isolated_state, monkeypatch):
+    log_path = tmp_path / "access.log"
+    log_path.write_text('10.0.0.5 - - [16/Oct/2025:10:00:00 +0000] "GET / HTTP/1.1" 200 1 "-" "x"\n' * 3)
+
+    assert log_reader.resolve_log_format("Host_Fmt", str(log_path)) == "nginx_access"
+    assert state_manager.get_log_format("Host_Fmt")["format"] == "nginx_access"
+
+    monkeypatch.setattr(log_formats, "detect_format", lambda lines: pytest.fail("phai dung cache"))
+    assert log_reader.resolve_log_format("Host_Fmt", str(log_path)) == "nginx_access"
+    assert log_reader.resolve_log_format("Host_Fmt", str(log_path), configured="bsd_syslog") == "bsd_syslog"
+
+    content, _, _, count, _ = log_reader.read_log_window(
+        str(log_path), datetime(2025, 10, 16, 9, 0, 0), datetime(2025, 10, 16, 11, 0, 0), "UTC", "Host_Fmt"
+    )
+    assert count == 3
@@ -0,0 +1,440 @@
+import os
+import asyncio
+import re
+import json
+import threading
+import configparser
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import main
+from modules import state_manager
+
+
+def _make_configs(tmp_path, log_path, pipeline, chunk_size=10, extra_host=None, extra_system=None):
+    """Tao host config + system settings that (ConfigParser) trong tmp."""
+    prompt_dir = tmp_path / "prompts"
+    prompt_dir.mkdir(exist_ok=True)
+    (prompt_dir / "p.md").write_text("{logs_content}{bonus_context}")
+    (prompt_dir / "summary_prompt_template.md").write_text("{reports_content}{bonus_context}")
+
+    host_conf = configparser.ConfigParser(interpolation=None)
+    host_conf["Host_Test"] = {
+        "syshostname": "TestHost", "logfile": str(log_path), "hourstoanalyze": "24",
+        "timezone": "UTC", "geminiapikey": "dummy-key", "chunk_size": str(chunk_size),
+        "pipeline_config": json.dumps(pipeline), **(extra_host or {})
+    }
+    sys_conf = configparser.ConfigParser(interpolation=None)
+    sys_conf["System"] = {"report_directory": str(tmp_path / "reports"), "prompt_directory": str(prompt_dir), **(extra_system or {})}
+    return host_conf, sys_conf
+
+
+def _write_log(log_path, count, minutes_ago=30):
+    base = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=minutes_ago)
+    with open(log_path, "w") as f:
+        for i in range(count):
+            f.write(f"{(base + timedelta(seconds=i)).strftime('%Y-%m-%d %H:%M:%S')} pfsense filterlog: line {i}\n")
+
+
+def _stage0(substages=2):
+    return {
+        "name": "Periodic", "model": "m", "prompt_file": "p.md",
+        "substages": [{"name": f"Sub{i}", "model": "m", "prompt_file": "p.md"} for i in range(substages)],
+        "summary_conf": {"name": "Periodic_Reduce"},
+    }
+
+
+def test_stage0_streams_chunks_to_workers_and_commits(tmp_path, isolated_state):
+    log_path = tmp_path / "filter.log"
+    _write_log(log_path, 25)
+    host_conf, sys_conf = _make_configs(tmp_path, log_path, [_stage0()])
+
+    calls = []
+    lock = threading.Lock()
+
+    def fake_gemini(host_id, content, *args, **kwargs):
+        with lock:
+            calls.append((host_id, content))
+        return '```json\n{"stat_1_value": 1}\n```\nok'
+
+    with patch("modules.gemini_analyzer.analyze_with_gemini", side_effect=fake_gemini):
+        assert main.run_pipeline_stage_0(host_conf, "Host_Test", _stage0(), "dummy-key", sys_conf) is True
+
+    worker_chunks = [c for h, c in calls if not h.endswith("_Reduce")]
+    assert sorted(len(c.splitlines()) for c in worker_chunks) == [5, 10, 10]
+    assert any(h.endswith("_Reduce") for h, _ in calls)
+    segments = state_manager.get_log_checkpoint("Host_Test")["segments"]
+    assert segments[str(log_path.stat().st_ino)]["offset"] == log_path.stat().st_size
+
+
+def test_exact_token_count_uses_count_tokens_api_for_chunk_totals(tmp_path, isolated_state, caplog):
+    """exact_token_count = true: tong token moi chunk lay tu gemini_analyzer.count_tokens (key/model cua stage)."""
+    log_path = tmp_path / "filter.log"
+    _write_log(log_path, 30)
+    host_conf, sys_conf = _make_configs(tmp_path, log_path, [_stage0()], chunk_size=1000,
+                                        extra_host={"chunk_token_budget": "150", "exact_token_count": "true"})
+
+    counted = []
+    with caplog.at_level("INFO"), \
+         patch("modules.gemini_analyzer.count_tokens", side_effect=lambda text, key, model: counted.append((key, model)) or 777), \
+         patch("modules.gemini_analyzer.analyze_with_gemini", return_value='```json\n{"stat_1_value": 1}\n```\nok'):
+        assert main.run_pipeline_stage_0(host_conf, "Host_Test", _stage0(), "dummy-key", sys_conf) is True
+
+    assert counted == [("dummy-key", "m")] * 3
+    assert len(re.findall(r"~777 token log", caplog.text)) == 3
+
+
+def test_backlog_drain_runs_batches_within_budget(tmp_path, isolated_state):
+    """Con backlog -> chay tiep batch trong cung chu ky den khi het ngan sach, chu ky sau xa not."""
+    log_path = tmp_path / "filter.log"
+    _write_log(log_path, 45)
+    pipeline = [_stage0(substages=0)]
+    host_conf, sys_conf = _make_configs(
+        tmp_path, log_path, pipeline,
+        extra_host={"run_interval_seconds": "0"}, extra_system={"backlog_max_batches_per_cycle": "3"}
+    )
+
+    chunks = []
+
+    def fake_gemini(host_id, content, *args, **kwargs):
+        chunks.append(content)
+        return '```json\n{"stat_1_value": 1}\n```\nok'
+
+    with patch("modules.gemini_analyzer.analyze_with_gemini", side_effect=fake_gemini):
+        main.process_host_pipeline(host_conf, "Host_Test", sys_conf)
+        status = state_manager.get_backlog_status("Host_Test")
+        assert len(chunks) == 3
+        assert status["has_backlog"] and status["batches_last_cycle"] == 3
+        assert 10 <= status["remaining_lines"] <= 20 and status["eta_seconds"] is not None
+
+        main.process_host_pipeline(host_conf, "Host_Test", sys_conf)
+
+    status = state_manager.get_backlog_status("Host_Test")
+    assert not status["has_backlog"] and status["batches_last_cycle"] == 2
+    lines = [l for c in chunks for l in c.splitlines() if "filterlog" in l]
+    assert [l.rsplit(" ", 1)[1] for l in lines] == [str(i) for i in range(45)]
+
+
+def test_backlog_drain_sends_one_email_per_cycle(tmp_path, isolated_state):
+    """Drain nhieu batch trong 1 chu ky: moi batch luu bao cao nhung chi batch cuoi gui email."""
+    log_path = tmp_path / "filter.log"
+    _write_log(log_path, 45)
+    template = tmp_path / "email.html"
+    template.write_text("{hostname}: {analysis_result}")
+    stage = {**_stage0(substages=0), "recipient_emails": "ops@example.com", "email_template": str(template)}
+    host_conf, sys_conf = _make_configs(
+        tmp_path, log_path, [stage],
+        extra_host={"run_interval_seconds": "0"}, extra_system={"backlog_max_batches_per_cycle": "3"}
+    )
+
+    with patch("modules.gemini_analyzer.analyze_with_gemini", return_value='```json\n{"stat_1_value": 1}\n```\nok'), \
+         patch("main.get_smtp_config_for_stage", return_value={"server": "smtp"}), \
+         patch("main.get_attachments", return_value=[]), \
+         patch("main.email_service.send_email") as send_email:
+        main.process_host_pipeline(host_conf, "Host_Test", sys_conf)
+        assert state_manager.get_backlog_status("Host_Test")["batches_last_cycle"] == 3
+        assert send_email.call_count == 1
+
+        main.process_host_pipeline(host_conf, "Host_Test", sys_conf)
+        assert state_manager.get_backlog_status("Host_Test")["batches_last_cycle"] == 2
+        assert send_email.call_count == 2
+
+    assert len(list((tmp_path / "reports").rglob("*.json"))) == 5
+
+
+def test_stage0_template_mining_compresses_and_reports_ratio(tmp_path, isolated_state):
+    log_path = tmp_path / "filter.log"
+    _write_log(log_path, 200)
+    host_conf, sys_conf = _make_configs(tmp_path, log_path, [_stage0(substages=0)], chunk_size=500,
+                                        extra_host={"template_mining": "True"})
+
+    sent = []
+
+    def fake_gemini(host_id, content, *args, **kwargs):
+        sent.append(content)
+        return '```json\n{"stat_1_value": 1}\n```\nok'
+
+    with patch("modules.gemini_analyzer.analyze_with_gemini", side_effect=fake_gemini):
+        assert main.run_pipeline_stage_0(host_conf, "Host_Test", _stage0(substages=0), "dummy-key", sys_conf) is True
+
+    assert len(sent) == 1 and "200 dong -> 1 template" in sent[0]
+    report_file = next((tmp_path / "reports").rglob("*.json"))
+    stats = json.loads(report_file.read_text())["template_mining"]
+    assert stats["compression_ratio"] > 10 and stats["templates"] == 1
+    assert len(state_manager.get_template_state("Host_Test")["clusters"]) == 1
+
+
+def test_stage0_template_ratio_excludes_local_stats_table(tmp_path, isolated_state):
+    """compressed_chars chi tinh payload template, khong tinh bang thong ke cuc bo dat truoc."""
+    log_path = tmp_path / "filter.log"
+    _write_log(log_path, 200)
+    host_conf, sys_conf = _make_configs(tmp_path, log_path, [_stage0(substages=0)], chunk_size=500,
+                                        extra_host={"template_mining": "True", "local_stats": "True"})
+
+    sent = []
+
+    def fake_gemini(host_id, content, *args, **kwargs):
+        sent.append(content)
+        return '```json\n{"stat_1_value": 1}\n```\nok'
+
+    with patch("modules.gemini_analyzer.analyze_with_gemini", side_effect=fake_gemini):
+        assert main.run_pipeline_stage_0(host_conf, "Host_Test", _stage0(substages=0), "dummy-key", sys_conf) is True
+
+    table_end = sent[0].index("\n\n") + 2
+    assert sent[0].startswith("### THONG KE CUC BO")
+    report_file = next((tmp_path / "reports").rglob("*.json"))
+    stats = json.loads(report_file.read_text())["template_mining"]
+    assert stats["compressed_chars"] == len(sent[0]) - table_end
+
+
+def test_stage0_local_stats_use_resolved_log_format(tmp_path, isolated_state):
+    """log_format = auto: thong ke cuc bo nhan ten format ma log_reader da nhan dien, khong phai 'auto'."""
+    log_path = tmp_path / "filter.log"
+    _write_log(log_path, 20)
+    host_conf, sys_conf = _make_configs(tmp_path, log_path, [_stage0(substages=0)], extra_host={"local_stats": "True"})
+
+    with patch("modules.gemini_analyzer.analyze_with_gemini", return_value='```json\n{"stat_1_value": 1}\n```\nok'), \
+         patch("main.log_stats.LogStatsAggregator", wraps=main.log_stats.LogStatsAggregator) as aggregator:
+        assert main.run_pipeline_stage_0(host_conf, "Host_Test", _stage0(substages=0), "dummy-key", sys_conf) is True
+
+    detected = state_manager.get_log_format("Host_Test")["format"]
+    assert detected != "auto"
+    assert aggregator.call_args.args[1] == detected
+
+
+def test_stage0_local_stats_in_prompt_and_reports(tmp_path, isolated_state):
+    """Thong ke cuc bo (action, IP nguon, cong dich) dat truoc log trong prompt va luu chinh xac vao summary_stats."""
+    log_path = tmp_path / "filter.log"
+    base = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=30)
+    with open(log_path, "w") as f:
+        for i in range(20):
+            action = "block" if i % 4 else "pass"
+            f.write(f"{(base + timedelta(seconds=i)).strftime('%Y-%m-%d %H:%M:%S')} pfsense filterlog[4721]: "
+                    f"5,,,1000000103,igb1,match,{action},in,4,0x0,,64,0,0,DF,6,tcp,60,203.0.113.{i % 3},10.0.0.5,{40000 + i},{22 if i % 2 else 443},0,S\n")
+    host_conf, sys_conf = _make_configs(tmp_path, log_path, [_stage0(substages=1)], extra_host={"local_stats": "True"})
+
+    prompts = {}
+
+    def fake_gemini(host_id, content, *args, **kwargs):
+        prompts[host_id] = content
+        return '```json\n{"stat_1_value": 1}\n```\nok'
+
+    with patch("modules.gemini_analyzer.analyze_with_gemini", side_effect=fake_gemini):
+        assert main.run_pipeline_stage_0(host_conf, "Host_Test", _stage0(substages=1), "dummy-key", sys_conf) is True
+
+    assert "| Action | block (7), pass (3) |" in prompts["Host_Test_Periodic"]
+    assert "| Tong so dong | 20 |" in prompts["Host_Test_Reduce"]
+
+    reports = {json.loads(p.read_text())["report_type"]: json.loads(p.read_text()) for p in (tmp_path / "reports").rglob("*.json")}
+    local = reports["Periodic_Reduce"]["summary_stats"]["local_stats"]
+    assert local["actions"] == {"block": 15, "pass": 5}
+    assert local["top_src_ips"] == [["203.0.113.0", 7], ["203.0.113.1", 7], ["203.0.113.2", 6]]
+    assert local["top_dst_ports"] == [["22", 10], ["443", 10]]
+    assert local["event_rate"]["peak_per_minute"] <= 20
+    assert reports["Sub0"]["summary_stats"]["local_stats"]["total_events"] == 10
+
+
+def test_stage0_token_budget_chunking_logs_planned_vs_actual(tmp_path, isolated_state, caplog):
+    log_path = tmp_path / "filter.log"
+    _write_log(log_path, 30)
+    host_conf, sys_conf = _make_configs(tmp_path, log_path, [_stage0()], chunk_size=1000,
+                                        extra_host={"chunk_token_budget": "150"})
+
+    sizes = []
+
+    def fake_gemini(host_id, content, *args, usage_out=None, **kwargs):
+        if not host_id.endswith("_Reduce"):
+            sizes.append(len(content.splitlines()))
+            usage_out["prompt_tokens"] = 123
+        return '```json\n{"stat_1_value": 1}\n```\nok'
+
+    with caplog.at_level("INFO"), patch("modules.gemini_analyzer.analyze_with_gemini", side_effect=fake_gemini):
+        assert main.run_pipeline_stage_0(host_conf, "Host_Test", _stage0(), "dummy-key", sys_conf) is True
+
+    # // ~48 ky tu/dong -> 12 token/dong -> 12 dong/chunk; chi co 3 worker
+    assert sorted(sizes) == [6, 12, 12]
+    assert len(re.findall(r"planned ~1[34]\d \(log\), actual 123 \(prompt\)", caplog.text)) == 2
+
+
+def test_stage0_work_queue_processes_every_chunk(tmp_path, isolated_state):
+    """So chunk > so worker profile -> khong chunk nao bi bo; profile dung lai round-robin, metrics vao bao cao Reduce."""
+    log_path = tmp_path / "filter.log"
+    _write_log(log_path, 20)
+    host_conf, sys_conf = _make_configs(
+        tmp_path, log_path, [_stage0(substages=1)], chunk_size=10,
+        extra_host={"chunk_token_budget": "60", "max_concurrency": "2", "worker_assignment": "round_robin"},
+        extra_system={"max_concurrent_requests": "1"}
+    )
+
+    sent = []
+    lock = threading.Lock()
+
+    def fake_gemini(host_id, content, *args, **kwargs):
+        with lock:
+            sent.append((host_id, content))
+        return '```json\n{"stat_1_value": 1}\n```\nok'
+
+    with patch("modules.gemini_analyzer.analyze_with_gemini", side_effect=fake_gemini):
+        assert main.run_pipeline_stage_0(host_conf, "Host_Test", _stage0(substages=1), "dummy-key", sys_conf) is True
+
+    worker_calls = [(h, c) for h, c in sent if not h.endswith("_Reduce")]
+    assert len(worker_calls) == 4
+    lines = sorted(int(l.rsplit(" ", 1)[1]) for _, c in worker_calls for l in c.splitlines())
+    assert lines == list(range(20))
+    assert sorted(h for h, _ in worker_calls) == ["Host_Test_Periodic"] * 2 + ["Host_Test_Sub0"] * 2
+
+    reduce_input = [c for h, c in sent if h.endswith("_Reduce")][0]
+    assert reduce_input.index("PART 1 FROM Periodic") < reduce_input.index("PART 2 FROM Sub0") < reduce_input.index("PART 4 FROM Sub0")
+    reports = [json.loads(p.read_text()) for p in (tmp_path / "reports").rglob("*.json")]
+    assert len([r for r in reports if r["report_type"] != "Periodic_Reduce"]) == 4
+    metrics = [r for r in reports if r["report_type"] == "Periodic_Reduce"][0]["worker_metrics"]
+    assert metrics["Periodic"]["chunks"] == 2 and metrics["Sub0"]["chunks"] == 2 and metrics["Sub0"]["failed"] == 0
+
+
+def test_stage_n_tree_reduce_retries_from_cached_intermediates(tmp_path, isolated_state):
+    """Nhieu bao cao vuot reduce_token_budget -> reduce theo nhom; Reduce cuoi loi thi lan sau chi chay lai Reduce cuoi."""
+    host_conf, sys_conf = _make_configs(tmp_path, tmp_path / "filter.log", [_stage0()], extra_system={"reduce_token_budget": "300"})
+    report_dir = tmp_path / "reports" / "Host_Test" / "periodic" / "2024-01-01"
+    report_dir.mkdir(parents=True)
+    for i in range(6):
+        (report_dir / f"r{i}.json").write_text(json.dumps({
+            "report_type": "Periodic", "analysis_start_time": f"2024-01-01T0{i}:00:00", "analysis_end_time": f"2024-01-01T0{i}:59:00",
+            "analysis_details_markdown": f"report {i} " + "x" * 400,
+        }))
+    stage = {"name": "Daily", "model": "m", "prompt_file": "summary_prompt_template.md", "trigger_threshold": 6}
+
+    sent = []
+    lock = threading.Lock()
+
+    def failing_top(host_id, content, *args, **kwargs):
+        with lock:
+            sent.append(content)
+        if "INTERMEDIATE SUMMARY" in content:
+            return "Fatal Gemini Error: 500"
+        return f"summary of {content.count('--- REPORT')} reports"
+
+    with patch("modules.gemini_analyzer.analyze_with_gemini", side_effect=failing_top):
+        assert main.run_pipeline_stage_n(host_conf, "Host_Test", 1, stage, _stage0(), "dummy-key", sys_conf) is False
+    assert len(sent) == 4
+    assert all(c.count("--- REPORT") == 2 for c in sent[:3])
+
+    sent.clear()
+    with patch("modules.gemini_analyzer.analyze_with_gemini", side_effect=lambda h, c, *a, **k: sent.append(c) or '```json\n{"stat_1_value": 1}\n```\nfinal'):
+        assert main.run_pipeline_stage_n(host_conf, "Host_Test", 1, stage, _stage0(), "dummy-key", sys_conf) is True
+    assert len(sent) == 1 and sent[0].count("summary of 2 reports") == 3
+    report = json.loads(next((tmp_path / "reports" / "Host_Test" / "daily").rglob("*.json")).read_text())
+    assert report["reduce_tree"]["cache_hits"] == 3 and report["reduce_tree"]["fan_in"] == [2]
+
+
+def test_stage_n_cursor_consumes_each_report_once(tmp_path, isolated_state):
+    """Moi lan chay Stage N lay batch bao cao chua tieu thu tiep theo; buffer = so bao cao con lai sau cursor."""
+    host_conf, sys_conf = _make_configs(tmp_path, tmp_path / "filter.log", [_stage0()])
+    report_dir = tmp_path / "reports" / "Host_Test" / "periodic" / "2024-01-01"
+    report_dir.mkdir(parents=True)
+    for i in range(5):
+        path = report_dir / f"r{i}.json"
+        path.write_text(json.dumps({
+            "report_type": "Periodic", "analysis_start_time": f"2024-01-01T0{i}:00:00", "analysis_end_time": f"2024-01-01T0{i}:59:00",
+            "analysis_details_markdown": f"report {i}",
+        }))
+        os.utime(path, (1700000000 + i, 1700000000 + i))
+    stage = {"name": "Daily", "model": "m", "prompt_file": "summary_prompt_template.md", "trigger_threshold": 2}
+
+    sent = []
+    with patch("modules.gemini_analyzer.analyze_with_gemini", side_effect=lambda h, c, *a, **k: sent.append(c) or "ok"):
+        assert main.run_pipeline_stage_n(host_conf, "Host_Test", 1, stage, _stage0(), "dummy-key", sys_conf) is True
+        assert main.run_pipeline_stage_n(host_conf, "Host_Test", 1, stage, _stage0(), "dummy-key", sys_conf) is True
+        assert main.run_pipeline_stage_n(host_conf, "Host_Test", 1, stage, _stage0(), "dummy-key", sys_conf) is False
+
+    assert [re.findall(r"report (\d)", c) for c in sent] == [["0", "1"], ["2", "3"]]
+    cursor = state_manager.get_stage_cursor("Host_Test", 1)
+    assert cursor["consumed_total"] == 4 and cursor["last_batch"] == [os.path.join("Host_Test", "periodic", "2024-01-01", f"r{i}.json") for i in (2, 3)]
+    pending, _ = main._pending_stage_reports(str(tmp_path / "reports"), "Host_Test", 1, _stage0())
+    assert [p["rel_path"].rsplit(os.sep, 1)[1] for p in pending] == ["r4.json"]
+
+
+def test_stage_n_buffer_counts_one_report_per_stage0_cycle(tmp_path, isolated_state):
+    """Chu ky Stage 0 nhieu chunk luu ca bao cao tung chunk lan Reduce: buffer Stage 1 chi tang 1."""
+    log_path = tmp_path / "filter.log"
+    _write_log(log_path, 25)
+    daily = {"name": "Daily", "model": "m", "prompt_file": "summary_prompt_template.md", "trigger_threshold": 10}
+    host_conf, sys_conf = _make_configs(tmp_path, log_path, [_stage0(substages=0), daily], chunk_size=50,
+                                        extra_host={"chunk_token_budget": "100"})
+
+    with patch("modules.gemini_analyzer.analyze_with_gemini", return_value='```json\n{"stat_1_value": 1}\n```\nok'):
+        main.process_host_pipeline(host_conf, "Host_Test", sys_conf)
+
+    chunk_reports = list((tmp_path / "reports" / "Host_Test" / "periodic").rglob("*.json"))
+    assert len(chunk_reports) >= 2
+    assert state_manager.get_stage_buffer_count("Host_Test", 1) == 1
+    pending, _ = main._pending_stage_reports(str(tmp_path / "reports"), "Host_Test", 1, _stage0(substages=0))
+    assert [p["report_type"] for p in pending] == ["Periodic_Reduce"]
+
+
+def test_failed_single_chunk_run_does_not_fill_stage_n_buffer(tmp_path, isolated_state):
+    """Stage 0 1 chunk bi loi van luu bao cao worker (status = failed) nhung khong tinh vao buffer Stage 1."""
+    log_path = tmp_path / "filter.log"
+    _write_log(log_path, 5)
+    daily = {"name": "Daily", "model": "m", "prompt_file": "summary_prompt_template.md", "trigger_threshold": 10}
+    host_conf, sys_conf = _make_configs(tmp_path, log_path, [_stage0(substages=0), daily])
+
+    with patch("modules.gemini_analyzer.analyze_with_gemini", return_value="Fatal Gemini Error: 500"), patch("main.time.sleep"):
+        main.process_host_pipeline(host_conf, "Host_Test", sys_conf)
+
+    reports = [json.loads(p.read_text()) for p in (tmp_path / "reports" / "Host_Test" / "periodic").rglob("*.json")]
+    assert [r["status"] for r in reports] == ["failed"]
+    assert state_manager.get_stage_buffer_count("Host_Test", 1) == 0
+    pending, _ = main._pending_stage_reports(str(tmp_path / "reports"), "Host_Test", 1, _stage0(substages=0))
+    assert pending == []
+
+
+def test_stage_n_cursor_seeded_from_legacy_buffer_count(tmp_path, isolated_state):
+    """Nang cap tu ban dem buffer_count: lan dau chi giu N bao cao moi nhat, khong tong hop lai lich su."""
+    report_dir = tmp_path / "reports" / "Host_Test" / "periodic" / "2024-01-01"
+    report_dir.mkdir(parents=True)
+    for i in range(5):
+        path = report_dir / f"r{i}.json"
+        path.write_text(json.dumps({
+            "report_type": "Periodic", "analysis_start_time": f"2024-01-01T0{i}:00:00", "analysis_end_time": f"2024-01-01T0{i}:59:00",
+        }))
+        os.utime(path, (1700000000 + i, 1700000000 + i))
+    state_manager.save_stage_buffer_count("Host_Test", 1, 2)
+
+    pending, cursor = main._pending_stage_reports(str(tmp_path / "reports"), "Host_Test", 1, _stage0())
+    assert [p["rel_path"].rsplit(os.sep, 1)[1] for p in pending] == ["r3.json", "r4.json"]
+    saved = state_manager.get_stage_cursor("Host_Test", 1)
+    assert saved == cursor and saved["rel_path"] == os.path.join("Host_Test", "periodic", "2024-01-01", "r2.json")
+    pending, _ = main._pending_stage_reports(str(tmp_path / "reports"), "Host_Test", 1, _stage0())
+    assert [p["rel_path"].rsplit(os.sep, 1)[1] for p in pending] == ["r3.json", "r4.json"]
+
+
+def test_stage0_async_engine_keeps_many_chunks_in_flight(tmp_path, isolated_state):
+    """analysis_engine = async: chunk chay tren event loop dung chung, so request dong thoi > so thread mac dinh."""
+    log_path = tmp_path / "filter.log"
+    _write_log(log_path, 40)
+    host_conf, sys_conf = _make_configs(
+        tmp_path, log_path, [_stage0(substages=0)], chunk_size=100,
+        extra_host={"chunk_token_budget": "25", "max_concurrency": "50"}, extra_system={"analysis_engine": "async"}
+    )
+
+    sent = []
+    state = {"active": 0, "peak": 0}
+
+    async def fake_gemini_async(host_id, content, *args, **kwargs):
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        await asyncio.sleep(0.2)
+        state["active"] -= 1
+        sent.append(content)
+        return '```json\n{"stat_1_value": 1}\n```\nok'
+
+    with patch("modules.gemini_analyzer.analyze_with_gemini_async", side_effect=fake_gemini_async), \
+         patch("modules.gemini_analyzer.analyze_with_gemini", return_value='```json\n{"stat_1_value": 1}\n```\nreduced'):
+        assert main.run_pipeline_stage_0(host_conf, "Host_Test", _stage0(substages=0), "dummy-key", sys_conf) is True
+
+    assert len(sent) == 20
+    assert state["peak"] > main.DEFAULT_MAX_CONCURRENCY
+    reports = [json.loads(p.read_text()) for p in (tmp_path / "reports").rglob("*.json")]
+    reduce_report = [r for r in reports if r["report_type"] == "Periodic_Reduce"][0]
+    assert reduce_report["analysis_engine"] == "async"
+    assert reduce_report["async_engine"]["peak_in_flight"] >= state["peak"]
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import concurrent.futures
+
+from modules import rate_limiter
+from modules import state_manager
+
+
+class FakeClock:
+    """Dong ho gia: sleep() chi tang thoi gian, test khong phai cho that."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.lock = threading.Lock()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.now += seconds
+
+
+def _limits(tmp_path, line):
+    ini = tmp_path / "model_list.ini"
+    ini.write_text(f"[RateLimits]\n{line}\n")
+    return str(ini)
+
+
+def test_requests_queue_for_slot_instead_of_colliding(tmp_path, isolated_state):
+    path = _limits(tmp_path, "m1 = 2, 0\nm2 = 0, 1000")
+    clock = FakeClock()
+
+    def take(tokens=0, key="key-1", model="m1"):
+        return rate_limiter.acquire(key, model, tokens, "Profile: a", path=path, clock=clock.time, sleep=clock.sleep)
+
+    assert take() == 0 and take() == 0
+    # // Bucket 2 request/phut da het: request thu 3 cho 30s (1 request duoc nap lai)
+    assert take() == 30
+    # // Key khac -> bucket rieng
+    assert take(key="key-2") == 0
+    # // TPM: con 100 token, can 400 -> cho 300 * 60 / 1000 = 18s
+    assert take(tokens=900, model="m2") == 0
+    assert take(tokens=400, model="m2") == 18
+
+    metrics = state_manager.get_rate_limits()["metrics"]["Profile: a"]
+    assert metrics["m1"]["calls"] == 4 and metrics["m1"]["queued_calls"] == 1
+    assert metrics["m1"]["max_wait_seconds"] == 30
+    assert metrics["m2"]["total_wait_seconds"] == 18
+
+
+def test_penalize_drains_bucket_and_unlimited_models_pass(tmp_path, isolated_state):
+    path = _limits(tmp_path, "m1 = 60, 0")
+    clock = FakeClock()
+
+    assert rate_limiter.acquire("k", "m1", 10**6, path=path, clock=clock.time, sleep=clock.sleep) == 0
+    assert rate_limiter.penalize("k", "m1", path=path, clock=clock.time)
+    assert rate_limiter.acquire("k", "m1", path=path, clock=clock.time, sleep=clock.sleep) == 1
+
+    # // Model khong co trong [RateLimits]: khong gioi han, khong ghi state
+    assert rate_limiter.acquire("k", "other", path=path) == 0
+    assert not rate_limiter.penalize("k", "other", path=path)
+    assert "other" not in str(state_manager.get_rate_limits())
+
+
+def test_acquire_async_waits_on_loop_without_holding_threads(tmp_path, isolated_state):
+    """Cho slot bang asyncio.sleep: executor 1 thread van phuc vu request khac trong luc 1 task dang cho."""
+    path = _limits(tmp_path, "m1 = 1, 0")
+    clock = FakeClock()
+    order = []
+
+    async def fake_sleep(seconds):
+        clock.sleep(seconds)
+        await asyncio.sleep(0.05)
+
+    async def take(name, key):
+        waited = await rate_limiter.acquire_async(key, "m1", path=path, clock=clock.time, sleep=fake_sleep)
+        order.append(name)
+        return waited
+
+    async def main():
+        asyncio.get_running_loop().set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=1))
+        assert await take("first", "key-1") == 0
+        waiting = asyncio.create_task(take("queued", "key-1"))
+        await asyncio.sleep(0.01)
+        # // key-2: bucket rieng, khong bi task dang cho cua key-1 chan
+        assert await take("other", "key-2") == 0
+        return await waiting
+
+    assert asyncio.run(main()) >= 60
+    assert order == ["first", "other", "queued"]
+    assert rate_limiter.try_acquire("key-3", "other-model", path=path) == 0
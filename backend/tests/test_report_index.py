@@ -0,0 +1,29 @@
+import json
+import threading
+
+from modules import report_generator, report_index
+
+
+def test_index_covers_existing_tree_and_concurrent_writers(tmp_path):
+    """Cay bao cao cu duoc build vao index lan dau; nhieu thread luu bao cao cung luc khong mat dong; rebuild bo file da xoa."""
+    base = tmp_path / "reports"
+    legacy = base / "Host_A" / "periodic" / "2024-01-01"
+    legacy.mkdir(parents=True)
+    for i in range(2):
+        (legacy / f"0{i}-00-00.json").write_text(json.dumps({"report_type": "Periodic", "stage_index": 0, "summary_stats": {"raw_log_count": 5}}))
+
+    def save(i):
+        report_generator.save_structured_report("Host_A", {"stage_index": 0, "raw_log_count": 10, "summary_stats": {}}, "UTC", str(base), f"Stage {i}")
+
+    threads = [threading.Thread(target=save, args=(i,)) for i in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    reports = report_index.query_reports(str(base), host="Host_A")
+    assert len(reports) == 10
+    assert report_index.total_raw_log_count(str(base)) == 2 * 5 + 8 * 10
+    assert [r["report_type"] for r in report_index.query_reports(str(base), stage_slugs=["stage_3"])] == ["Stage 3"]
+
+    (legacy / "00-00-00.json").unlink()
+    assert report_index.rebuild(str(base)) == 9
+    assert report_index.total_raw_log_count(str(base)) == 5 + 8 * 10
@@ -1,7 +1,7 @@
 
 import pytest
 import os
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from unittest.mock import patch, MagicMock
 from modules.gemini_analyzer import analyze_with_gemini
 from modules.log_reader import read_new_log_entries, MAX_LOG_LINES_PER_RUN
@@ -10,7 +10,7 @@ from google.api_core import exceptions as google_exceptions
 # Import hàm run_pipeline_stage_0 để test integration logic
 from main import run_pipeline_stage_0
 
-def test_gemini_infinite_retry_prevention(tmp_path): 
+def test_gemini_infinite_retry_prevention(tmp_path, isolated_state):
     """
     Đảm bảo hệ thống không retry vô tận gây treo tiến trình nếu Google sập hẳn.
     """
@@ -48,47 +48,52 @@ def test_log_reader_memory_limit(temp_test_env):
     assert len(actual_log_lines) <= limit
     assert f"Line {total_lines-1}" in content
 
-def test_data_integrity_on_ai_failure(temp_test_env):
+def test_data_integrity_on_ai_failure(temp_test_env, isolated_state):
     """
     CRITICAL: Test Transactional Logic.
-    Nếu AI Analysis thất bại, timestamp KHÔNG được cập nhật vào state file.
+    Nếu AI Analysis thất bại, timestamp và checkpoint đọc log KHÔNG được cập nhật vào state file.
     Lần chạy sau phải quét lại đúng đoạn log đó.
     """
     host_id = "Host_Integrity_Test"
     log_file = os.path.join(temp_test_env['root'], "test.log")
     
-    # 1. Tạo log giả
+    # 1. Tạo log thật (trong cửa sổ HoursToAnalyze) để Stage 0 đọc qua open_log_stream
+    recent = (datetime.now(timezone.utc) - timedelta(minutes=10)).strftime('%Y-%m-%d %H:%M:%S')
     with open(log_file, 'w') as f:
-        f.write("2025 Jan 01 10:00:00 pfsense filterlog: critical packet\n")
+        f.write(f"{recent} pfsense filterlog: critical packet\n")
 
-    # 2. Mock Config object
+    # 2. Mock Config object (giá trị tường minh: tắt template mining / local stats)
     mock_config = MagicMock()
     mock_config.get.side_effect = lambda section, key, fallback=None: {
         'LogFile': log_file,
         'SysHostname': 'TestHost',
         'TimeZone': 'UTC'
     }.get(key, fallback)
-    mock_config.getint.return_value = 24
+    mock_config.getint.side_effect = lambda section, key, fallback=None: {'HoursToAnalyze': 24, 'chunk_size': 100}.get(key, fallback)
+    mock_config.getboolean.return_value = False
+    mock_config.has_option.return_value = False
 
     mock_sys_settings = MagicMock()
-    mock_sys_settings.get.return_value = str(temp_test_env['report_dir'])
+    mock_sys_settings.get.side_effect = lambda section, key, fallback=None: {
+        'report_directory': str(temp_test_env['report_dir'])
+    }.get(key, fallback)
+    mock_sys_settings.getint.side_effect = lambda section, key, fallback=None: fallback
+    mock_sys_settings.getboolean.side_effect = lambda section, key, fallback=None: fallback
 
-    # 3. Mock log_reader để trả về dữ liệu như thật
-    # Return: (content, start, end, count, NEW_TIMESTAMP)
-    mock_read_return = ("log content", datetime.now(), datetime.now(), 1, datetime(2025, 12, 31))
-    
-    with patch('modules.log_reader.read_new_log_entries', return_value=mock_read_return):
-        # 4. Mock Gemini failure
-        with patch('modules.gemini_analyzer.analyze_with_gemini', return_value="Fatal Gemini Error"):
-            
-            # 5. Run Pipeline
-            success = run_pipeline_stage_0(mock_config, host_id, {}, "key", mock_sys_settings, test_mode=True)
-            
-            # Assert Pipeline bao fail
-            assert success is False
-            
-            # 6. Assert State File KHÔNG tồn tại hoặc KHÔNG cập nhật
-            # Vì đây là lần chạy đầu tiên trong env test, file không nên được tạo ra
-            state_path = state_manager._get_state_file_path(f"last_run_timestamp_{host_id}", test_mode=True)
-            assert not os.path.exists(state_path), "State file should not be created on failure"
+    stage_config = {"name": "Periodic", "model": "m", "prompt_file": "prompt.md"}
+
+    # 3. Mock Gemini failure
+    with patch('modules.gemini_analyzer.analyze_with_gemini', return_value="Fatal Gemini Error") as mock_ai, \
+         patch('main.time.sleep'):
+        # 4. Run Pipeline
+        # Chạy chế độ production (state đã cô lập): test_mode đọc toàn bộ file, không dùng checkpoint
+        success = run_pipeline_stage_0(mock_config, host_id, stage_config, "key", mock_sys_settings, test_mode=False)
+
+    # Assert log đã thực sự được đọc và gửi cho AI, pipeline báo fail
+    assert mock_ai.called
+    assert "critical packet" in mock_ai.call_args.args[1]
+    assert success is False
 
+    # 5. Assert State KHÔNG được commit: không timestamp, không checkpoint
+    assert state_manager.get_last_run_timestamp(host_id) is None
+    assert state_manager.get_log_checkpoint(host_id) is None
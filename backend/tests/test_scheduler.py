@@ -0,0 +1,83 @@
+import time
+import threading
+
+from modules import scheduler, state_manager
+
+
+def test_slow_host_does_not_delay_others_and_lateness_recorded(isolated_state):
+    """Host cham (ket retry) khong chan host khac; moi host toi da 1 lan chay cung luc; do tre duoc ghi."""
+    runs = {"Host_Slow": 0, "Host_Fast": 0}
+    active, overlap = set(), []
+    lock = threading.Lock()
+
+    def run_host(host):
+        with lock:
+            if host in active: overlap.append(host)
+            active.add(host)
+            runs[host] += 1
+        time.sleep(0.6 if host == "Host_Slow" else 0.01)
+        with lock:
+            active.discard(host)
+
+    def next_due(host, now, after_run):
+        return now + 0.05 if after_run else now - 2
+
+    sched = scheduler.HostScheduler(max_workers=2)
+    sched.sync(["Host_Slow", "Host_Fast"], next_due)
+    deadline = time.time() + 0.5
+    while time.time() < deadline:
+        sched.dispatch(run_host, next_due)
+        sched.wait(max_idle=0.1)
+    sched.shutdown()
+
+    assert runs["Host_Slow"] == 1 and runs["Host_Fast"] >= 3
+    assert not overlap
+    metrics = state_manager.get_scheduler_metrics()
+    assert metrics["Host_Slow"]["max_lateness_seconds"] >= 2
+    assert metrics["Host_Fast"]["runs"] == runs["Host_Fast"] and metrics["Host_Fast"]["lateness_seconds"] < 1
+
+
+def test_reschedule_replaces_pending_due(isolated_state):
+    """Config host doi -> han moi thay han cu trong heap (muc cu bi bo qua)."""
+    dues = {"Host_A": time.time() + 3600}
+    next_due = lambda host, now, after_run: dues[host]
+    ran = []
+    sched = scheduler.HostScheduler(max_workers=1)
+    sched.sync(["Host_A"], next_due)
+    assert sched.dispatch(ran.append, next_due) == []
+
+    dues["Host_A"] = time.time() - 1
+    sched.reschedule({"Host_A", "Host_Removed"}, next_due)
+    assert sched.dispatch(ran.append, next_due) == ["Host_A"]
+    sched.shutdown()
+    assert ran == ["Host_A"] and sched.seconds_until_next(max_idle=5) <= 5
+
+
+def test_lateness_includes_wait_for_pool_slot_and_resize(isolated_state):
+    """Do tre tinh luc host bat dau that (gom thoi gian cho slot); resize pool khi doi scheduler_max_parallel_hosts."""
+    due_at = time.time()
+    next_due = lambda host, now, after_run: now + 3600 if after_run else due_at
+    sched = scheduler.HostScheduler(max_workers=1)
+    sched.sync(["Host_A", "Host_B"], next_due)
+    assert sorted(sched.dispatch(lambda host: time.sleep(0.4), next_due)) == ["Host_A", "Host_B"]
+    sched.shutdown()
+    lateness = sorted(m["lateness_seconds"] for m in state_manager.get_scheduler_metrics().values())
+    assert lateness[0] < 0.3 and lateness[1] >= 0.35
+
+    active, peak = set(), []
+    lock = threading.Lock()
+
+    def run_host(host):
+        with lock:
+            active.add(host)
+            peak.append(len(active))
+        time.sleep(0.3)
+        with lock:
+            active.discard(host)
+
+    sched = scheduler.HostScheduler(max_workers=1)
+    sched.resize(2)
+    sched.sync(["Host_C", "Host_D"], next_due)
+    sched.dispatch(run_host, next_due)
+    sched.shutdown()
+    assert sched.max_workers == 2 and max(peak) == 2
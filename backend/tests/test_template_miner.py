@@ -0,0 +1,24 @@
+from modules import template_miner
+
+
+def _filterlog(i):
+    return (f"Oct 16 10:00:{i % 60:02d} pfsense filterlog[{4700 + i % 7}]: 5,,,1000000103,igb1,match,block,in,4,0x0,,64,0,0,DF,6,tcp,60,"
+            f"203.0.113.{i % 5 + 1},10.0.0.5,{40000 + i},443,0,S,1234567890,,64240,,mss")
+
+
+def test_template_miner_groups_lines_and_persists():
+    """Dong chi khac IP/port/pid gom ve 1 template; state nap lai van khop template cu."""
+    miner = template_miner.TemplateMiner()
+    lines = [_filterlog(i) for i in range(300)] + [f"Oct 16 10:01:00 pfsense sshd[{i}]: Failed password for root from 198.51.100.{i} port 22 ssh2" for i in range(20)]
+    chunk = "\n".join(lines) + "\n\n!!! WARNING: Con khoang 5 dong log (0.0 MB) chua xu ly trong dot nay. !!!\n"
+
+    text, templates = template_miner.compress_chunk(miner, chunk)
+    assert templates == 2 and len(miner.clusters) == 2
+    assert len(chunk) / len(text) > 10
+    assert "x300 | Oct 16 <*> pfsense <*> 5,,,1000000103,igb1,match,block" in text
+    assert "203.0.113.1(60)" in text
+    assert text.rstrip().endswith("chua xu ly trong dot nay. !!!")
+
+    restored = template_miner.TemplateMiner.from_state(miner.to_state())
+    cluster, _ = restored.add_line(_filterlog(999))
+    assert cluster.cluster_id in miner.clusters and len(restored.clusters) == 2
@@ -0,0 +1,49 @@
+import os
+import pytz
+import pytest
+
+from modules import token_budget, log_formats
+
+
+def test_token_chunks_respect_budget_and_keep_multiline_events(tmp_path):
+    """Chunk xep theo token uoc tinh; stack trace di cung dong co timestamp; canh bao backlog o chunk cuoi."""
+    ini = tmp_path / "model_list.ini"
+    ini.write_text("[GeminiModels]\nDefault = m1\n\n[TokenCalibration]\nm1 = 2.0\nbad = x\n")
+    assert token_budget.load_calibration(str(ini)) == {"m1": 2.0}
+    estimator = token_budget.TokenEstimator("m1", calibration=token_budget.load_calibration(str(ini)))
+    assert estimator.estimate("x" * 10) == 5
+    assert token_budget.TokenEstimator("other", calibration={}).chars_per_token == token_budget.DEFAULT_CHARS_PER_TOKEN
+
+    lines = [f"2025-10-16 10:00:{i:02d} app: request {i} ok\n" for i in range(10)]
+    trace = ["2025-10-16 10:00:10 app: ERROR boom\n", "Traceback (most recent call last):\n",
+             '  File "app.py", line 1, in <module>\n', "ValueError: boom\n"]
+    warning = "\n!!! WARNING: Con khoang 5 dong log (0.0 MB) chua xu ly trong dot nay. !!!\n"
+    parser = log_formats.make_parser("iso8601", pytz.UTC)
+
+    chunks = list(token_budget.iter_token_chunks(lines[:5] + trace + lines[5:] + [warning], 60, estimator, parser))
+    assert all(planned <= 60 for chunk, planned in chunks if "Traceback" not in chunk)
+    assert sum(chunk.count("app:") for chunk, _ in chunks) == 11
+    assert [c for c, _ in chunks if "Traceback" in c][0].count("ValueError: boom") == 1
+    assert [c for c, _ in chunks if "ERROR boom" in c][0] == [c for c, _ in chunks if "ValueError" in c][0]
+    assert "!!! WARNING" in chunks[-1][0] and len(chunks) > 3
+
+    hooked = token_budget.TokenEstimator("m1", chars_per_token=2.0, count_tokens=lambda text: 7)
+    assert hooked.count("abc") == 7 and hooked.estimate("abcd") == 2
+    # // Xep chunk theo uoc tinh, so token bao cao cua chunk lay tu hook
+    hooked_chunks = list(token_budget.iter_token_chunks(lines, 60, hooked, parser))
+    assert [c for c, _ in hooked_chunks] == [c for c, _ in token_budget.iter_token_chunks(lines, 60, estimator, parser)]
+    assert all(planned == 7 for _, planned in hooked_chunks)
+
+
+def test_calibration_cached_until_file_changes(tmp_path, monkeypatch):
+    ini = tmp_path / "model_list.ini"
+    ini.write_text("[TokenCalibration]\nm1 = 2.0\n")
+    first = token_budget.load_calibration(str(ini))
+    monkeypatch.setattr(token_budget.configparser, "ConfigParser", lambda: pytest.fail("phai dung cache"))
+    assert token_budget.load_calibration(str(ini)) is first
+    monkeypatch.undo()
+
+    ini.write_text("[TokenCalibration]\nm1 = 3.0\n")
+    os.utime(ini, (ini.stat().st_mtime + 5, ini.stat().st_mtime + 5))
+    assert token_budget.load_calibration(str(ini)) == {"m1": 3.0}
+    assert token_budget.load_calibration(str(tmp_path / "missing.ini")) == {}
@@ -0,0 +1,21 @@
+import threading
+
+from modules import tree_reduce, state_manager
+
+
+def test_plan_groups_packs_by_budget_and_always_shrinks():
+    """Nhom cac phan lien tiep theo budget; moi phan qua lon -> van ghep tung cap."""
+    assert tree_reduce.plan_groups([100, 100, 100, 100, 100], 300) == [[0, 1, 2], [3, 4]]
+    assert tree_reduce.plan_groups([100, 250, 40], 300) == [[0], [1, 2]]
+    assert tree_reduce.plan_groups([500, 500, 500], 300) == [[0, 1], [2]]
+
+
+def test_reduce_cache_keeps_concurrent_saves(isolated_state):
+    """Cac nhom reduce song song cung ghi cache: khong mat muc nao (read-modify-write duoi file lock)."""
+    threads = [threading.Thread(target=state_manager.save_reduce_cache, args=("Host_A", f"k{i}", f"r{i}"))
+               for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert all(state_manager.get_reduce_cache("Host_A", f"k{i}") == f"r{i}" for i in range(20))
@@ -0,0 +1,56 @@
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from modules import upload_cache
+
+
+class FakeFileAPI:
+    """File API gia lap cuc bo: upload_file / get_file / delete_file giong genai."""
+
+    def __init__(self, ttl=timedelta(hours=48)):
+        self.files = {}
+        self.uploads = 0
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+    def upload_file(self, path):
+        time.sleep(0.05)
+        with self.lock:
+            self.uploads += 1
+            name = f"files/{self.uploads}"
+        self.files[name] = SimpleNamespace(
+            name=name, uri=f"https://fake/{name}", mime_type="application/pdf", display_name="doc.pdf",
+            state=SimpleNamespace(name="ACTIVE"), expiration_time=datetime.now(timezone.utc) + self.ttl)
+        return self.files[name]
+
+    def get_file(self, name):
+        if name not in self.files:
+            raise LookupError(f"{name} not found")
+        return self.files[name]
+
+
+def test_upload_shared_per_content_and_key_and_renewed_when_gone(tmp_path, isolated_state, monkeypatch):
+    """5 worker cung luc -> 1 upload; key khac -> upload rieng; file bi xoa / sap het han -> upload lai."""
+    pdf = tmp_path / "doc.pdf"
+    pdf.write_bytes(b"%PDF" + b"x" * 4096)
+    api = FakeFileAPI()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(upload_cache.get_or_upload(str(pdf), "key-1", api.upload_file, api.get_file)))
+               for _ in range(5)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert api.uploads == 1 and {r["uri"] for r in results} == {"https://fake/files/1"}
+
+    assert upload_cache.get_or_upload(str(pdf), "key-1", api.upload_file, api.get_file)["uri"] == "https://fake/files/1"
+    assert upload_cache.get_or_upload(str(pdf), "key-2", api.upload_file, api.get_file)["uri"] == "https://fake/files/2"
+
+    monkeypatch.setattr(upload_cache, "VERIFY_INTERVAL_SECONDS", 0)
+    del api.files["files/1"]
+    assert upload_cache.get_or_upload(str(pdf), "key-1", api.upload_file, api.get_file)["uri"] == "https://fake/files/3"
+
+    api.ttl = timedelta(minutes=5)
+    assert upload_cache.get_or_upload(str(pdf), "key-3", api.upload_file, api.get_file)["uri"] == "https://fake/files/4"
+    assert upload_cache.get_or_upload(str(pdf), "key-3", api.upload_file, api.get_file)["uri"] == "https://fake/files/5"
+    assert api.uploads == 5
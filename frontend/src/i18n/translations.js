@@ -133,6 +133,7 @@ export const translations = {
     settingsSaved: "Đã lưu cài đặt",
     profileName: "Tên Profile",
     apiKey: "Khóa API",
+    keyPool: "Nhóm Key (profile, cách nhau bởi dấu phẩy)",
     smtpServerAddress: "Địa Chỉ SMTP Server",
     port: "Cổng (Port)",
     senderEmail: "Email Gửi",
@@ -282,6 +283,7 @@ export const translations = {
     settingsSaved: "Settings saved",
     profileName: "Profile Name",
     apiKey: "API Key",
+    keyPool: "Key Pool (profiles, comma-separated)",
     smtpServerAddress: "SMTP Server Address",
     port: "Port",
     senderEmail: "Sender Email",
@@ -431,6 +433,7 @@ export const translations = {
     settingsSaved: "設定を保存しました",
     profileName: "プロファイル名",
     apiKey: "APIキー",
+    keyPool: "キープール（プロファイル、カンマ区切り）",
     smtpServerAddress: "SMTPサーバーアドレス",
     port: "ポート",
     senderEmail: "送信元メール",
@@ -167,6 +167,16 @@ const PipelineStageCard = React.memo(({
                         isTestMode={isTestMode}
                     />
                 </FormControl>
+
+                <FormControl gridColumn={{base: "span 1", lg: "span 2"}}>
+                    <FormLabel fontSize="xs" mb={0} color="gray.500">{t('keyPool')} (Optional)</FormLabel>
+                    <Input
+                        size="xs"
+                        placeholder="profile_a, profile_b"
+                        value={stage.key_pool || ''}
+                        onChange={(e) => onUpdateStage(idx, 'key_pool', e.target.value)}
+                    />
+                </FormControl>
             </SimpleGrid>
             
 
@@ -82,6 +82,13 @@ const SettingsPage = () => {
     active_smtp_profile: '',
     attach_context_files: false,
     scheduler_check_interval_seconds: 60,
+    scheduler_max_parallel_hosts: 4,
+    backlog_max_batches_per_cycle: 5,
+    backlog_max_api_calls_per_cycle: 0,
+    backlog_max_tokens_per_cycle: 0,
+    max_concurrent_requests: 0,
+    reduce_token_budget: 200000,
+    analysis_engine: 'thread',
     gemini_profiles: {}
   });
   
@@ -116,6 +123,13 @@ const SettingsPage = () => {
         active_smtp_profile: data.active_smtp_profile || '',
         attach_context_files: data.attach_context_files || false,
         scheduler_check_interval_seconds: data.scheduler_check_interval_seconds || 60,
+        scheduler_max_parallel_hosts: data.scheduler_max_parallel_hosts || 4,
+        backlog_max_batches_per_cycle: data.backlog_max_batches_per_cycle || 5,
+        backlog_max_api_calls_per_cycle: data.backlog_max_api_calls_per_cycle || 0,
+        backlog_max_tokens_per_cycle: data.backlog_max_tokens_per_cycle || 0,
+        max_concurrent_requests: data.max_concurrent_requests || 0,
+        reduce_token_budget: data.reduce_token_budget || 200000,
+        analysis_engine: data.analysis_engine || 'thread',
         gemini_profiles: data.gemini_profiles || {}
       };
       setSettings(newSettings);